@@ -19,6 +19,9 @@ import sys
 debug=False
 usegzip=True
 uselz4=True
+usemmap=True
+#zstd support requires the zstd library and headers (libzstd-dev), enable it by setting USE_ZSTD in the environment
+usezstd="USE_ZSTD" in os.environ
 
 extra_args=[]
 if debug:
@@ -32,6 +35,15 @@ if usegzip:
 if uselz4:
     extra_args.append("-DUSE_LZ4")
 
+if usemmap:
+    #memory mapped reading of uncompressed files (POSIX only)
+    extra_args.append("-DUSE_MMAP")
+
+if usezstd:
+    extra_args.append("-DUSE_ZSTD")
+    extra_args.append("-lzstd")
+    extra_args.append("-pthread")
+
 
 
 #don't necessarily cythonize on the fly
@@ -51,8 +63,14 @@ def listexts():
     for csrc in ["nmea.c","stream.c","gnssrlib.c"]:
         sources.append(f"{srcd}/src/{csrc}")
     
+    if usegzip:
+        sources.append(f"{srcd}/src/gzstream.c")
+    
+    if usezstd:
+        sources.append(f"{srcd}/src/zstdstream.c")
+    
     if uselz4:
-        for csrc in ["lz4stream.c","lz4static/lz4file.c","lz4static/lz4.c","lz4static/lz4hc.c","lz4static/xxhash.c","lz4static/lz4frame.c"]:
+        for csrc in ["lz4stream.c","lz4static/lz4.c","lz4static/lz4hc.c","lz4static/xxhash.c","lz4static/lz4frame.c"]:
             sources.append(f"{srcd}/src/{csrc}")
 
     exts.append(Extension(f"gnssr4water.gnssrlib",sources,include_dirs=[np.get_include(),"."], define_macros=[('NPY_NO_DEPRECATED_API', 'NPY_1_7_API_VERSION')],extra_compile_args=extra_args,extra_link_args=extra_args))
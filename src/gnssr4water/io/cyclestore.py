@@ -0,0 +1,163 @@
+# This file is part of gnssr4water
+# gnssr4water is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# gnssr4water is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with gnssr4water if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2025
+import os
+import glob
+import numpy as np
+import xarray as xr
+from gnssr4water.core.logger import log
+from gnssr4water.gnssrlib import iter_cycles,concatenate_batches,_to_epoch
+
+NSPERDAY=86400*1000000000
+
+#per cycle and per satellite columns of a batch (see NMEAFile.readbatch) and the dtypes used on disk
+cyclecols={"lat":np.float64,"lon":np.float64,"ortho_height":np.float32,"geoid_height":np.float32}
+satcols={"prn":np.int16,"system":np.int8,"elevation":np.float32,"azimuth":np.float32,"cnr0":np.float32}
+maskedcols={"masked_prn":np.int16,"masked_pos":np.int16}
+
+
+def _slice_batch(batch,i0,i1):
+    """Extract the cycles [i0,i1) of a columnar batch"""
+    sliced={}
+    for offky,cols in (("offset",satcols),("masked_offset",maskedcols)):
+        if offky not in batch:
+            continue
+        offset=batch[offky]
+        s0,s1=offset[i0],offset[i1]
+        sliced[offky]=offset[i0:i1+1]-s0
+        for ky in cols:
+            sliced[ky]=batch[ky][s0:s1]
+    sliced["epoch"]=batch["epoch"][i0:i1]
+    for ky in cyclecols:
+        sliced[ky]=batch[ky][i0:i1]
+    return sliced
+
+
+class CycleStore:
+    """
+    Compact binary store of decoded nmea cycles, so that logs only need to be parsed once
+    The cycles are stored as columnar, chunked and compressed zarr datasets, one per UTC day (YYYY-MM-DD.zarr), with a 'time' dimension for the epoch, receiver position and the amount of satellites per cycle, and a 'sat' dimension for the prn, system code, elevation, azimuth and cnr0 of the satellites in view.
+    The store can be used as a stream for SatArcBuilder (see readcycles)
+    """
+    def __init__(self,storepath,start=None,end=None,chunksize=262144):
+        self.storepath=storepath
+        self.chunksize=chunksize
+        self.start=start
+        self.end=end
+        os.makedirs(storepath,exist_ok=True)
+
+    def dayfile(self,day):
+        return os.path.join(self.storepath,f"{np.datetime64(day,'D')}.zarr")
+
+    def days(self):
+        """Return the days which are available in the store"""
+        return [np.datetime64(os.path.basename(path)[:-5],"D") for path in sorted(glob.glob(os.path.join(self.storepath,"????-??-??.zarr")))]
+
+    def write(self,source):
+        """Convert decoded cycles to the store
+            Note: days which are present in the source replace those in the store, so the source should hold complete days
+
+            Parameters
+            ----------
+            source : NMEAFile, NMEAFileStream or iterable
+                Source of the cycles, objects with a readbatches method (e.g. NMEAFile, NMEAFileStream), or an iterable of columnar batches in chronological order
+
+            Returns
+            -------
+            list of numpy.datetime64
+                Days which were written
+        """
+        if hasattr(source,"readbatches"):
+            batches=source.readbatches()
+        else:
+            batches=source
+        written=[]
+        daybatches=[]
+        currentday=None
+        for batch in batches:
+            if batch is None or len(batch["epoch"]) == 0:
+                continue
+            days=batch["epoch"]//NSPERDAY
+            #split the batch at day boundaries
+            seams=np.flatnonzero(np.diff(days))+1
+            for i0,i1 in zip(np.concatenate([[0],seams]),np.concatenate([seams,[len(days)]])):
+                if days[i0] != currentday:
+                    if currentday is not None:
+                        if days[i0] < currentday:
+                            raise ValueError("Cycles must be provided in chronological order")
+                        written.append(self.writeday(currentday,concatenate_batches(daybatches)))
+                    currentday=days[i0]
+                    daybatches=[]
+                daybatches.append(_slice_batch(batch,i0,i1))
+        if currentday is not None:
+            written.append(self.writeday(currentday,concatenate_batches(daybatches)))
+        return written
+
+    def writeday(self,day,batch):
+        """Write a columnar batch holding the cycles of a single day to the store"""
+        day=np.datetime64(int(day),"D")
+        ncyc=len(batch["epoch"])
+        data_vars={"nsats":(["time"],np.diff(batch["offset"]).astype(np.int16))}
+        for ky,dtype in cyclecols.items():
+            data_vars[ky]=(["time"],batch[ky].astype(dtype))
+        for ky,dtype in satcols.items():
+            data_vars[ky]=(["sat"],batch[ky].astype(dtype))
+        if "masked_offset" in batch and batch["masked_offset"][-1] > 0:
+            #satellites which were rejected by a sky mask while decoding
+            data_vars["nmasked"]=(["time"],np.diff(batch["masked_offset"]).astype(np.int16))
+            for ky,dtype in maskedcols.items():
+                data_vars[ky]=(["masked"],batch[ky].astype(dtype))
+        ds=xr.Dataset(data_vars=data_vars,coords={"time":batch["epoch"].view("datetime64[ns]")})
+        encoding={ky:{"chunks":(self.chunksize,)} for ky in ds.variables}
+        encoding["time"]["units"]="nanoseconds since 1970-01-01"
+        encoding["time"]["dtype"]=np.int64
+        log.info(f"Writing {ncyc} cycles to {self.dayfile(day)}")
+        ds.to_zarr(self.dayfile(day),mode="w",encoding=encoding,consolidated=False)
+        return day
+
+    def readday(self,day):
+        """Read the cycles of a single day from the store into a columnar batch (see NMEAFile.readbatch)"""
+        with xr.open_zarr(self.dayfile(day),consolidated=False) as ds:
+            batch={"epoch":ds.time.values.astype("datetime64[ns]").view(np.int64)}
+            batch["offset"]=np.concatenate([[0],np.cumsum(ds.nsats.values,dtype=np.int64)])
+            for ky in list(cyclecols)+list(satcols):
+                batch[ky]=ds[ky].values
+            if "nmasked" in ds:
+                batch["masked_offset"]=np.concatenate([[0],np.cumsum(ds.nmasked.values,dtype=np.int64)])
+                for ky in maskedcols:
+                    batch[ky]=ds[ky].values
+        return batch
+
+    def readbatches(self,start=None,end=None):
+        """Iterate over the cycles in the time window [start,end) (defaults to the window of the store) in columnar batches of a day"""
+        start=self.start if start is None else start
+        end=self.end if end is None else end
+        t0=_to_epoch(start) if start is not None else np.iinfo(np.int64).min
+        t1=_to_epoch(end) if end is not None else np.iinfo(np.int64).max
+        for day in self.days():
+            daystart=day.astype("datetime64[ns]").astype(np.int64)
+            if daystart+NSPERDAY <= t0 or daystart >= t1:
+                continue
+            batch=self.readday(day)
+            i0,i1=np.searchsorted(batch["epoch"],[t0,t1],side="left")
+            if i0 < i1:
+                yield _slice_batch(batch,i0,i1)
+
+    def readcycles(self,start=None,end=None):
+        """Iterate over the cycles in the time window [start,end) (see iter_cycles), e.g. to feed a SatArcBuilder"""
+        for batch in self.readbatches(start,end):
+            for nmeacycle in iter_cycles(batch):
+                yield nmeacycle
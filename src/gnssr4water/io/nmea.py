@@ -17,19 +17,21 @@
 
 
 # Imports
-import gzip as gz
 from datetime import datetime,timedelta
 import pandas as pd
 import numpy as np
-from scipy.interpolate import interp1d,UnivariateSpline
+from scipy.interpolate import UnivariateSpline
 from scipy.optimize import curve_fit
-import lz4.frame
+from numba import jit
 
 from gnssr4water.core.logger import log
 from gnssr4water.core.gnss import GPSL1,GLONASSIIL1
+import gnssr4water.gnssrlib as gnssrlib
 
 
 GNSSlookup={"GL":GLONASSIIL1,"GP":GPSL1}
+#systems belonging to the system codes of the C parser
+GNSScodes={gnssrlib.GLONASSIIL1.code:GLONASSIIL1,gnssrlib.GPSL1.code:GPSL1}
 
 ###############################################################################
 
@@ -47,6 +49,76 @@ def parseDeg(deg,EWNS):
     return swopfac[EWNS]*decdeg
 
 
+def _to_ns(timev):
+    """Convert time tags (datetime objects, numpy.datetime64 or int64 nanoseconds) to int64 nanoseconds since 1970-01-01"""
+    timev=np.asarray(timev)
+    if timev.dtype == np.int64:
+        return timev
+    return timev.astype("datetime64[ns]").view(np.int64)
+
+@jit(nopython=True,cache=True)
+def _smooth_section(degarray,degsmth,i0,i1):
+    """Interpolate linearly between the centres of the runs of equal values in the contiguous section [i0,i1) (see smoothDegrees)"""
+    n=i1-i0
+    isup=np.empty(n)
+    degsup=np.empty(n)
+    nsup=0
+    ist=i0
+    for i in range(i0+1,i1+1):
+        if i == i1 or degarray[i]-degarray[i-1] != 0:
+            if not np.isnan(degarray[ist]):
+                isup[nsup]=(ist-i0)+(i-ist)/2
+                degsup[nsup]=degarray[ist]
+                nsup+=1
+            ist=i
+    if nsup < 2:
+        #single value or all values are the same
+        degsmth[i0:i1]=degarray[i0:i1]
+        return
+    #note: same arithmetic as the (extrapolating) linear scipy interp1d
+    hi=1
+    for k in range(n):
+        x=float(k)
+        while hi < nsup-1 and isup[hi] < x:
+            hi+=1
+        lo=hi-1
+        slope=(degsup[hi]-degsup[lo])/(isup[hi]-isup[lo])
+        degsmth[i0+k]=slope*(x-isup[lo])+degsup[lo]
+
+@jit(nopython=True,cache=True)
+def _smooth_groups(degarray,timens,istart,iend):
+    degsmth=np.empty(len(degarray))
+    maxdt=30*1000000000
+    for ig in range(len(istart)):
+        #split into contigous sections (i.e. crossing  0-360 border or jumping in time)
+        ist=istart[ig]
+        for i in range(istart[ig]+1,iend[ig]+1):
+            if i == iend[ig] or abs(degarray[i]-degarray[i-1]) > 180.0 or timens[i]-timens[i-1] > maxdt:
+                _smooth_section(degarray,degsmth,ist,i)
+                ist=i
+    return degsmth
+
+def smoothDegreesBatch(degarray,timev,istart):
+    """Smooth the degree arrays of multiple PRNs (or arcs) in a single call (see smoothDegrees)
+
+        Parameters
+        ----------
+        degarray : float array
+            Concatenated degree values of the PRNs (each in chronological order)
+        timev : int64 (nanoseconds since 1970-01-01) or datetime array
+            Time tags of the degree values
+        istart : int array
+            Start index of every PRN
+
+        Returns
+        -------
+        float array
+            Smoothed degree values
+    """
+    istart=np.asarray(istart,dtype=np.int64)
+    iend=np.append(istart[1:],len(degarray))
+    return _smooth_groups(np.asarray(degarray,dtype=np.float64),_to_ns(timev),istart,iend)
+
 def smoothDegrees(degarray,timev,irec=0):
         """ Smooths degree array which only have degree resolution to a version which varies more smoothly (i.e. no jumps)"""
         
@@ -54,43 +126,51 @@ def smoothDegrees(degarray,timev,irec=0):
             #Corner case just return original value
             return degarray
 
-
-        ddif=np.diff(degarray)
-
-        if np.count_nonzero(ddif) == 0:
+        if np.count_nonzero(np.diff(degarray)) == 0:
             #no need to interpolate in this case as all values are the same
             return degarray
 
-        
-        if irec > 1:
-            assert("This function is not supposed to be called with a recursion depth more than 1)")
-            #Possibly split into contigous sections (i.e. crossing  0-360 border or jumping in time)
-        dsections=np.argwhere(np.logical_or((np.abs(ddif) > 180.0), (np.diff(timev) > np.timedelta64(30,'s'))))  
-        if dsections.size != 0:
-            degsmth=np.full([len(degarray)],np.nan)
-            for ist,iend in zip(np.insert(dsections+1,0,0),np.append(dsections+1,len(degarray))):
-                #call this function for the sections (it shouldn;t execute this if part)
-                degsmth[ist:iend]=smoothDegrees(degarray[ist:iend],timev[ist:iend],irec=irec+1)
-        else:
-            
-            #compute for the contiguous section
-            #detect the jumps (and add the first and final index) value
-            ijumps=np.insert(np.append(np.argwhere(ddif != 0).squeeze()+1,len(degarray)),0,0)
-
-            #what are half the interval lengths between the jump locations (we need to shift the interpolant input by this)
-            iintHalfDistance=np.diff(ijumps)/2
-            #create the support points for the interpolant
-            isup=ijumps[0:-1]+iintHalfDistance
-            degsup=degarray[ijumps[0:-1]]
-            inonnan=~np.isnan(degarray[ijumps[0:-1]])
-            #create an interpolant based on the values where a jump was detected
-            iinterp=interp1d(isup[inonnan],degsup[inonnan],kind='linear',fill_value="extrapolate")
-            degsmth=iinterp([float(i) for i in range(len(degarray))])
-            
+        return smoothDegreesBatch(degarray,timev,[0])
 
-            degsmth[np.isnan(degsmth)]=np.nan #refill original nan values with nans again
-        
-        return degsmth
+def _fit_subvalues(dx,dataint):
+    """Evaluate a smoothing spline through the data at the time offsets dx [s] (see resolveSubValues)"""
+    try:
+        bSplApprox = UnivariateSpline(dx, dataint)
+    except:
+        # log.warning("Cannot fit spline to Arc segment is, ignoring")
+
+        return dataint
+    return bSplApprox(dx)
+
+def resolveSubValuesBatch(time,dataint,istart):
+    """Retrieve smoothly varying degree vectors of multiple arcs in a single call (see resolveSubValues)
+
+        Parameters
+        ----------
+        time : int64 (nanoseconds since 1970-01-01) or datetime array
+            Time tags of the concatenated arcs
+        dataint : float array
+            Concatenated degrees as integer
+        istart : int array
+            Start index of every arc
+
+        Returns
+        -------
+        float array
+            Smoothly varying degree values
+    """
+    timens=_to_ns(time)
+    istart=np.asarray(istart,dtype=np.int64)
+    iend=np.append(istart[1:],len(timens))
+    datasub=np.array(dataint,dtype=np.float64)
+    nmin=4
+    for i0,i1 in zip(istart,iend):
+        if i1-i0 < nmin:
+            continue
+        #offsets in seconds with respect to the central epoch
+        dx=(timens[i0:i1]-timens[i0+(i1-i0)//2])/1e9
+        datasub[i0:i1]=_fit_subvalues(dx,dataint[i0:i1])
+    return datasub
 
 def resolveSubValues(time, dataint):
     """Retrieve a smoothly varying degree vector from a integer-truncated vector of data, based on the assumption that it varies smoothly 
@@ -98,7 +178,7 @@ def resolveSubValues(time, dataint):
         Parameters
         ----------
         time : datetime array
-            Time tags associated with the integer degree values
+            Time tags associated with the integer degree values (or int64 nanoseconds since 1970-01-01)
         dataint : float array
             Degrees as integer
 
@@ -112,32 +192,11 @@ def resolveSubValues(time, dataint):
         # log.warning(f"Arc segment is less than {nmin}, ignoring")
         return dataint
 
+    timens=_to_ns(time)
     icenter=int(len(time)/2)
+    dx=(timens-timens[icenter])/1e9
     
-    x0=time[icenter]
-    dx=[td.total_seconds() for td in time-x0]
-    
-    #first guess
-    s=len(time)*2
-    # # s=10
-    try:
-        bSplApprox = UnivariateSpline(dx, dataint)
-    except:
-        # log.warning("Cannot fit spline to Arc segment is, ignoring")
-
-        return dataint
-
-    # def smooth_trunc(x,smooth):
-        # bSplApprox.set_smoothing_factor(smooth)
-        # print(f"Trying s {smooth}")
-        # return np.floor(bSplApprox(x))
-
-    # popt,pcov,info,mesg,ier=curve_fit(smooth_trunc, dx,dataint,p0=[s],bounds=[5,len(time)],full_output=True)
-
-
-    datasub=bSplApprox(dx)
-    
-    return datasub
+    return _fit_subvalues(dx,dataint)
     # npoly=2
     
     # npara=npoly+1 #amount of unknown parameters
@@ -211,79 +270,269 @@ dispatchParse={"$GPRMC":parseGNRMC,"$GPGSV":parseGNGSV,"$GNRMC":parseGNRMC,"$GLG
 
 ###############################################################################
 
-def readnmea(fidorfile):
-    """Parses a nmea file/stream and puts the output in a pandas dataframe"""
-    if type(fidorfile) == str:
-        if fidorfile.endswith('.gz'):
-            fid=gz.open(fidorfile,'rt')
-        elif fidorfile.endswith(".lz4"):
-            # lz4 compressed file (e.g. from Actinius devices)
-            fid=lz4.frame.open(fidorfile, mode='rt')
-        else:
-            fid=open(fidorfile,'rt')
+#decoding options which mimic the former line parser: satellites with empty fields are ignored and the satellites of cycles without a valid fix are added to the next cycle
+_readnmeafilters={"systems":list(GNSSlookup.keys()),"skip_empty":True,"merge_void":True}
+
+def _batch_to_frame(batch):
+    """Unwrap a columnar batch (see NMEAFile.readbatch) into a DataFrame with one row per satellite observation"""
+    nsats=np.diff(batch["offset"])
+    icycle=np.repeat(np.arange(len(nsats)),nsats)
+    lookup=np.empty(256,dtype=object)
+    for code,sys in GNSScodes.items():
+        lookup[code]=sys
+    system=lookup[batch["system"].view(np.uint8)]
+    df=pd.DataFrame({"time":batch["epoch"][icycle].view("datetime64[ns]"),
+                     "lat":batch["lat"][icycle].astype(np.float64),
+                     "lon":batch["lon"][icycle].astype(np.float64),
+                     "PRN":batch["prn"].astype(np.int64),
+                     "system":system,
+                     "elev":batch["elevation"].astype(np.float64),
+                     "az":batch["azimuth"].astype(np.float64),
+                     "snr":batch["cnr0"].astype(np.float64)})
+    #a PRN which is reported twice in a cycle is only kept once (at its first position, with the last values)
+    key=pd.DataFrame({"cycle":icycle,"PRN":df.PRN})
+    first=key.groupby(["cycle","PRN"],sort=False).ngroup().to_numpy()
+    last=~key.duplicated(keep="last").to_numpy()
+    df=df.iloc[np.flatnonzero(last)[np.argsort(first[last],kind="stable")]]
+    return df.reset_index(drop=True)
+
+def _smooth_segments(prn,time,elev,az):
+    """Compute the smoothed elevations and azimuths and the ascending (even)/descending (odd) segment numbers of all PRNs 
+        The observations are sorted by PRN, so that every PRN occupies a contiguous section of the arrays.
+
+        Parameters
+        ----------
+        prn : int array
+            PRNs of the observations (in chronological order per PRN)
+        time : datetime64 array
+            Time tags of the observations
+        elev : float array
+            Elevations with a resolution of a degree
+        az : float array
+            Azimuths with a resolution of a degree
+
+        Returns
+        -------
+        tuple of arrays
+            elevsmth,azsmth and segment in the order of the input
+    """
+    order=np.argsort(prn,kind="stable")
+    prns=prn[order]
+    #start indices of the PRN sections
+    istart=np.concatenate([[0],np.flatnonzero(np.diff(prns))+1])
+    iend=np.append(istart[1:],len(prns))
+    
+    times=_to_ns(time[order])
+    elevsmth=smoothDegreesBatch(elev[order],times,istart)
+    azsmth=smoothDegreesBatch(az[order],times,istart)
+
+    #the segment number increases when the smoothed elevation changes from ascending to descending (and vice versa)
+    segment=np.full(len(prns),-1,dtype=np.int64)
+    if len(prns) > 2:
+        up=np.diff(elevsmth) > 0
+        #cumulative amount of direction changes (the ones crossing PRN sections cancel out below)
+        nflips=np.concatenate([[0],np.cumsum(up[1:] != up[:-1])])
+        lengths=iend-istart
+        ivalid=lengths > 2
+        #first segment is odd when the PRN starts descending
+        first=(~up[istart[ivalid]]).astype(np.int64)
+        igroup=np.repeat(np.arange(len(istart)),lengths)
+        pos=np.arange(len(prns))-istart[igroup]
+        sel=ivalid[igroup]
+        grpstart=istart[igroup[sel]]
+        counts=np.where(pos[sel] >= 2,nflips[np.maximum(np.flatnonzero(sel)-1,0)]-nflips[grpstart],0)
+        segment[sel]=counts+np.repeat(first,lengths[ivalid])
+
+    #restore the original order
+    unsorted=np.empty(len(prns),dtype=np.int64)
+    unsorted[order]=np.arange(len(prns))
+    return elevsmth[unsorted],azsmth[unsorted],segment[unsorted]
+
+#compact dtypes of the chunks of readnmea
+compactdtypes={"PRN":np.int16,"elev":np.float32,"az":np.float32,"snr":np.float32,
+               "elevsmth":np.float32,"azsmth":np.float32,"segment":np.int16,
+               "system":pd.CategoricalDtype(list(GNSScodes.values()))}
+
+def _run_starts(degarray,timev):
+    """Start indices of the runs of equal degree values (a new run also starts at a section of smoothDegrees)"""
+    brk=(np.diff(degarray) != 0) | (np.diff(timev) > np.timedelta64(30,'s'))
+    return np.concatenate([[0],np.flatnonzero(brk)+1])
+
+def _section_start(degarray,timev):
+    """Start index of the last contiguous section of smoothDegrees"""
+    brk=(np.abs(np.diff(degarray)) > 180.0) | (np.diff(timev) > np.timedelta64(30,'s'))
+    ibrk=np.flatnonzero(brk)
+    return ibrk[-1]+1 if len(ibrk) > 0 else 0
+
+def _continue_segments(elevsmth,state):
+    """Continue the ascending (even)/descending (odd) segment numbering of a PRN (see readnmea) with newly smoothed elevations
+        state holds the amount of preceding observations, the last smoothed elevation, direction and segment number and is updated in place
+    """
+    count=state.get("count",0)
+    seq=np.concatenate([[state["elev"]],elevsmth]) if count > 0 else elevsmth
+    up=np.diff(seq) > 0
+    if count >= 2:
+        up=np.concatenate([[state["up"]],up])
+        segment=state["segment"]+np.cumsum(up[1:] != up[:-1])
+    elif count+len(elevsmth) > 2:
+        segment=np.insert(np.cumsum(up[1:] != up[:-1]),0,[0,0])+(0 if up[0] else 1)
+        segment=segment[count:]
     else:
-        fid=fidorfile
+        segment=np.full(len(elevsmth),-1)
+    if len(elevsmth) > 0:
+        state["count"]=count+len(elevsmth)
+        state["elev"]=seq[-1]
+        state["segment"]=segment[-1]
+        if len(up) > 0:
+            state["up"]=up[-1]
+    return segment
+
+def _readnmea_chunks(nmeaf,chunks):
+    """Generator for readnmea which yields the observations in chunks
+        Observations which still depend on future data (the last runs of equal degree values of a PRN, see smoothDegrees) are held back, together with the preceding run, so that the concatenated chunks equal the output of a complete read
+    """
+    if isinstance(chunks,(int,np.integer)):
+        ncycles,period=chunks,None
+    else:
+        ncycles,period=3600,pd.Timedelta(chunks).value
+    states={}
+    carry=None
+    nrows=0
+    with nmeaf:
+        batches=nmeaf.readbatches(ncycles,**_readnmeafilters)
+        while True:
+            batch=next(batches,None)
+            eof=batch is None
+            frames=[] if carry is None else [carry]
+            if not eof:
+                df=_batch_to_frame(batch)
+                df["emitted"]=False
+                df["row"]=np.arange(nrows,nrows+len(df))
+                nrows+=len(df)
+                frames.append(df)
+            if len(frames) == 0:
+                return
+            data=pd.concat(frames,ignore_index=True)
+            if len(data) == 0:
+                if eof:
+                    return
+                continue
+            
+            prn=data.PRN.to_numpy()
+            time=data.time.to_numpy()
+            elev=data.elev.to_numpy()
+            az=data.az.to_numpy()
+            emitted=data.emitted.to_numpy(copy=True)
+            order=np.argsort(prn,kind="stable")
+            istart=np.concatenate([[0],np.flatnonzero(np.diff(prn[order]))+1])
+            iend=np.append(istart[1:],len(order))
+            
+            #smooth the PRN sections and find the observations which are final
+            elevsmth=smoothDegreesBatch(elev[order],time[order],istart)
+            azsmth=smoothDegreesBatch(az[order],time[order],istart)
+            tlast=time[-1]
+            tcut=np.datetime64("NaT")
+            groups=[]
+            for i0,i1 in zip(istart,iend):
+                idx=order[i0:i1]
+                t,e,a=time[idx],elev[idx],az[idx]
+                nfinal=len(idx)
+                if not eof and tlast-t[-1] < np.timedelta64(30,'s'):
+                    #the last two runs of a section are not final (the sections of the elevations and azimuths differ)
+                    bounds=[]
+                    for degarray in (e,a):
+                        runs=_run_starts(degarray,t)
+                        bounds.append(max(_section_start(degarray,t),runs[-2] if len(runs) > 1 else 0))
+                    nfinal=min(bounds)
+                    if np.isnat(tcut) or t[nfinal] < tcut:
+                        tcut=t[nfinal]
+                groups.append((idx,elevsmth[i0:i1],azsmth[i0:i1]))
+
+            if np.isnat(tcut):
+                #all observations are final
+                cut=tlast+np.timedelta64(1,'ns')
+            elif period is not None:
+                #only complete periods
+                cut=(tcut.astype(np.int64)//period*period).astype("datetime64[ns]")
+            else:
+                cut=tcut
+
+            #select the observations before the cut and keep the remainder (with some context) for the next batch
+            rows,elevsmth,azsmth,segment,keep=[],[],[],[],[]
+            for idx,es,azs in groups:
+                t=time[idx]
+                iemit=np.count_nonzero(emitted[idx])
+                icut=np.searchsorted(t,cut,side="left")
+                state=states.setdefault(prn[idx[0]],{})
+                rows.append(idx[iemit:icut])
+                elevsmth.append(es[iemit:icut])
+                azsmth.append(azs[iemit:icut])
+                segment.append(_continue_segments(es[iemit:icut],state))
+                if icut < len(idx):
+                    #start with the run preceding the first observation which is not yet emitted
+                    ikeep=icut
+                    for degarray in (elev[idx],az[idx]):
+                        runs=_run_starts(degarray,t)
+                        irun=np.searchsorted(runs,icut,side="right")-1
+                        ikeep=min(ikeep,runs[max(irun-1,0)])
+                    keep.append(idx[ikeep:])
+            
+            rows=np.concatenate(rows)
+            emitted[rows]=True
+            carry=data.iloc[np.sort(np.concatenate(keep))] if len(keep) > 0 else None
+            if carry is not None:
+                carry=carry.assign(emitted=emitted[carry.index])
+            
+            if len(rows) > 0:
+                out=data.iloc[rows].assign(elevsmth=np.concatenate(elevsmth),azsmth=np.concatenate(azsmth),segment=np.concatenate(segment))
+                out=out.sort_values("row").drop(columns=["emitted","row"]).astype(compactdtypes)
+                if period is None:
+                    yield out.set_index(["time","PRN","segment"])
+                else:
+                    for _,chunk in out.groupby(out.time.to_numpy().astype(np.int64)//period,sort=True):
+                        yield chunk.set_index(["time","PRN","segment"])
+            if eof:
+                return
+
+def readnmea(fidorfile,chunks=None):
+    """Parses a nmea file/stream (decoded by the C parser of gnssrlib) and puts the output in a pandas dataframe
+    
+        Parameters
+        ----------
+        fidorfile : str or file object
+            (compressed) nmea file or an open file with nmea data
+        chunks : int, str or timedelta, optional
+            When provided, a generator is returned which yields dataframes of (roughly) the given amount of cycles, or of the observations per time period (e.g. '1h').
+            The chunks use compact dtypes (int16 PRN and segment, float32 angles and SNR, float64 coordinates and a categorical system) and their segment numbering continues over the chunk boundaries
 
+        Returns
+        -------
+        pandas.DataFrame, generator or None
+            Observations indexed by time, PRN and segment (None when no observations are found)
+    """
+    if type(fidorfile) == str:
+        nmeaf=gnssrlib.NMEAFile(fidorfile)
+    else:
+        data=fidorfile.read()
+        if isinstance(data,str):
+            data=data.encode()
+        nmeaf=gnssrlib.NMEAFile.frombuffer(data)
 
+    if chunks is not None:
+        return _readnmea_chunks(nmeaf,chunks)
 
-    #loop over the buffer and parse messages as we go
-    nmeacycle={}
-    nmeadata=[]
-    try:
-        for ln in fid:
-            if ln.startswith("$"):
-                try:
-                    nmeacycle.update(dispatchParse[ln[0:6]](ln))
-
-                    #possibly append this cycle data to nmeadata when a time tag is present
-                    if "time" in nmeacycle and (sum(k.startswith("PRN") for k in nmeacycle.keys()) > 0):
-
-                        basedict={k:v for k,v in nmeacycle.items() if not k.startswith("PRN")}
-
-                        #unwrap the different PRN's into separate rows
-                        for ky,val in nmeacycle.items():
-                            if ky.startswith("PRN"):
-                                nmeadata.append({**basedict,"PRN":int(ky[3:]),**val})
-                        #reset nmeacycle dict
-                        nmeacycle={}
-                except KeyError:
-                    continue
-    except UnicodeDecodeError:
-        return None
+    with nmeaf:
+        #only the GSV messages of GPS and GLONASS are used
+        batch=nmeaf.readall(**_readnmeafilters)
     
-    if len(nmeadata) == 0:
+    if batch is None:
+        return None
+    df=_batch_to_frame(batch)
+    if len(df) == 0:
         return None
-    #create a dataframe and set multiindex
-    df=pd.DataFrame(nmeadata)
-    
-    #We wan to get rid of rows which don;t have a elevation of azimuth in them
-    # df.dropna(subset=["elev","az"],inplace=True)
-    
 
     #since the resolution of the elevatio, and azimuthn is only on discrete degrees, let's create smoothed versions (better for plotting etc)
     # Furthermore, we also want to identify the different ascending/descending segment, even/oddly numbered repspectively so we can select of those too
-    df["elevsmth"]=np.nan 
-    df["azsmth"]=np.nan 
-    df["segment"]=-1
-    for name,grp in df.groupby("PRN"):
-        time=grp.time.to_numpy()
-        for dvi,dvo in [("elev","elevsmth"),("az","azsmth")]:
-            dsmooth=smoothDegrees(grp[dvi].to_numpy(),time)
-            #put the stuff back in the dataframe
-            df.loc[grp.index,dvo]=dsmooth
-
-
-            if dvi == "elev" and len(dsmooth) > 2:
-                #also figure out the valid iascending (will be even numbered, descending will be oddly numbered) segments per PRN
-                pdif=(np.diff(dsmooth)>0).astype(float)
-                segment=np.insert(np.cumsum(np.abs(np.diff(pdif))),0,[0,0]).astype(int)
-                if pdif[0] == 0.0:
-                    #starts with a descending node
-                    #make sure it's oddly numbered
-                    segment=segment+1
-
-                df.loc[grp.index,"segment"]=segment
-
-                df=df.loc[df.snr.notna()]
+    df["elevsmth"],df["azsmth"],df["segment"]=_smooth_segments(df.PRN.to_numpy(),df.time.to_numpy(),df.elev.to_numpy(),df.az.to_numpy())
                 
     return df.set_index(["time","PRN","segment"])
@@ -0,0 +1,154 @@
+# This file is part of gnssr4water
+# gnssr4water is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# gnssr4water is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with gnssr4water if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2025
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from gnssr4water.core.logger import log
+from gnssr4water.gnssrlib import scan_nmea,_to_epoch
+from gnssr4water.io.nmeastream import NMEAFileStream
+
+
+class NMEACatalog:
+    """
+    SQLite catalog with a summary (see scan_nmea) of a collection of (compressed) nmea log files.
+    Files are only scanned when they are new or modified (size or modification time differ), so that the logs can be selected by time range without opening them.
+    """
+    def __init__(self,dbfile,mingap=timedelta(seconds=10)):
+        self.dbfile=dbfile
+        self.mingap=mingap
+        self.conn=sqlite3.connect(dbfile)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, first INTEGER, last INTEGER, ncycles INTEGER, nlines INTEGER, ninvalid INTEGER, nbackward INTEGER, talkers TEXT)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS files_time ON files (first,last)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS gaps (path TEXT, gapstart INTEGER, gapend INTEGER)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS gaps_path ON gaps (path)")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_val,exc_tb):
+        self.close()
+
+    def update(self,nmeafiles,max_workers=None):
+        """Scan new and modified files and store their summaries in the catalog
+            The scans are done concurrently on a thread pool (the C scanner does not hold the GIL)
+
+            Parameters
+            ----------
+            nmeafiles : list of str
+                Files to add to the catalog
+            max_workers : int, optional
+                Maximum number of threads to use (defaults to the ThreadPoolExecutor default)
+
+            Returns
+            -------
+            int
+                Amount of files which were (re)scanned
+        """
+        known={path:(size,mtime) for path,size,mtime in self.conn.execute("SELECT path,size,mtime FROM files")}
+        toscan=[]
+        for nmeafile in nmeafiles:
+            path=os.path.abspath(nmeafile)
+            stat=os.stat(path)
+            if known.get(path) != (stat.st_size,stat.st_mtime_ns):
+                toscan.append(path)
+
+        def scan(path):
+            try:
+                return path,scan_nmea(path,self.mingap)
+            except ValueError as exc:
+                log.warning(f"Could not scan {path}: {exc}")
+                return path,None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results=list(executor.map(scan,toscan))
+
+        with self.conn:
+            for path,summary in results:
+                if summary is None:
+                    continue
+                self.conn.execute("DELETE FROM gaps WHERE path = ?",(path,))
+                hascycles=summary["ncycles"] > 0
+                first=_to_epoch(summary["first"]) if hascycles else None
+                last=_to_epoch(summary["last"]) if hascycles else None
+                self.conn.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?,?)",(path,summary["size"],summary["mtime"],first,last,summary["ncycles"],summary["nlines"],summary["ninvalid"],summary["nbackward"],",".join(summary["talkers"])))
+                self.conn.executemany("INSERT INTO gaps VALUES (?,?,?)",[(path,int(t0),int(t1)) for t0,t1 in summary["gaps"].astype(np.int64)])
+        log.info(f"Scanned {len(toscan)} new or modified files")
+        return len(toscan)
+
+    def prune(self):
+        """Remove the entries of files which no longer exist, returns the amount of removed entries"""
+        missing=[(path,) for path, in self.conn.execute("SELECT path FROM files") if not os.path.exists(path)]
+        with self.conn:
+            self.conn.executemany("DELETE FROM files WHERE path = ?",missing)
+            self.conn.executemany("DELETE FROM gaps WHERE path = ?",missing)
+        return len(missing)
+
+    def table(self):
+        """Return the catalog as a pandas DataFrame (ordered by the time of the first cycle)"""
+        df=pd.read_sql_query("SELECT * FROM files ORDER BY first,last",self.conn)
+        for col in ["first","last"]:
+            df[col]=pd.to_datetime(df[col],unit="ns")
+        return df
+
+    def gaps(self,start=None,end=None):
+        """Return the gaps between cycles within files (see scan_nmea) which overlap the time window [start,end) as a pandas DataFrame"""
+        t0=_to_epoch(start) if start is not None else np.iinfo(np.int64).min
+        t1=_to_epoch(end) if end is not None else np.iinfo(np.int64).max
+        df=pd.read_sql_query("SELECT * FROM gaps WHERE gapend > ? AND gapstart < ? ORDER BY gapstart",self.conn,params=(t0,t1))
+        for col in ["gapstart","gapend"]:
+            df[col]=pd.to_datetime(df[col],unit="ns")
+        return df
+
+    def select(self,start=None,end=None):
+        """Select the files holding cycles in the time window [start,end), ordered and de-overlapped
+            Files which are completely covered by the preceding files are skipped, and the others only need to be read after the last cycle of their predecessors.
+
+            Returns
+            -------
+            list of tuples
+                (path, filters) pairs, where filters holds the 'start' and/or 'end' selection to apply when reading the file (see NMEAFile.set_filter).
+                The list can be used as input for NMEAFileStream
+        """
+        t0=_to_epoch(start) if start is not None else np.iinfo(np.int64).min
+        t1=_to_epoch(end) if end is not None else np.iinfo(np.int64).max
+        rows=self.conn.execute("SELECT path,first,last FROM files WHERE ncycles > 0 AND last >= ? AND first < ? ORDER BY first,last",(t0,t1)).fetchall()
+        selection=[]
+        covered=t0
+        for path,first,last in rows:
+            if last < covered:
+                #all cycles have been read from preceding files already
+                log.info(f"Skipping {path} which overlaps with preceding files")
+                continue
+            filters={}
+            if covered > first:
+                filters["start"]=np.datetime64(covered,"ns")
+            if end is not None:
+                filters["end"]=np.datetime64(t1,"ns")
+            selection.append((path,filters))
+            covered=last+1
+        return selection
+
+    def stream(self,start=None,end=None,**kwargs):
+        """Create a NMEAFileStream of the selected files (see select), additional keyword arguments are passed to NMEAFileStream"""
+        return NMEAFileStream(self.select(start,end),**kwargs)
@@ -15,22 +15,159 @@
 
 # Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
 import gzip
+import os
+import glob
+import time
+import asyncio
+import socket
+import select
+import numpy as np
 from gnssr4water.core.logger import log
 from datetime import datetime,timedelta
-from gnssr4water.gnssrlib import NMEAFile
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from gnssr4water.gnssrlib import NMEAFile,iter_cycles,concatenate_batches
+
+
+def readfile(nmeafile,ncycles=10000,**filters):
+    """Decode a complete (compressed) nmea file into a columnar batch (see NMEAFile.readbatch and NMEAFile.set_filter for the filters)"""
+    with NMEAFile(nmeafile) as fid:
+        fid.set_filter(**filters)
+        return fid.readall(ncycles)
+
+def readfiles(nmeafiles,max_workers=None,ncycles=10000,**filters):
+    """Decode a list of (compressed) nmea files concurrently on a thread pool 
+        The decompression and parsing of the files is done without holding the GIL, so this scales over the available cores
+
+        Parameters
+        ----------
+        nmeafiles : list of str
+            Files to decode
+        max_workers : int, optional
+            Maximum number of threads to use (defaults to the ThreadPoolExecutor default)
+        ncycles: int
+            Amount of cycles to decode in a single batch
+        **filters :
+            Selection criteria which are applied while decoding (see NMEAFile.set_filter)
+
+        Returns
+        -------
+        list of dict
+            Columnar batches (or None when a file holds no cycles), in the same order as the input files
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda nmeafile: readfile(nmeafile,ncycles,**filters),nmeafiles))
+
+
+def readfile_parallel(nmeafile,max_workers=None,ncycles=10000,**filters):
+    """Decode a single large (compressed) nmea file concurrently on a thread pool
+        The file is split in contiguous segments at the checkpoints of its time index (see NMEAFile.get_index), which is built, and stored as a sidecar file, when not available.
+        Every segment is decoded by its own reader, which restarts decompression at the nearest gzip access point and stops at the start of the next segment, so that the concatenated result equals that of readfile.
+
+        Parameters
+        ----------
+        nmeafile : str
+            File to decode
+        max_workers : int, optional
+            Maximum number of threads (and segments) to use (defaults to the number of cores)
+        ncycles: int
+            Amount of cycles to decode in a single batch
+        **filters :
+            Selection criteria which are applied while decoding (see NMEAFile.set_filter), start and end also restrict the segments which are decoded
+
+        Returns
+        -------
+        dict or None
+            Columnar batch (or None when the file holds no cycles)
+    """
+    if max_workers is None:
+        max_workers=os.cpu_count()
+    with NMEAFile(nmeafile) as fid:
+        index=fid.get_index()
+    pos=index["pos"]
+    #restrict to the checkpoints which cover the requested time span
+    i0=0
+    i1=len(pos)
+    if filters.get("start") is not None:
+        i0=np.searchsorted(index["last"],np.datetime64(filters["start"],"ns").astype(np.int64),side="left")
+    if filters.get("end") is not None:
+        i1=np.searchsorted(index["first"],np.datetime64(filters["end"],"ns").astype(np.int64),side="left")
+    if i0 >= i1:
+        return None
+    #split in segments of roughly the same amount of uncompressed bytes
+    endpos=pos[i1] if i1 < len(pos) else None
+    target=np.linspace(pos[i0],pos[i1-1] if endpos is None else endpos,max_workers+1)[1:-1]
+    seams=np.unique(np.searchsorted(pos[i0:i1],target,side="left"))
+    seams=seams[(seams > 0) & (seams < i1-i0)]+i0
+    offsets=[pos[i0]]+[pos[i] for i in seams]+[endpos]
+
+    def readsegment(p0,p1):
+        with NMEAFile(nmeafile) as fid:
+            fid.index=index
+            fid.set_filter(**filters,end_offset=p1)
+            fid.seek_offset(p0)
+            return fid.readall(ncycles)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batches=list(executor.map(readsegment,offsets[:-1],offsets[1:]))
+    return concatenate_batches(batches)
 
 
 
 class NMEAFileStream:
     """
     Creates a continuous stream from a list of (compressed) nmea file logs. Note: the files must be chronological order!
+    Items can also be (nmeafile,filters) pairs, with additional selection criteria for that file only (e.g. as returned by NMEACatalog.select)
+    When prefetch > 0, the next prefetch files are decompressed and decoded in background threads, while the current one is consumed.
+    Additional keyword arguments are selection criteria which are applied while decoding (see NMEAFile.set_filter)
     """
-    def __init__(self,nmeaobjs,check=True):
+    def __init__(self,nmeaobjs,check=True,prefetch=0,ncycles=10000,**filters):
         self.nmeaobjs=iter(nmeaobjs)
         self.fid=None 
-        self.openNext()
+        self.ncycles=ncycles
+        self.prefetch=prefetch
+        self.filters=filters
+        if self.prefetch > 0:
+            #note: background decoding starts when reading starts, so that filters can still be set
+            self._executor=ThreadPoolExecutor(max_workers=self.prefetch)
+            self._pending=deque()
+        else:
+            self.openNext()
+
+    def set_filter(self,**filters):
+        """Set selection criteria for the remainder of the stream (see NMEAFile.set_filter)"""
+        self.filters={**self.filters,**filters}
+        if self.fid is not None:
+            self.fid.set_filter(**filters)
         
+    def readbatches(self):
+        """Iterate over the stream in columnar batches (see NMEAFile.readbatch)"""
+        if self.prefetch > 0:
+            while len(self._pending) < self.prefetch and self.submitNext():
+                pass
+            while len(self._pending) > 0:
+                nmeafile,future=self._pending.popleft()
+                #keep the pipeline filled
+                self.submitNext()
+                log.info(f"Reading from next stream object {nmeafile}")
+                batch=future.result()
+                if batch is not None:
+                    yield batch
+            self._executor.shutdown()
+        else:
+            while self.fid is not None:
+                for batch in self.fid.readbatches(self.ncycles):
+                    yield batch
+                self.openNext()
+
     def readcycles(self):
+        if self.prefetch > 0:
+            #cycles come out in the order of the input files
+            for batch in self.readbatches():
+                for nmeacycle in iter_cycles(batch):
+                    yield nmeacycle
+            return
+
         while self.fid is not None:
             for nmeacycle in self.fid.readcycles():
                 yield nmeacycle
@@ -135,9 +272,201 @@ class NMEAFileStream:
             self.fid.close()
         try:
             #open new NMEA file
-            nmeafile=next(self.nmeaobjs)
+            nmeafile,filters=self.nextItem()
             self.fid=NMEAFile(nmeafile)
+            self.fid.set_filter(**filters)
             log.info(f"Reading from next stream object {nmeafile}")
         except StopIteration:
             self.fid=None
 
+    def submitNext(self):
+        """Submit the next file for background decoding, returns False when no more files are available"""
+        try:
+            nmeafile,filters=self.nextItem()
+            self._pending.append((nmeafile,self._executor.submit(readfile,nmeafile,self.ncycles,**filters)))
+            return True
+        except StopIteration:
+            return False
+
+    def nextItem(self):
+        """Return the next file and the selection criteria to apply to it"""
+        item=next(self.nmeaobjs)
+        if isinstance(item,tuple):
+            nmeafile,filters=item
+            return nmeafile,{**self.filters,**filters}
+        return item,self.filters
+
+
+class NMEAFollowStream:
+    """
+    Follows a growing (uncompressed) nmea log, so that cycles become available shortly after the logger has appended them.
+    The files matching the glob pattern are ordered by name: the stream starts with the last one (or startfile), and continues with the next one when the logger rotates to a new (e.g. hourly) file.
+    Additional keyword arguments are selection criteria which are applied while decoding (see NMEAFile.set_filter)
+    """
+    def __init__(self,pattern,interval=1.0,startfile=None,**filters):
+        self.pattern=pattern
+        self.interval=interval
+        self.filters=filters
+        self.fid=None
+        self.current=None
+        if startfile is None:
+            nmeafiles=self.listFiles()
+            if len(nmeafiles) > 0:
+                startfile=nmeafiles[-1]
+        if startfile is not None:
+            self.openFile(startfile)
+
+    def listFiles(self):
+        return sorted(glob.glob(self.pattern))
+
+    def set_filter(self,**filters):
+        """Set selection criteria for the remainder of the stream (see NMEAFile.set_filter)"""
+        self.filters={**self.filters,**filters}
+        if self.fid is not None:
+            self.fid.set_filter(**filters)
+
+    def openFile(self,nmeafile):
+        if self.fid is not None:
+            self.fid.close()
+        self.fid=NMEAFile(nmeafile,follow=True)
+        self.fid.set_filter(**self.filters)
+        self.current=nmeafile
+        log.info(f"Following {nmeafile}")
+
+    def nextFile(self):
+        """Return the file which follows the current one, or None when the current file is the latest"""
+        later=[nmeafile for nmeafile in self.listFiles() if self.current is None or nmeafile > self.current]
+        return later[0] if len(later) > 0 else None
+
+    def available(self):
+        """Iterate over the cycles which are currently available (without waiting), and switch to the next file when the log has been rotated"""
+        while True:
+            if self.fid is None:
+                nmeafile=self.nextFile()
+                if nmeafile is None:
+                    return
+                self.openFile(nmeafile)
+            for nmeacycle in self.fid.readcycles():
+                yield nmeacycle
+            nmeafile=self.nextFile()
+            if nmeafile is None:
+                return
+            #the logger has moved on, so the current file is complete after reading what was appended in the meantime
+            for nmeacycle in self.fid.readcycles():
+                yield nmeacycle
+            self.openFile(nmeafile)
+
+    def readcycles(self,timeout=None):
+        """Iterate over the cycles, while waiting (blocking) for new data
+            
+            Parameters
+            ----------
+            timeout : float, optional
+                Stop when no new cycles arrived during this amount of seconds (default: follow forever)
+        """
+        lastdata=time.monotonic()
+        while True:
+            for nmeacycle in self.available():
+                lastdata=time.monotonic()
+                yield nmeacycle
+            if timeout is not None and time.monotonic()-lastdata > timeout:
+                return
+            time.sleep(self.interval)
+
+    async def areadcycles(self,timeout=None,nyield=100):
+        """Asynchronous version of readcycles, which waits for new data without blocking the event loop
+            The event loop also gets a chance to run other tasks after every nyield cycles (e.g. while catching up on a backlog)
+        """
+        lastdata=time.monotonic()
+        while True:
+            for i,nmeacycle in enumerate(self.available()):
+                lastdata=time.monotonic()
+                yield nmeacycle
+                if i%nyield == nyield-1:
+                    await asyncio.sleep(0)
+            if timeout is not None and time.monotonic()-lastdata > timeout:
+                return
+            await asyncio.sleep(self.interval)
+
+    def close(self):
+        if self.fid is not None:
+            self.fid.close()
+            self.fid=None
+
+
+class NMEALiveStream:
+    """
+    Stream of cycles from a live receiver which is connected through a serial port, a (TCP) socket or another file descriptor.
+    The descriptor is read without blocking: areadcycles waits for new data with loop.add_reader, so that a single event loop can serve several receivers.
+    Additional keyword arguments are selection criteria which are applied while decoding (see NMEAFile.set_filter)
+    """
+    def __init__(self,source,name=None,**filters):
+        self.source=source
+        self.fd=source if isinstance(source,int) else source.fileno()
+        os.set_blocking(self.fd,False)
+        self.fid=NMEAFile.fromfd(source,name)
+        self.fid.set_filter(**filters)
+
+    @classmethod
+    async def connect(cls,host,port,**filters):
+        """Connect to a receiver which serves NMEA messages over TCP (e.g. through ser2net or a NTRIP caster)"""
+        sock=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock,(host,port))
+        return cls(sock,name=f"{host}:{port}",**filters)
+
+    @classmethod
+    def openSerial(cls,device,baudrate=9600,**filters):
+        """Open a serial port in raw mode (POSIX only)"""
+        import termios
+        import tty
+        fd=os.open(device,os.O_RDONLY|os.O_NOCTTY|os.O_NONBLOCK)
+        tty.setraw(fd)
+        attrs=termios.tcgetattr(fd)
+        speed=getattr(termios,f"B{baudrate}")
+        attrs[4]=attrs[5]=speed
+        termios.tcsetattr(fd,termios.TCSANOW,attrs)
+        return cls(fd,name=device,**filters)
+
+    def set_filter(self,**filters):
+        """Set selection criteria for the remainder of the stream (see NMEAFile.set_filter)"""
+        self.fid.set_filter(**filters)
+
+    def readcycles(self,timeout=None):
+        """Iterate over the cycles, while waiting (blocking) for new data, until the connection is closed (or no data arrived during timeout seconds)"""
+        while not self.fid.eof():
+            for nmeacycle in self.fid.readcycles():
+                yield nmeacycle
+            if self.fid.eof():
+                break
+            ready,_,_=select.select([self.fd],[],[],timeout)
+            if not ready:
+                return
+
+    async def areadcycles(self,nyield=100):
+        """Asynchronously iterate over the cycles as they arrive, until the connection is closed
+            The event loop also gets a chance to run other tasks after every nyield cycles (e.g. when a burst of data arrived)
+        """
+        loop=asyncio.get_running_loop()
+        readable=asyncio.Event()
+        loop.add_reader(self.fd,readable.set)
+        try:
+            while True:
+                readable.clear()
+                for i,nmeacycle in enumerate(self.fid.readcycles()):
+                    yield nmeacycle
+                    if i%nyield == nyield-1:
+                        await asyncio.sleep(0)
+                if self.fid.eof():
+                    break
+                #note: the reader callback is level triggered, so data which arrived in the meantime sets the event again
+                await readable.wait()
+        finally:
+            loop.remove_reader(self.fd)
+
+    def close(self):
+        self.fid.close()
+        if isinstance(self.source,int):
+            os.close(self.source)
+        else:
+            self.source.close()
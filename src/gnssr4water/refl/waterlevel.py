@@ -34,8 +34,13 @@ atmo_corr_tag="atmo_corr"
 
 
 class WaterLevelArc(Arc):
+    __slots__=("sinelev","noiseBandwidth","snrv_v","antennaHeight","omega")
+
     def __init__(self,arc,noiseBandwidth=1):
-        super().__init__(arc.prn,arc.system,arc.time,arc.elev,arc.az,arc.cnr0)
+        #wrap the (already refined) arc: the buffers are shared and the nmea values are not refined again
+        for ky in Arc.__slots__:
+            if hasattr(arc,ky):
+                setattr(self,ky,getattr(arc,ky))
         self.sinelev=np.sin(np.deg2rad(self.elev))
         self.setNoisebandwidth(noiseBandwidth)
         
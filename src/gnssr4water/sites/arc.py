@@ -14,7 +14,6 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 
 # Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
-from datetime import timedelta
 from gnssr4water.core.logger import log
 import numpy as np
 import matplotlib.pyplot as mpl
@@ -24,13 +23,17 @@ from gnssr4water.io.nmea import resolveSubValues
 class Arc:
     """ 
     Represents a certain Arc seen from a dedicated location
+    Time tags are stored as numpy.datetime64[ns] (datetime objects and int64 nanoseconds since 1970-01-01 are converted)
     """
+    __slots__=("prn","system","time","elev","az","cnr0","elevint","azint","isplit","direction")
+
     def __init__(self,prn,system,time,elev,az,cnr0,refinenmea=True):
         self.prn=prn
-        self.time=np.array(time)
-        self.elev=np.array(elev)
-        self.az=np.array(az)
-        self.cnr0=np.array(cnr0)
+        #note: arrays (e.g. views on the buffers of the arc builder) are not copied
+        self.time=np.asarray(time,dtype="datetime64[ns]")
+        self.elev=np.asarray(elev)
+        self.az=np.asarray(az)
+        self.cnr0=np.asarray(cnr0)
 
         self.system=system
         if refinenmea:
@@ -74,12 +77,14 @@ class Arc:
 
     @property
     def deltaT(self):
+        """Time span of the arc (numpy.timedelta64[ns])"""
         return self.time[-1]-self.time[0]
     
     @property
     def centralT(self):
-        t0=self.time[0]
-        return timedelta(seconds=np.median([(dt-t0).total_seconds() for dt in self.time]))+t0
+        """Median epoch of the arc (numpy.datetime64[ns])"""
+        tns=self.time.view(np.int64)
+        return self.time[0]+np.timedelta64(int(np.median(tns-tns[0])),'ns')
 
     def split(self):
         """
@@ -91,14 +96,20 @@ class Arc:
         if self.isplit is None:
             # nothing to split
             return self,None
-        slice1=slice(0,self.isplit)
-        slice2=slice(self.isplit,len(self.time))
-        refinenmea=hasattr(self,'elevint')
-
-        arc1=Arc(self.prn,self.system,self.time[slice1],self.elev[slice1],self.az[slice1],self.cnr0[slice1],refinenmea=refinenmea)
-        arc2=Arc(self.prn,self.system,self.time[slice2],self.elev[slice2],self.az[slice2],self.cnr0[slice2],refinenmea=refinenmea)
+        arc1=self.subArc(slice(0,self.isplit))
+        arc2=self.subArc(slice(self.isplit,len(self.time)))
         
         return arc1,arc2 
+
+    def subArc(self,sl):
+        """
+        Retrieve a part of the arc as a new arc which shares the buffers of this arc (the values are not refined again)
+        """
+        arc=Arc(self.prn,self.system,self.time[sl],self.elev[sl],self.az[sl],self.cnr0[sl],refinenmea=False)
+        if hasattr(self,'elevint'):
+            arc.elevint=self.elevint[sl]
+            arc.azint=self.azint[sl]
+        return arc
         
 
         
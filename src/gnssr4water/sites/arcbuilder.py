@@ -15,18 +15,74 @@
 
 # Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
 import asyncio
+import heapq
+from itertools import count
 from asyncio.exceptions import CancelledError
 from asyncio.queues import QueueEmpty, QueueFull
 from datetime import timedelta,datetime
 from gnssr4water.core.logger import log
 from gnssr4water.sites.arc import Arc
-from gnssr4water.sites.skymask import SimpleMask
+from gnssr4water.sites.skymask import SimpleMask,SkyMask
+from gnssr4water.io.nmea import resolveSubValuesBatch
+from gnssr4water.gnssrlib import gnss_sys
 import numpy as np
 
 
+class ArcBuffer:
+    """
+    Growable buffers holding the observations of an open satellite arc (int64 nanosecond epochs and float32 values)
+    The completed arc is a view on the buffers, so a buffer should not be appended to after its arc has been retrieved
+    """
+    def __init__(self,prn,system,capacity=1024):
+        self.prn=prn
+        self.system=system
+        self.time=np.empty(capacity,dtype=np.int64)
+        self.elev=np.empty(capacity,dtype=np.float32)
+        self.az=np.empty(capacity,dtype=np.float32)
+        self.cnr0=np.empty(capacity,dtype=np.float32)
+        self.n=0
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def lasttime(self):
+        """Epoch of the last observation [ns since 1970-01-01]"""
+        return self.time[self.n-1]
+
+    def append(self,tm,el,az,cnr0):
+        if self.n == len(self.time):
+            #double the capacity
+            for ky in ("time","elev","az","cnr0"):
+                buf=getattr(self,ky)
+                grown=np.empty(2*len(buf),dtype=buf.dtype)
+                grown[0:self.n]=buf
+                setattr(self,ky,grown)
+        n=self.n
+        self.time[n]=tm
+        self.elev[n]=el
+        self.az[n]=az
+        self.cnr0[n]=cnr0
+        self.n+=1
+
+    def arc(self):
+        """Return the arc of the buffered observations"""
+        n=self.n
+        return Arc(self.prn,self.system,self.time[0:n].view("datetime64[ns]"),self.elev[0:n],self.az[0:n],self.cnr0[0:n])
+
+
 class SatArcBuilder:
-    def __init__(self,snrStream,mask,block=True,minLengthSec=1800,split=True,minElevationSpan=None):
+    """
+    Collects the SNR observations of a stream of cycles into satellite arcs
+    With filterStream=True, the db threshold and the sky mask are applied by the stream while decoding (see pushFilter). 
+    Note that this sets the 'min_cnr0' and 'mask' filters on the stream which is passed in, and these remain in place after the builder stops
+    """
+    def __init__(self,snrStream,mask,block=True,minLengthSec=1800,split=True,minElevationSpan=None,filterStream=False):
         self.arccache={}
+        #min-heap of (last epoch,prn,sequence number,buffer) entries of the open arcs, ordered by their expiry deadline (and prn for arcs with the same deadline)
+        #note: entries are only updated when they reach the top of the heap, see expire
+        self.deadlines=[]
+        self._seq=count()
         self.maxarcs=10 
         # initialize a queue of finished satellite arcs
         self.arcqueue=asyncio.Queue(self.maxarcs)
@@ -41,6 +97,8 @@ class SatArcBuilder:
         self.mask=mask
 
         self.mindb=10 #ignore values with very (likely erroneous) db values
+        self.filterStream=filterStream #let the stream apply the db threshold and the sky mask when starting (see pushFilter)
+        self.cmask=False #set when the sky mask is applied by the stream
         self.split=split
 
         self.minpoints=4
@@ -64,28 +122,34 @@ class SatArcBuilder:
         """
         return self.arcqueue.qsize()
 
-    async def submitArc(self,arc):
+    def acceptArcs(self,arc):
+        """
+        Apply the selection criteria to a completed arc and return the list of accepted arcs (ascending and descending parts are split first when split=True)
+        """
         if len(arc) < self.minpoints:
             #basic sanity check to exclude all arcs with less them minpoints
-            return
+            return []
 
         if self.split and "-" in arc.direction:
-            #split into ascending and descending arc before filtering and resubmit them to the queue
+            #split into ascending and descending arc before filtering
             a1,a2=arc.split()
-            #resubmit splitted arcs
-            await self.submitArc(a1)
-            await self.submitArc(a2)
-            return
+            return self.acceptArcs(a1)+self.acceptArcs(a2)
 
         if self.minElevationSpan is not None and (np.max(arc.elev) - np.min(arc.elev) < self.minElevationSpan):
             #possibly check for minimum elevation span
-            return
+            return []
 
-        if arc.deltaT < self.minlength:
+        if arc.deltaT < np.timedelta64(self.minlength):
             #check for minimum timelength
             # log.warning(f"arc is too short, {arc.deltaT}")
-            return
-        
+            return []
+        return [arc]
+
+    async def submitArc(self,arc):
+        for arc in self.acceptArcs(arc):
+            await self.queueArc(arc)
+
+    async def queueArc(self,arc):
         if self.block:
             await self.arcqueue.put(arc)
         else:
@@ -102,48 +166,195 @@ class SatArcBuilder:
         """
         Process a cycle of SNR observations
         """
-        if sativ.sats_in_view == 0: 
+        #satellites which were rejected by the sky mask while decoding (see pushFilter) are only known by prn and their position in the cycle
+        maskedsats=list(zip(sativ.masked_pos,sativ.masked_prn)) if self.cmask else []
+        if sativ.sats_in_view == 0 and len(maskedsats) == 0: 
             #nothing to add
             return
-        tm=sativ.time
-        for i in range(sativ.sats_in_view):
-            prn=sativ.prn[i] 
-            el=sativ.elevation[i]
-            az=sativ.azimuth[i]
-            cnr0=sativ.cnr0[i]
-            system=sativ.system[i]
-            if cnr0 < self.mindb:
+        tm=sativ.epoch
+        imask=0
+        #note: the per satellite arrays are (cached) views on the cycle, so retrieve them only once
+        for isat,(prn,el,az,cnr0,system) in enumerate(zip(sativ.prn,sativ.elevation,sativ.azimuth,sativ.cnr0,sativ.system)):
+            #process masked satellites in their original order
+            while imask < len(maskedsats) and maskedsats[imask][0] <= isat:
+                await self.appendSat(tm,maskedsats[imask][1],masked=True)
+                imask+=1
+            await self.appendSat(tm,prn,el,az,cnr0,system)
+        for _,prn in maskedsats[imask:]:
+            await self.appendSat(tm,prn,masked=True)
+
+        #check for expired arc (e.g. lost tracking) and submit
+        await self.expire(tm)
+
+    async def expire(self,tm):
+        """
+        Submit the open arcs which were last seen longer than expiry before epoch tm, in the order of their deadlines
+        """
+        expiry=self.expiryns
+        while len(self.deadlines) > 0 and (tm-self.deadlines[0][0]) > expiry:
+            lasttime,prn,_,buf=heapq.heappop(self.deadlines)
+            if self.arccache.get(prn) is not buf:
+                #arc has already been submitted
+                continue
+            if buf.lasttime != lasttime:
+                #arc has been extended in the meantime: reschedule
+                heapq.heappush(self.deadlines,(buf.lasttime,prn,next(self._seq),buf))
                 continue
+            await self.submitArc(self.arccache.pop(prn).arc())
+
+    async def appendSat(self,tm,prn,el=None,az=None,cnr0=None,system=None,masked=None):
+        """
+        Process the SNR observation of a single satellite at epoch tm [ns since 1970-01-01] (masked can be provided when the satellite is already known to be outside of the mask)
+        """
+        if masked is None:
+            if cnr0 < self.mindb:
+                return
 
             masked=self.mask.masked(el,az)
     
-            if prn in self.arccache:
-                if masked:
-                    # satellite moved out of view of the mask -> close the arc and move to queue for processing
-                    
-                    await self.submitArc(Arc(**self.arccache.pop(prn)))
-                    continue
-                elif (tm-self.arccache[prn]["time"][-1]) > self.expiry:
-                    await self.submitArc(Arc(**self.arccache.pop(prn)))
-                    #satellite is within the mask but last point was too far in the past -> submit existing arc but allow the current values to start a new arc
-                else:
-                    #append values to existing arc
-                    self.arccache[prn]["time"].append(tm)
-                    self.arccache[prn]["elev"].append(el)
-                    self.arccache[prn]["az"].append(az)
-                    self.arccache[prn]["cnr0"].append(cnr0)
-                    continue 
-            elif masked:
-                #satellite is not in view of the mask, ignore
-                continue
+        if prn in self.arccache:
+            if masked:
+                # satellite moved out of view of the mask -> close the arc and move to queue for processing
+                
+                await self.submitArc(self.arccache.pop(prn).arc())
+                return
+            elif (tm-self.arccache[prn].lasttime) > self.expiryns:
+                await self.submitArc(self.arccache.pop(prn).arc())
+                #satellite is within the mask but last point was too far in the past -> submit existing arc but allow the current values to start a new arc
+            else:
+                #append values to existing arc
+                self.arccache[prn].append(tm,el,az,cnr0)
+                return 
+        elif masked:
+            #satellite is not in view of the mask, ignore
+            return
 
-            #When we land here we should initialize a new arc
-            self.arccache[prn]={"prn":prn,"system":system,"time":[tm],"elev":[el],"az":[az],"cnr0":[cnr0]}
+        #When we land here we should initialize a new arc
+        buf=ArcBuffer(prn,system)
+        buf.append(tm,el,az,cnr0)
+        self.arccache[prn]=buf
+        heapq.heappush(self.deadlines,(tm,prn,next(self._seq),buf))
 
-        #check for expired arc (e.g. lost tracking) and submit
-        expiredarcs=[prn for prn,val in self.arccache.items() if  (tm-val['time'][-1]) > self.expiry]
-        for prn in expiredarcs:
-            await self.submitArc(Arc(**self.arccache.pop(prn)))
+    @property
+    def expiryns(self):
+        """Expiry in nanoseconds"""
+        return self.expiry//timedelta(microseconds=1)*1000
+
+    def pushFilter(self):
+        """
+        Let the stream discard low (likely erroneous) db values and satellites outside of the sky mask while decoding (when supported by the stream)
+        Note: the filters are merged into the filters of the stream (replacing its 'min_cnr0' and 'mask' criteria) and are not removed afterwards
+        """
+        if not hasattr(self.snrStream,"set_filter"):
+            return
+        filters={"min_cnr0":self.mindb}
+        if getattr(self.mask,"_poly",None) is not None and type(self.mask).masked in (SkyMask.masked,SimpleMask.masked):
+            #note: the point in polygon test in the stream is the same as the one of SkyMask.masked
+            filters["mask"]=self.mask._poly
+            self.cmask=True
+        existing=getattr(self.snrStream,"filters",{})
+        for ky,val in filters.items():
+            if existing.get(ky) is not None and not np.array_equal(existing[ky],val):
+                log.warning(f"Replacing the '{ky}' filter of the stream with the one of the arc builder")
+        self.snrStream.set_filter(**filters)
+
+    def build_arcs(self,batch):
+        """
+        Build the arcs of a columnar batch of cycles at once (e.g. a day from CycleStore.readday or NMEAFile.readall), without streaming
+        The arcs are segmented with array operations on the observations sorted by prn and time, and equal the arcs which the streaming builder submits for the same cycles (in the order of submission)
+
+        Parameters
+        ----------
+        batch : dict
+            Columnar batch of cycles in chronological order (see NMEAFile.readbatch)
+
+        Returns
+        -------
+        list of Arc
+            Accepted arcs
+        """
+        if batch is None or len(batch["epoch"]) == 0:
+            return []
+        epoch=batch["epoch"]
+        nsats=np.diff(batch["offset"])
+        icycle=np.repeat(np.arange(len(nsats)),nsats)
+        #position of the satellite in the cycle (masked satellites of the batch are processed before the accepted satellite at their masked_pos)
+        poskey=2*(np.arange(len(icycle))-batch["offset"][icycle])+1
+        prn=batch["prn"]
+        valid=batch["cnr0"] >= self.mindb
+        masked=np.zeros(len(icycle),dtype=bool)
+        masked[valid]=self.mask.isMasked(batch["elevation"][valid],batch["azimuth"][valid])
+        nonempty=nsats > 0
+        if "masked_offset" in batch and batch["masked_offset"][-1] > 0:
+            nmasked=np.diff(batch["masked_offset"])
+            icycle=np.concatenate([icycle,np.repeat(np.arange(len(nmasked)),nmasked)])
+            poskey=np.concatenate([poskey,2*batch["masked_pos"]])
+            prn=np.concatenate([prn,batch["masked_prn"]])
+            valid=np.concatenate([valid,np.ones(len(batch["masked_prn"]),dtype=bool)])
+            masked=np.concatenate([masked,np.ones(len(batch["masked_prn"]),dtype=bool)])
+            nonempty|=nmasked > 0
+        #epochs of the cycles which trigger the expiry of open arcs
+        expiryepochs=epoch[nonempty]
+
+        #sort the relevant observations by prn, time and position in the cycle
+        iobs=np.flatnonzero(valid)
+        iobs=iobs[np.lexsort((poskey[iobs],icycle[iobs],prn[iobs]))]
+        p=prn[iobs]
+        t=epoch[icycle[iobs]]
+        m=masked[iobs]
+        nobs=len(iobs)
+        if nobs == 0:
+            return []
+        
+        expiry=self.expiryns
+        newprn=np.concatenate([[True],p[1:] != p[:-1]])
+        #an arc starts at an unmasked observation, after a masked one, or after a time gap
+        start=~m & (newprn | np.concatenate([[True],m[:-1]]) | np.concatenate([[True],np.diff(t) > expiry]))
+        istart=np.flatnonzero(start)
+        #and ends before the next masked observation or start of an arc
+        ibreak=np.flatnonzero(m | start)
+        iend=np.append(ibreak,nobs)[np.searchsorted(ibreak,istart,side="right")]
+        
+        #epoch at which the arc is submitted when streaming: by the next observation of the prn, or by the first cycle after it expired
+        tlast=t[iend-1]
+        iexp=np.searchsorted(expiryepochs,tlast+expiry,side="right")
+        texp=np.append(expiryepochs,np.iinfo(np.int64).max)[iexp]
+        hasnext=(iend < nobs) & ~np.append(newprn,True)[iend]
+        tnext=np.append(t,0)[iend]
+        bynext=hasnext & (tnext <= texp)
+        tsubmit=np.where(bynext,tnext,texp)
+        #arcs which are still open at the end are not submitted
+        submitted=bynext | (iexp < len(expiryepochs))
+        #arcs closed by an observation come before the expired ones of the same cycle (which are in deadline order)
+        order=np.lexsort((p[istart],np.where(bynext,np.append(poskey[iobs],0)[iend],tlast),~bynext,tsubmit))
+        order=order[submitted[order]]
+
+        #arcs which are too short can be discarded before refining
+        n=iend-istart
+        deltat=tlast-t[istart]
+        order=order[(n[order] >= self.minpoints) & (deltat[order] >= np.timedelta64(self.minlength,'ns').astype(np.int64))]
+        if len(order) == 0:
+            return []
+
+        #refine the elevations and azimuths of all arcs in one go
+        iarcobs=np.concatenate([np.arange(istart[i],iend[i]) for i in order])
+        isub=np.concatenate([[0],np.cumsum(n[order])[:-1]])
+        elevint=batch["elevation"][iobs[iarcobs]]
+        azint=batch["azimuth"][iobs[iarcobs]]
+        time=t[iarcobs]
+        elevsub=resolveSubValuesBatch(time,elevint,isub)
+        azsub=resolveSubValuesBatch(time,azint,isub)
+        cnr0=batch["cnr0"][iobs[iarcobs]]
+        system=batch["system"][iobs[iarcobs]]
+
+        arcs=[]
+        time=time.view("datetime64[ns]")
+        for i0,i1 in zip(isub,np.append(isub[1:],len(iarcobs))):
+            arc=Arc(p[iarcobs[i0]],gnss_sys.from_code(system[i0]),time[i0:i1],elevsub[i0:i1],azsub[i0:i1],cnr0[i0:i1],refinenmea=False)
+            arc.elevint=elevint[i0:i1]
+            arc.azint=azint[i0:i1]
+            arcs.extend(self.acceptArcs(arc))
+        return arcs
 
     async def start(self):
         """
@@ -155,9 +366,16 @@ class SatArcBuilder:
         
         
         self.isStreaming=True
-        try: 
-            for sv_snr in self.snrStream.readcycles():
-                await self.append(sv_snr)
+        if self.filterStream:
+            self.pushFilter()
+        try:
+            if hasattr(self.snrStream,"areadcycles"):
+                #asynchronous source (e.g. a followed log), which does not block the event loop while waiting for data
+                async for sv_snr in self.snrStream.areadcycles():
+                    await self.append(sv_snr)
+            else:
+                for sv_snr in self.snrStream.readcycles():
+                    await self.append(sv_snr)
         except CancelledError:
                 log.warning("canceling streaming task") 
                 pass #ok, pass so to set the isStreaming status to False below
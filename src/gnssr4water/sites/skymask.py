@@ -112,6 +112,14 @@ def masked_fast(polygon,elevation,azimuth) -> bool:
     #print 'intersections =', intersections
     return intersections & 1
 
+@jit(nopython=True)
+def masked_fast_array(polygon,elevation,azimuth):
+    """Apply masked_fast to arrays of points, returns a boolean array which is set for points inside (or on) the polygon"""
+    inside=np.empty(len(elevation),dtype=np.bool_)
+    for i in range(len(elevation)):
+        inside[i]=masked_fast(polygon,elevation[i],azimuth[i]) != 0
+    return inside
+
 
 
 class SkyMask:
@@ -230,7 +238,9 @@ class SkyMask:
         """
         returns a boolean array
         """
-        return np.array([self.masked(el,az) for el,az in zip(elevation,azimuth)])
+        if type(self).masked is SkyMask.masked:
+            return ~masked_fast_array(self._poly,np.asarray(elevation),np.asarray(azimuth))
+        return np.array([self.masked(el,az) for el,az in zip(elevation,azimuth)],dtype=bool)
         
     def weights(self,azimuth,elevation):
 
@@ -373,5 +383,14 @@ class SimpleMask(SkyMask):
         #ok point is not masked
         return False
 
+    def isMasked(self,elevation,azimuth):
+        """
+        returns a boolean array
+        """
+        elevation=np.asarray(elevation)
+        azimuth=np.asarray(azimuth)
+        azimuth=np.where(azimuth < 0,azimuth+360,azimuth)
+        return (elevation < self.elevBnds[0]) | (elevation > self.elevBnds[1]) | (azimuth < self.azBnds[0]) | (azimuth > self.azBnds[1])
+
     
 
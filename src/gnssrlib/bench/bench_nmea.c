@@ -0,0 +1,384 @@
+/*# This file is part of gnssr4water*/
+/*# gnssr4water is free software; you can redistribute it and/or*/
+/*# modify it under the terms of the GNU Lesser General Public*/
+/*# License as published by the Free Software Foundation; either*/
+/*# version 3 of the License, or (at your option) any later version.*/
+
+/*# gnssr4water is distributed in the hope that it will be useful,*/
+/*# but WITHOUT ANY WARRANTY; without even the implied warranty of*/
+/*# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU*/
+/*# Lesser General Public License for more details.*/
+
+/*# You should have received a copy of the GNU Lesser General Public*/
+/*# License along with gnssr4water if not, write to the Free Software*/
+/*# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA*/
+
+/*# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2025*/
+
+///Microbenchmark of the NMEA line parser: the single pass tokenizer versus the previous strchr/atof based parser
+///The parsed values of both parsers are compared as well (the seconds may differ slightly, as the previous parser rounded the time stamp to a float)
+///Usage: bench_nmea [file.nmea] [repetitions] (a synthetic log is generated when no file is provided)
+
+#define _POSIX_C_SOURCE 200809L
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <time.h>
+#include "src/gnssrlib.h"
+#include "src/nmea.h"
+
+///////////////////////////// previous parser //////////////////////////////////
+
+static unsigned char legacy_checksum_range(const char * nmea,size_t slen){
+	unsigned char xorval=nmea[1];
+	for (size_t i=2;i<slen-3;i++){
+		xorval=xorval^nmea[i];
+	}
+	return xorval;
+}
+
+static int legacy_hexval(const char c){
+	if (c >= '0' && c <= '9'){
+	    return c-'0';
+	}else if (c >= 'A' && c <= 'F'){
+	    return c-'A'+10;
+	}else if (c >= 'a' && c <= 'f'){
+	    return c-'a'+10;
+	}
+	return -1;
+}
+
+static nmea_type legacy_check_nmea_len(const char * nmea, size_t *slen){
+	size_t len=*slen;
+	if (len == 0 || nmea[0] != '$'){
+		return NMEA_INVALID;
+	}
+	while (len > 0 && (nmea[len-1] == '\n' || nmea[len-1] == '\r')){
+		len--;
+	}
+	*slen=len;
+	if (len < 9 || nmea[len-3] != '*'){
+		return NMEA_INVALID;
+	}
+	int hi=legacy_hexval(nmea[len-2]);
+	int lo=legacy_hexval(nmea[len-1]);
+	if (hi < 0 || lo < 0 ){
+		return NMEA_INVALID;
+	}
+	if ( legacy_checksum_range(nmea,len) != (unsigned char) (hi*16+lo)){
+		return NMEA_INVALID;
+	}
+	if (strncmp(nmea+3,"RMC",3)==0){
+		return NMEA_RMC;
+	}else if (strncmp(nmea+3,"GGA",3)==0){
+	    return NMEA_GGA;
+	}else if (strncmp(nmea+3,"GSV",3)==0){
+	    return NMEA_GSV;
+	}
+	return NMEA_UNSUPPORTED;
+}
+
+static int legacy_shift_to_komma(const  char ** nmeaPtr,const char ** kommaPtr,const char * end,int skip){
+	for (int i=0;i<skip;i++){
+	    if (*kommaPtr!=NULL){
+		*nmeaPtr=*kommaPtr+1;
+	    }
+	    *kommaPtr=memchr(*nmeaPtr,',',end-*nmeaPtr);
+	    if (*kommaPtr==NULL){
+		return GNSSR_IO_ERROR;
+	    }
+	}
+    return GNSSR_SUCCESS;
+}
+
+static int legacy_parse_2digits(const char * nmeaPtr, const char * end, int * val){
+	if (nmeaPtr+2 > end || nmeaPtr[0] < '0' || nmeaPtr[0] > '9' || nmeaPtr[1] < '0' || nmeaPtr[1] > '9'){
+		return GNSSR_IO_ERROR;
+	}
+	*val=(nmeaPtr[0]-'0')*10+(nmeaPtr[1]-'0');
+	return GNSSR_SUCCESS;
+}
+
+static float legacy_convert_deg(const float deg){
+	const float cconv=(1.0-100.0/60);
+	return deg/60 + cconv*(int)(deg/100);
+}
+
+static int legacy_update_nmea_RMC(const char * nmea, size_t slen, nmea_cycle *data){
+	const char * nmeaPtr=nmea;
+	const char * end=nmea+slen;
+	const char* kommaPtr=NULL;
+	if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,2) == GNSSR_IO_ERROR){
+	    return GNSSR_IO_ERROR;
+	}
+	float tstamp=atof(nmeaPtr);
+	data->hr=(int)(tstamp/10000);
+	data->min=(int)((tstamp-data->hr*10000)/100);
+	float sec=tstamp-data->hr*10000-data->min*100;
+	data->sec=(int)sec;
+	data->usec=lroundf((sec-data->sec)*1e6f);
+	if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,1) == GNSSR_IO_ERROR){
+	    return GNSSR_IO_ERROR;
+	}
+	data->status=*(nmeaPtr);
+	if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,1) == GNSSR_IO_ERROR){
+	    return GNSSR_IO_ERROR;
+	}
+	float deg=atof(nmeaPtr);
+	deg=legacy_convert_deg(deg);
+	if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,1) == GNSSR_IO_ERROR){
+	    return GNSSR_IO_ERROR;
+	}
+	data->lat=*(nmeaPtr)=='S'?-deg:deg;
+	if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,1) == GNSSR_IO_ERROR){
+	    return GNSSR_IO_ERROR;
+	}
+	deg=atof(nmeaPtr);
+	deg=legacy_convert_deg(deg);
+	if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,1) == GNSSR_IO_ERROR){
+	    return GNSSR_IO_ERROR;
+	}
+	data->lon=*(nmeaPtr)=='W'?-deg:deg;
+	if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,3) == GNSSR_IO_ERROR){
+	    return GNSSR_IO_ERROR;
+	}
+	if (legacy_parse_2digits(nmeaPtr,end,&data->day) == GNSSR_SUCCESS && legacy_parse_2digits(nmeaPtr+2,end,&data->month) == GNSSR_SUCCESS){
+		legacy_parse_2digits(nmeaPtr+4,end,&data->year);
+	}
+	if (data->year < 80){
+		data->year+=2000;
+	}
+	return GNSSR_SUCCESS;
+}
+
+static int legacy_update_nmea_GSV(const char * nmea, size_t slen, nmea_cycle *data){
+	const char * nmeaPtr=nmea;
+	const char * end=nmea+slen;
+	const char* kommaPtr=NULL;
+	if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,4) == GNSSR_IO_ERROR){
+	    return GNSSR_IO_ERROR;
+	}
+	int stop=0;
+	for (int i=0 ;i<4;++i){
+	    if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,1) == GNSSR_IO_ERROR){
+		return GNSSR_SUCCESS;
+	    }
+	    int prn=atoi(nmeaPtr);
+	    if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,1) == GNSSR_IO_ERROR){
+		return GNSSR_IO_ERROR;
+	    }
+	    float elev=atof(nmeaPtr);
+	    if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,1) == GNSSR_IO_ERROR){
+		return GNSSR_IO_ERROR;
+	    }
+	    float az=atof(nmeaPtr);
+	    if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,1) == GNSSR_IO_ERROR){
+		stop=1;
+	    }
+	    float cnr0=atof(nmeaPtr);
+	    int idx=data->sats_in_view;
+	    data->prn[idx]=prn;
+	    data->elevation[idx]=elev;
+	    data->azimuth[idx]=az;
+	    data->cnr0[idx]=cnr0;
+	    data->sats_in_view++;
+	    if (data->sats_in_view >= NMEA_GSV_MAX_SATELLITES){
+		data->sats_in_view=0;
+	    }
+	    if (stop){
+		return GNSSR_SUCCESS;
+	    }
+	}
+    return GNSSR_SUCCESS;
+}
+
+static int legacy_update_nmea_GGA(const char * nmea, size_t slen, nmea_cycle *data){
+	const char * nmeaPtr=nmea;
+	const char * end=nmea+slen;
+	const char* kommaPtr=NULL;
+	if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,10) == GNSSR_IO_ERROR){
+	    return GNSSR_IO_ERROR;
+	}
+	data->ortho_height=atof(nmeaPtr);
+	if (legacy_shift_to_komma(&nmeaPtr,&kommaPtr,end,2) == GNSSR_IO_ERROR){
+	    return GNSSR_IO_ERROR;
+	}
+	data->geoid_height=atof(nmeaPtr);
+	return GNSSR_SUCCESS;
+}
+
+static int legacy_parse_line(const char * line, size_t slen, nmea_cycle *data){
+	switch (legacy_check_nmea_len(line,&slen)){
+	    case NMEA_GSV:
+		return legacy_update_nmea_GSV(line,slen,data);
+	    case NMEA_RMC:
+		return legacy_update_nmea_RMC(line,slen,data);
+	    case NMEA_GGA:
+		legacy_update_nmea_GGA(line,slen,data);
+		return GNSSR_SUCCESS;
+	    default:
+		return GNSSR_SUCCESS;
+	}
+}
+
+///////////////////////////// current parser //////////////////////////////////
+
+static int parse_line(const char * line, size_t slen, nmea_cycle *data){
+	nmea_fields fields;
+	switch (tokenize_nmea(line,&slen,&fields)){
+	    case NMEA_GSV:
+		return update_nmea_GSV(line,&fields,data,NULL);
+	    case NMEA_RMC:
+		return update_nmea_RMC(line,&fields,data);
+	    case NMEA_GGA:
+		update_nmea_GGA(line,&fields,data);
+		return GNSSR_SUCCESS;
+	    default:
+		return GNSSR_SUCCESS;
+	}
+}
+
+///////////////////////////// benchmark //////////////////////////////////
+
+static void append_line(char **buf, size_t *len, size_t *nalloc, const char *body){
+	unsigned char chk=0;
+	for (const char *c=body;*c;c++){
+	    chk^=*c;
+	}
+	if (*len+128 > *nalloc){
+	    *nalloc=*nalloc?2*(*nalloc):1<<20;
+	    *buf=realloc(*buf,*nalloc);
+	}
+	*len+=sprintf(*buf+*len,"$%s*%02X\r\n",body,chk);
+}
+
+///Generate a synthetic log with (fractional) time stamps, southern/western positions and empty fields
+static char * synthetic_log(int ncycles, size_t *len){
+	char *buf=NULL;
+	size_t nalloc=0;
+	char body[128];
+	*len=0;
+	srand(1);
+	for (int i=0;i<ncycles;i++){
+	    const char *talkers[2]={"GP","GL"};
+	    for (int t=0;t<2;t++){
+		for (int m=0;m<3;m++){
+		    int n=sprintf(body,"%sGSV,3,%d,12",talkers[t],m+1);
+		    for (int k=0;k<4;k++){
+			if (rand()%50 == 0){
+			    n+=sprintf(body+n,",%02d,,,",rand()%32+1);
+			}else{
+			    n+=sprintf(body+n,",%02d,%02d,%03d,%02d",rand()%32+1,rand()%90,rand()%360,rand()%50);
+			}
+		    }
+		    append_line(&buf,len,&nalloc,body);
+		}
+	    }
+	    int sec=i%86400;
+	    sprintf(body,"GNGGA,%02d%02d%02d.%02d,5213.%04d,S,00651.%04d,W,1,12,0.9,%d.%d,M,-%d.%d,M,,",sec/3600,(sec/60)%60,sec%60,rand()%100,rand()%10000,rand()%10000,rand()%100,rand()%10,rand()%100,rand()%10);
+	    append_line(&buf,len,&nalloc,body);
+	    sprintf(body,"GNRMC,%02d%02d%02d.%02d,A,5213.%04d,S,00651.%04d,W,0.0,0.0,170224,,,A",sec/3600,(sec/60)%60,sec%60,rand()%100,rand()%10000,rand()%10000);
+	    append_line(&buf,len,&nalloc,body);
+	}
+	return buf;
+}
+
+static double now(){
+	struct timespec ts;
+	clock_gettime(CLOCK_MONOTONIC,&ts);
+	return ts.tv_sec+1e-9*ts.tv_nsec;
+}
+
+///Parse all lines of the buffer, returns the amount of lines
+static size_t parse_buffer(const char *buf, size_t len, int (*parse)(const char*,size_t,nmea_cycle*), nmea_cycle *cycles, size_t maxcycles, size_t *ncycles){
+	nmea_cycle data;
+	size_t nlines=0;
+	const char *ptr=buf;
+	const char *end=buf+len;
+	*ncycles=0;
+	init_nmea_cycle(&data);
+	while (ptr < end){
+	    const char *nl=memchr(ptr,'\n',end-ptr);
+	    size_t slen=nl?(size_t)(nl+1-ptr):(size_t)(end-ptr);
+	    parse(ptr,slen,&data);
+	    nlines++;
+	    if (slen > 6 && strncmp(ptr+3,"RMC",3) == 0){
+		if (*ncycles < maxcycles){
+		    memcpy(&cycles[*ncycles],&data,sizeof(data));
+		}
+		(*ncycles)++;
+		init_nmea_cycle(&data);
+	    }
+	    ptr+=slen;
+	}
+	return nlines;
+}
+
+static int compare_cycles(const nmea_cycle *a, const nmea_cycle *b){
+	if (a->year != b->year || a->month != b->month || a->day != b->day || a->hr != b->hr || a->min != b->min || fabs((a->sec-b->sec)+1e-6*(a->usec-b->usec)) > 1.0/64){
+	    return 1;
+	}
+	//note: the legacy parser converts the coordinates in single precision
+	if (fabs(a->lat-b->lat) > 1e-4 || fabs(a->lon-b->lon) > 1e-4 || a->ortho_height != b->ortho_height || a->geoid_height != b->geoid_height || a->sats_in_view != b->sats_in_view){
+	    return 1;
+	}
+	for (int i=0;i<a->sats_in_view;i++){
+	    if (a->prn[i] != b->prn[i] || a->elevation[i] != b->elevation[i] || a->azimuth[i] != b->azimuth[i] || a->cnr0[i] != b->cnr0[i]){
+		return 1;
+	    }
+	}
+	return 0;
+}
+
+int main(int argc, char *argv[]){
+	char *buf=NULL;
+	size_t len=0;
+	int nrep=argc > 2?atoi(argv[2]):5;
+	if (argc > 1){
+	    FILE *fid=fopen(argv[1],"rb");
+	    if (fid == NULL){
+		fprintf(stderr,"Could not open %s\n",argv[1]);
+		return 1;
+	    }
+	    fseek(fid,0,SEEK_END);
+	    len=ftell(fid);
+	    fseek(fid,0,SEEK_SET);
+	    buf=malloc(len);
+	    if (fread(buf,1,len,fid) != len){
+		fprintf(stderr,"Could not read %s\n",argv[1]);
+		return 1;
+	    }
+	    fclose(fid);
+	}else{
+	    buf=synthetic_log(86400,&len);
+	}
+
+	const size_t maxcycles=100000;
+	nmea_cycle *ref=malloc(maxcycles*sizeof(nmea_cycle));
+	nmea_cycle *cycles=malloc(maxcycles*sizeof(nmea_cycle));
+	size_t nref,ncycles,nlines=0;
+	double tlegacy=INFINITY,tcurrent=INFINITY;
+	for (int irep=0;irep<nrep;irep++){
+	    double t0=now();
+	    nlines=parse_buffer(buf,len,legacy_parse_line,ref,maxcycles,&nref);
+	    double t1=now();
+	    parse_buffer(buf,len,parse_line,cycles,maxcycles,&ncycles);
+	    double t2=now();
+	    tlegacy=fmin(tlegacy,t1-t0);
+	    tcurrent=fmin(tcurrent,t2-t1);
+	}
+
+	size_t ndiff=nref != ncycles;
+	for (size_t i=0;i<ncycles && i<nref && i<maxcycles;i++){
+	    ndiff+=compare_cycles(&ref[i],&cycles[i]);
+	}
+	printf("%zu lines, %zu cycles (%.1f MB)\n",nlines,ncycles,len*1e-6);
+	printf("previous parser: %8.1f ns/line %8.1f MB/s\n",1e9*tlegacy/nlines,len*1e-6/tlegacy);
+	printf("tokenizer:       %8.1f ns/line %8.1f MB/s (speedup %.2f)\n",1e9*tcurrent/nlines,len*1e-6/tcurrent,tlegacy/tcurrent);
+	printf("differing cycles: %zu\n",ndiff);
+	free(buf);
+	free(ref);
+	free(cycles);
+	return ndiff != 0;
+}
@@ -18,29 +18,49 @@
 
 from cython.operator cimport dereference as deref
 from libc.stdlib cimport malloc, free
+from libc.string cimport memcpy
+from libc.stdint cimport int8_t, int64_t, uint32_t, uint64_t
 from datetime import datetime,timedelta
 import numpy as np
+import os
+from gnssr4water.core.logger import log
 
 cdef extern from "src/stream.h" nogil:
     cdef const int _GNSSR_SUCCESS "GNSSR_SUCCESS"
     cdef const int _GNSSR_IO_ERROR "GNSSR_IO_ERROR"
     cdef const int _GNSSR_EOF "GNSSR_EOF"
+    cdef const int _GNSSR_AGAIN "GNSSR_AGAIN"
     struct gnssrstream:
-        pass
+        int follow
     int open_stream(const char * filename, gnssrstream* gz)
+    int open_stream_follow(const char * filename, gnssrstream* gz)
+    int open_stream_fd(int fd, gnssrstream* gz)
+    int open_stream_buffer(const char *data, size_t size, const char *compression, gnssrstream* gz)
     void close_stream(gnssrstream *gz)
     int readline(gnssrstream *gz, char * line,size_t slen)
+    struct gzaccess:
+        int64_t out
+        int64_t in_ "in"
+        int bits
+        unsigned char window[32768]
+    int seek_stream(gnssrstream *gz, int64_t pos, const gzaccess *point)
+    int index_stream_access(const char *filename, int64_t span, gzaccess **list, int *npoints)
+    int set_stream_threads(gnssrstream *gz, int nthreads)
+    int set_stream_chunksize(gnssrstream *gz, size_t chunksize)
+    int recompress_stream_zstd(const char *filename, const char *outfile, int level, size_t framesize)
 
 cdef extern from "src/gnssrlib.h" nogil:
     cdef struct _gnss_system "gnss_system":
         char * system,
         double frequency,
         double length,
-        double bandwidth
+        double bandwidth,
+        int code
     # cdef void init_GNSS(_gnss_system * system, const char * sysname)
     cdef _gnss_system gnss_gpsl1
     cdef _gnss_system gnss_gpsl2
     cdef _gnss_system gnss_glonassiil1
+    cdef _gnss_system gnss_unknown
     cdef void copy_GNSS_as(_gnss_system *sys, const _gnss_system * sysfrom);
 
 cdef extern from "src/nmea.h" nogil:
@@ -51,10 +71,11 @@ cdef extern from "src/nmea.h" nogil:
         int day,
         int hr,
         int min,
-        float sec,
+        int sec,
+        int usec,
         char status,
-        float lat,
-        float lon,
+        double lat,
+        double lon,
         float ortho_height,
         float geoid_height,
         int sats_in_view,
@@ -62,7 +83,31 @@ cdef extern from "src/nmea.h" nogil:
         int prn[_NMEA_GSV_MAX_SATELLITES],
         float elevation[_NMEA_GSV_MAX_SATELLITES],
         float azimuth[_NMEA_GSV_MAX_SATELLITES],
-        float cnr0[_NMEA_GSV_MAX_SATELLITES]
+        float cnr0[_NMEA_GSV_MAX_SATELLITES],
+        int nmasked,
+        int masked_prn[_NMEA_GSV_MAX_SATELLITES],
+        int masked_pos[_NMEA_GSV_MAX_SATELLITES]
+
+    struct _nmea_batch "nmea_batch":
+        int maxcycles,
+        int maxsats,
+        int ncycles,
+        int nsats,
+        int64_t *epoch,
+        int64_t *offset,
+        double *lat,
+        double *lon,
+        float *ortho_height,
+        float *geoid_height,
+        int *prn,
+        int8_t *system,
+        float *elevation,
+        float *azimuth,
+        float *cnr0,
+        int nmasked,
+        int64_t *masked_offset,
+        int *masked_prn,
+        int *masked_pos
 
     cpdef enum nmea_type:
         NMEA_GGA,
@@ -79,6 +124,43 @@ cdef extern from "src/nmea.h" nogil:
     nmea_type check_nmea(char * nmea) 
     int read_nmea_cycle(gnssrstream *sid, _nmea_cycle * data);
     int init_nmea_cycle(_nmea_cycle * data)
+    int64_t nmea_cycle_epoch(const _nmea_cycle * data)
+    struct nmea_filter:
+        int64_t start
+        int64_t end
+        int64_t end_offset
+        uint32_t systems
+        int use_prns
+        uint64_t prns[4]
+        float min_elevation
+        float max_elevation
+        float min_cnr0
+        int skip_empty
+        int merge_void
+        int npoly
+        const double *poly
+    void init_nmea_filter(nmea_filter * filter)
+    int read_nmea_cycle_filter(gnssrstream *sid, _nmea_cycle * data, const nmea_filter * filter)
+    int read_nmea_batch(gnssrstream *sid, _nmea_batch * batch, const nmea_filter * filter)
+    int get_nmea_batch_cycle(const _nmea_batch * batch, int icycle, _nmea_cycle * data)
+    struct nmea_checkpoint:
+        int64_t pos
+        int64_t first
+        int64_t last
+    int index_nmea_stream(gnssrstream *sid, int64_t span, nmea_checkpoint **list, int *npoints)
+    struct nmea_scan:
+        int64_t first
+        int64_t last
+        int64_t ncycles
+        int64_t nlines
+        int64_t ninvalid
+        int64_t nbackward
+        int ntalkers
+        char talkers[16][3]
+        int ngaps
+        int64_t *gaps
+    int scan_nmea_stream(gnssrstream *sid, int64_t mingap, nmea_scan *scan)
+    void free_nmea_scan(nmea_scan *scan)
 
 cdef class gnss_sys:
     cdef _gnss_system* system_ptr
@@ -110,26 +192,240 @@ cdef class gnss_sys:
     def length(self):
         return deref(self.system_ptr).length
     
+    @property
+    def code(self):
+        return deref(self.system_ptr).code
+
+    @staticmethod
+    def from_code(code):
+        """Retrieve the (shared) GNSS system object belonging to a system code"""
+        return _systems_by_code.get(code,UNKNOWN)
+    
 GPSL1=gnss_sys.from_(gnss_gpsl1)
 GPSL2=gnss_sys.from_(gnss_gpsl2)
 GLONASSIIL1=gnss_sys.from_(gnss_glonassiil1)
+UNKNOWN=gnss_sys.from_(gnss_unknown)
+
+_systems_by_code={sys.code:sys for sys in [GPSL1,GPSL2,GLONASSIIL1,UNKNOWN]}
+
+#systems assigned to the satellites of GSV messages with a given talker id
+_talkers={"GP":GPSL1,"GL":GLONASSIIL1}
+
+def _system_code(system):
+    """Retrieve the system code of a gnss_sys object, system name (e.g. 'GPSL1'), talker id (e.g. 'GP') or code"""
+    if isinstance(system,gnss_sys):
+        return system.code
+    if isinstance(system,str):
+        if system in _talkers:
+            return _talkers[system].code
+        for sys in _systems_by_code.values():
+            if sys.system == system:
+                return sys.code
+        raise ValueError(f"Unknown GNSS system {system}")
+    return int(system)
+
+def _normalize_filters(filters):
+    """Convert selection criteria to the layout needed by the C filter (the returned dict must be kept alive while the filter is used)"""
+    filters=dict(filters)
+    if filters.get("mask",None) is not None:
+        filters["mask"]=np.ascontiguousarray(filters["mask"],dtype=np.float64)
+    return filters
+
+cdef int _fill_filter(nmea_filter *filt,dict filters) except -1:
+    """Translate a dictionary with selection criteria (see NMEAFile.set_filter) into a C filter
+        Note: the filter points to the polygon of the mask, so normalize the filters first (see _normalize_filters) and keep them alive while using the filter
+    """
+    cdef int prn
+    cdef const double[:,::1] polyview
+    init_nmea_filter(filt)
+    for ky,val in filters.items():
+        if val is None:
+            continue
+        if ky == "start":
+            filt.start=_to_epoch(val)
+        elif ky == "end":
+            filt.end=_to_epoch(val)
+        elif ky == "end_offset":
+            filt.end_offset=val
+        elif ky == "systems":
+            if isinstance(val,(str,gnss_sys,int)):
+                val=[val]
+            for system in val:
+                filt.systems |= (<uint32_t>1) << _system_code(system)
+        elif ky == "prns":
+            filt.use_prns=1
+            for prn in val:
+                if prn < 0 or prn > 255:
+                    raise ValueError(f"PRN {prn} is out of range")
+                filt.prns[prn >> 6] |= (<uint64_t>1) << (prn & 63)
+        elif ky == "min_elevation":
+            filt.min_elevation=val
+        elif ky == "max_elevation":
+            filt.max_elevation=val
+        elif ky == "min_cnr0":
+            filt.min_cnr0=val
+        elif ky == "skip_empty":
+            filt.skip_empty=bool(val)
+        elif ky == "merge_void":
+            filt.merge_void=bool(val)
+        elif ky == "mask":
+            poly=val
+            if poly.ndim != 2 or poly.shape[1] != 2 or poly.shape[0] < 4 or not poly.flags.c_contiguous or poly.dtype != np.float64:
+                raise ValueError("The sky mask must be a closed polygon of at least 3 (azimuth,elevation) vertices")
+            polyview=poly
+            filt.npoly=poly.shape[0]
+            filt.poly=&polyview[0,0]
+        else:
+            raise ValueError(f"Unknown filter {ky}")
+    return 0
+
+cdef dict _alloc_batch(int ncycles,_nmea_batch *batch):
+    """Allocate numpy arrays to hold a columnar batch of cycles and let the C struct point to them"""
+    cdef int nsats=ncycles*_NMEA_GSV_MAX_SATELLITES
+    cols={"epoch":np.empty(ncycles,dtype=np.int64),
+          "offset":np.empty(ncycles+1,dtype=np.int64),
+          "lat":np.empty(ncycles,dtype=np.float64),
+          "lon":np.empty(ncycles,dtype=np.float64),
+          "ortho_height":np.empty(ncycles,dtype=np.float32),
+          "geoid_height":np.empty(ncycles,dtype=np.float32),
+          "prn":np.empty(nsats,dtype=np.intc),
+          "system":np.empty(nsats,dtype=np.int8),
+          "elevation":np.empty(nsats,dtype=np.float32),
+          "azimuth":np.empty(nsats,dtype=np.float32),
+          "cnr0":np.empty(nsats,dtype=np.float32),
+          "masked_offset":np.empty(ncycles+1,dtype=np.int64),
+          "masked_prn":np.empty(nsats,dtype=np.intc),
+          "masked_pos":np.empty(nsats,dtype=np.intc)}
+    _wrap_batch(cols,batch)
+    batch.ncycles=0
+    batch.nsats=0
+    batch.nmasked=0
+    return cols
+
+cdef dict _wrap_batch(dict cols,_nmea_batch *batch):
+    """Let the C struct point to the arrays of a columnar batch (arrays are converted to the expected type and layout when needed)"""
+    cols={"epoch":np.ascontiguousarray(cols["epoch"],dtype=np.int64),
+          "offset":np.ascontiguousarray(cols["offset"],dtype=np.int64),
+          "lat":np.ascontiguousarray(cols["lat"],dtype=np.float64),
+          "lon":np.ascontiguousarray(cols["lon"],dtype=np.float64),
+          "ortho_height":np.ascontiguousarray(cols["ortho_height"],dtype=np.float32),
+          "geoid_height":np.ascontiguousarray(cols["geoid_height"],dtype=np.float32),
+          "prn":np.ascontiguousarray(cols["prn"],dtype=np.intc),
+          "system":np.ascontiguousarray(cols["system"],dtype=np.int8),
+          "elevation":np.ascontiguousarray(cols["elevation"],dtype=np.float32),
+          "azimuth":np.ascontiguousarray(cols["azimuth"],dtype=np.float32),
+          "cnr0":np.ascontiguousarray(cols["cnr0"],dtype=np.float32),
+          #the masked satellites are optional
+          "masked_offset":np.ascontiguousarray(cols["masked_offset"],dtype=np.int64) if "masked_offset" in cols else np.zeros(len(cols["offset"]),dtype=np.int64),
+          "masked_prn":np.ascontiguousarray(cols.get("masked_prn",[]),dtype=np.intc),
+          "masked_pos":np.ascontiguousarray(cols.get("masked_pos",[]),dtype=np.intc)}
+    
+    cdef int64_t[::1] epoch=cols["epoch"]
+    cdef int64_t[::1] offset=cols["offset"]
+    cdef double[::1] lat=cols["lat"]
+    cdef double[::1] lon=cols["lon"]
+    cdef float[::1] ortho_height=cols["ortho_height"]
+    cdef float[::1] geoid_height=cols["geoid_height"]
+    cdef int[::1] prn=cols["prn"]
+    cdef int8_t[::1] system=cols["system"]
+    cdef float[::1] elevation=cols["elevation"]
+    cdef float[::1] azimuth=cols["azimuth"]
+    cdef float[::1] cnr0=cols["cnr0"]
+    cdef int64_t[::1] masked_offset=cols["masked_offset"]
+    cdef int[::1] masked_prn=cols["masked_prn"]
+    cdef int[::1] masked_pos=cols["masked_pos"]
+    
+    batch.maxcycles=epoch.shape[0]
+    batch.maxsats=prn.shape[0]
+    batch.ncycles=epoch.shape[0]
+    batch.nsats=prn.shape[0]
+    #note: the pointers are only dereferenced for non-empty batches
+    batch.epoch=&epoch[0] if epoch.shape[0] > 0 else NULL
+    batch.offset=&offset[0]
+    batch.lat=&lat[0] if lat.shape[0] > 0 else NULL
+    batch.lon=&lon[0] if lon.shape[0] > 0 else NULL
+    batch.ortho_height=&ortho_height[0] if ortho_height.shape[0] > 0 else NULL
+    batch.geoid_height=&geoid_height[0] if geoid_height.shape[0] > 0 else NULL
+    batch.prn=&prn[0] if prn.shape[0] > 0 else NULL
+    batch.system=&system[0] if system.shape[0] > 0 else NULL
+    batch.elevation=&elevation[0] if elevation.shape[0] > 0 else NULL
+    batch.azimuth=&azimuth[0] if azimuth.shape[0] > 0 else NULL
+    batch.cnr0=&cnr0[0] if cnr0.shape[0] > 0 else NULL
+    batch.nmasked=masked_prn.shape[0]
+    batch.masked_offset=&masked_offset[0]
+    batch.masked_prn=&masked_prn[0] if masked_prn.shape[0] > 0 else NULL
+    batch.masked_pos=&masked_pos[0] if masked_pos.shape[0] > 0 else NULL
+    return cols
+
+cdef dict _trim_batch(dict cols,_nmea_batch *batch):
+    """Restrict the columns to the filled part of the batch"""
+    trimmed={}
+    for ky,val in cols.items():
+        if ky in ("offset","masked_offset"):
+            trimmed[ky]=val[0:batch.ncycles+1]
+        elif ky in ("masked_prn","masked_pos"):
+            trimmed[ky]=val[0:batch.nmasked]
+        elif val.shape[0] == batch.maxcycles:
+            trimmed[ky]=val[0:batch.ncycles]
+        else:
+            trimmed[ky]=val[0:batch.nsats]
+    return trimmed
 
 
 cdef class gnss_cycle:
+    """Holds the satellites in view and receiver information of a single NMEA cycle
+    Note: the per satellite arrays (prn, elevation,...) are (read-only) views on the underlying C structure, which are valid until the next cycle is read into this object. Use to_arrays() to take a snapshot.
+    """
     cdef _nmea_cycle* cycle_ptr
+    cdef object _mem
+    cdef dict _cache
     def __cinit__(self):
-        self.cycle_ptr=<_nmea_cycle*>malloc(sizeof(_nmea_cycle))
+        #use numpy allocated memory so that views on the cycle keep the memory alive
+        self._mem=np.zeros(sizeof(_nmea_cycle),dtype=np.uint8)
+        cdef unsigned char[::1] mem=self._mem
+        self.cycle_ptr=<_nmea_cycle*>&mem[0]
         init_nmea_cycle(self.cycle_ptr)
+        self._cache={}
 
-    def __dealloc__(self):
-        if self.cycle_ptr is not NULL:
-            free(self.cycle_ptr)
+    cdef void _invalidate(self):
+        """Clear cached views and objects (to be called when the cycle is refilled)"""
+        self._cache.clear()
+    
+    cdef _view(self,void *ptr,dtype):
+        cdef size_t offset=<char*>ptr-<char*>self.cycle_ptr
+        view=np.frombuffer(self._mem,dtype=dtype,count=deref(self.cycle_ptr).sats_in_view,offset=offset)
+        view.flags.writeable=False
+        return view
+
+    cdef dict _views(self):
+        if "prn" not in self._cache:
+            self._cache["prn"]=self._view(&deref(self.cycle_ptr).prn[0],np.intc)
+            self._cache["elevation"]=self._view(&deref(self.cycle_ptr).elevation[0],np.float32)
+            self._cache["azimuth"]=self._view(&deref(self.cycle_ptr).azimuth[0],np.float32)
+            self._cache["cnr0"]=self._view(&deref(self.cycle_ptr).cnr0[0],np.float32)
+        return self._cache
+
+    cdef _masked_view(self,int *ptr):
+        cdef size_t offset=<char*>ptr-<char*>self.cycle_ptr
+        view=np.frombuffer(self._mem,dtype=np.intc,count=deref(self.cycle_ptr).nmasked,offset=offset)
+        view.flags.writeable=False
+        return view
 
     @property
     def time(self):
-        tm=datetime(deref(self.cycle_ptr).year,deref(self.cycle_ptr).month,deref(self.cycle_ptr).day,deref(self.cycle_ptr).hr,deref(self.cycle_ptr).min)+timedelta(seconds=deref(self.cycle_ptr).sec)
+        try:
+            return self._cache["time"]
+        except KeyError:
+            pass
+        tm=datetime(deref(self.cycle_ptr).year,deref(self.cycle_ptr).month,deref(self.cycle_ptr).day,deref(self.cycle_ptr).hr,deref(self.cycle_ptr).min)+timedelta(seconds=deref(self.cycle_ptr).sec,microseconds=deref(self.cycle_ptr).usec)
+        self._cache["time"]=tm
         return tm
     
+    @property
+    def epoch(self):
+        """Epoch of the cycle in nanoseconds since 1970-01-01"""
+        return nmea_cycle_epoch(self.cycle_ptr)
+    
     @property
     def sats_in_view(self):
         return deref(self.cycle_ptr).sats_in_view
@@ -150,40 +446,415 @@ cdef class gnss_cycle:
     def geoid_height(self):
         return deref(self.cycle_ptr).ortho_height
 
+    @property
+    def system_code(self):
+        cdef int i
+        try:
+            return self._cache["system_code"]
+        except KeyError:
+            pass
+        codes=np.array([deref(self.cycle_ptr).system[i].code for i in range(deref(self.cycle_ptr).sats_in_view)],dtype=np.int8)
+        self._cache["system_code"]=codes
+        return codes
+
     @property
     def system(self):
-        return np.asarray([gnss_sys.from_(deref(self.cycle_ptr).system[i]) for i in range(deref(self.cycle_ptr).sats_in_view)]) 
+        try:
+            return self._cache["system"]
+        except KeyError:
+            pass
+        systems=np.array([gnss_sys.from_code(code) for code in self.system_code],dtype=object)
+        self._cache["system"]=systems
+        return systems
 
     @property
     def prn(self):
-        cdef int [:] prn=deref(self.cycle_ptr).prn
-        return np.asarray(prn[0:deref(self.cycle_ptr).sats_in_view])
+        return self._views()["prn"]
 
     @property
     def azimuth(self):
-        cdef float [:] az=deref(self.cycle_ptr).azimuth
-        return np.asarray(az[0:deref(self.cycle_ptr).sats_in_view])
+        return self._views()["azimuth"]
 
     @property
     def elevation(self):
-        cdef float [:] elev=deref(self.cycle_ptr).elevation
-        return np.asarray(elev[0:deref(self.cycle_ptr).sats_in_view])
+        return self._views()["elevation"]
 
     @property
     def cnr0(self):
-        cdef float [:] cnr0=deref(self.cycle_ptr).cnr0
-        return np.asarray(cnr0[0:deref(self.cycle_ptr).sats_in_view])
+        return self._views()["cnr0"]
+
+    @property
+    def masked_prn(self):
+        """PRNs of the satellites which were rejected by the sky mask of the filter (see NMEAFile.set_filter)"""
+        if "masked_prn" not in self._cache:
+            self._cache["masked_prn"]=self._masked_view(&deref(self.cycle_ptr).masked_prn[0])
+        return self._cache["masked_prn"]
+
+    @property
+    def masked_pos(self):
+        """Amount of accepted satellites preceding each masked satellite in the original message order"""
+        if "masked_pos" not in self._cache:
+            self._cache["masked_pos"]=self._masked_view(&deref(self.cycle_ptr).masked_pos[0])
+        return self._cache["masked_pos"]
+
+    def to_arrays(self):
+        """Take a snapshot of the per satellite data of this cycle
+
+            Returns
+            -------
+            dict
+                Copies of the 'prn','system' (int8 system code),'elevation','azimuth' and 'cnr0' arrays
+        """
+        views=self._views()
+        return {"prn":views["prn"].copy(),"system":self.system_code.copy(),
+                "elevation":views["elevation"].copy(),"azimuth":views["azimuth"].copy(),
+                "cnr0":views["cnr0"].copy()}
+
+def concatenate_batches(batches):
+    """Concatenate a list of columnar batches (as returned by NMEAFile.readbatch) into a single batch
+        
+        Parameters
+        ----------
+        batches : list of dict
+            Columnar batches in chronological order (None entries are ignored)
+
+        Returns
+        -------
+        dict or None
+            Concatenated batch or None when no data is available
+    """
+    batches=[batch for batch in batches if batch is not None]
+    if len(batches) == 0:
+        return None
+    if len(batches) == 1:
+        return batches[0]
+    concat={}
+    for ky in batches[0].keys():
+        if ky in ("offset","masked_offset"):
+            #shift the satellite offsets of the subsequent batches
+            shifts=np.cumsum([0]+[batch[ky][-1] for batch in batches[:-1]])
+            concat[ky]=np.concatenate([batches[0][ky][0:1]]+[batch[ky][1:]+shift for batch,shift in zip(batches,shifts)])
+        else:
+            concat[ky]=np.concatenate([batch[ky] for batch in batches])
+    return concat
+
+def iter_cycles(batch):
+    """Iterate over the cycles of a columnar batch (see NMEAFile.readbatch)
+        Note: similar to NMEAFile.readcycles, the yielded gnss_cycle object is reused for every cycle
+
+        Parameters
+        ----------
+        batch : dict
+            columnar batch
+
+        Yields
+        -------
+        gnss_cycle
+    """
+    cdef _nmea_batch cbatch
+    cdef gnss_cycle cycle=gnss_cycle()
+    cdef int i
+    if batch is None:
+        return
+    #keep a reference to the (possibly converted) arrays while iterating
+    cols=_wrap_batch(batch,&cbatch)
+    for i in range(cbatch.ncycles):
+        if get_nmea_batch_cycle(&cbatch,i,cycle.cycle_ptr) != _GNSSR_SUCCESS:
+            raise ValueError(f"Cannot retrieve cycle {i} from batch")
+        cycle._invalidate()
+        if cycle.sats_in_view > 0 or deref(cycle.cycle_ptr).nmasked > 0:
+            yield cycle
+
+def index_filename(filename):
+    """Name of the sidecar file holding the time index of an NMEA file"""
+    return filename+".idx.npz"
+
+def _to_epoch(t):
+    """Convert a time (datetime, numpy.datetime64 or iso string) to nanoseconds since 1970-01-01"""
+    return int(np.datetime64(t,"ns").astype(np.int64))
+
+def build_index(filename,int64_t span=1048576):
+    """Scan an NMEA file and build a time index which allows seeking in the (decompressed) stream
+        
+        Parameters
+        ----------
+        filename : str
+            NMEA file (possibly compressed)
+        span : int
+            Approximate distance in uncompressed bytes between checkpoints
+
+        Returns
+        -------
+        dict
+            Checkpoints at the start of a cycle: 'pos' (uncompressed byte offset), 'first' and 'last' epoch (int64 nanoseconds since 1970-01-01) covered until the next checkpoint.
+            For gzip files, the access points 'ap_out','ap_in','ap_bits','ap_window' from which decompression can be restarted.
+            'size' and 'mtime' of the indexed file
+    """
+    cdef gnssrstream sid
+    cdef nmea_checkpoint *checkpoints=NULL
+    cdef gzaccess *points=NULL
+    cdef int npoints=0
+    cdef int naccess=0
+    cdef int err
+    cdef int i
+    bname=filename.encode('utf-8')
+    cdef const char *cname=bname
+    stat=os.stat(filename)
+    if open_stream(cname,&sid) != _GNSSR_SUCCESS:
+        raise ValueError(f"Error opening {filename}")
+    with nogil:
+        err=index_nmea_stream(&sid,span,&checkpoints,&npoints)
+        close_stream(&sid)
+    if err != _GNSSR_SUCCESS:
+        raise ValueError(f"Error indexing {filename}")
+    index={"pos":np.empty(npoints,dtype=np.int64),"first":np.empty(npoints,dtype=np.int64),"last":np.empty(npoints,dtype=np.int64)}
+    cdef int64_t[::1] pos=index["pos"]
+    cdef int64_t[::1] first=index["first"]
+    cdef int64_t[::1] last=index["last"]
+    for i in range(npoints):
+        pos[i]=checkpoints[i].pos
+        first[i]=checkpoints[i].first
+        last[i]=checkpoints[i].last
+    free(checkpoints)
+
+    with nogil:
+        err=index_stream_access(cname,span,&points,&naccess)
+    if err != _GNSSR_SUCCESS:
+        raise ValueError(f"Error building access points of {filename}")
+    index["ap_out"]=np.empty(naccess,dtype=np.int64)
+    index["ap_in"]=np.empty(naccess,dtype=np.int64)
+    index["ap_bits"]=np.empty(naccess,dtype=np.int8)
+    index["ap_window"]=np.empty([naccess,sizeof(points[0].window)],dtype=np.uint8)
+    cdef int64_t[::1] ap_out=index["ap_out"]
+    cdef int64_t[::1] ap_in=index["ap_in"]
+    cdef int8_t[::1] ap_bits=index["ap_bits"]
+    cdef unsigned char[:,::1] ap_window=index["ap_window"]
+    for i in range(naccess):
+        ap_out[i]=points[i].out
+        ap_in[i]=points[i].in_
+        ap_bits[i]=points[i].bits
+        memcpy(&ap_window[i,0],points[i].window,sizeof(points[i].window))
+    free(points)
+    index["size"]=np.int64(stat.st_size)
+    index["mtime"]=np.int64(stat.st_mtime_ns)
+    return index
+
+def save_index(index,filename):
+    """Store the time index of an NMEA file in its sidecar file"""
+    with open(index_filename(filename),'wb') as fid:
+        np.savez_compressed(fid,**index)
+
+def load_index(filename):
+    """Load the time index of an NMEA file from its sidecar file
+        
+        Returns
+        -------
+        dict or None
+            The index (see build_index) or None when the sidecar does not exist or is outdated
+    """
+    idxfile=index_filename(filename)
+    if not os.path.exists(idxfile):
+        return None
+    stat=os.stat(filename)
+    with np.load(idxfile) as data:
+        index={ky:data[ky] for ky in data.files}
+    if index["size"] != stat.st_size or index["mtime"] != stat.st_mtime_ns:
+        return None
+    return index
+
+def scan_nmea(filename,mingap=timedelta(seconds=10)):
+    """Quickly summarize an NMEA file: all checksums are validated, but only the times of the RMC messages are decoded
+        
+        Parameters
+        ----------
+        filename : str
+            NMEA file (possibly compressed)
+        mingap : timedelta or numpy.timedelta64
+            Report gaps between consecutive cycles which are longer than this
+
+        Returns
+        -------
+        dict
+            'first' and 'last' (earliest and latest cycle time as numpy.datetime64, NaT when the file holds no cycles), 
+            'ncycles', 'nlines' (non-empty lines), 'ninvalid' (lines which are not valid NMEA messages), 'nbackward' (cycles which are earlier than their predecessor),
+            'talkers' (talker ids of the GSV messages, e.g. ['GP','GL']), 'gaps' (array [n,2] with the cycle times bounding each gap)
+            and the 'size' and 'mtime' of the scanned file
+    """
+    cdef gnssrstream sid
+    cdef nmea_scan scan
+    cdef int err
+    cdef int i
+    cdef int64_t cgap=int(np.timedelta64(mingap,"ns").astype(np.int64))
+    bname=filename.encode('utf-8')
+    cdef const char *cname=bname
+    stat=os.stat(filename)
+    if open_stream(cname,&sid) != _GNSSR_SUCCESS:
+        raise ValueError(f"Error opening {filename}")
+    with nogil:
+        err=scan_nmea_stream(&sid,cgap,&scan)
+        close_stream(&sid)
+    if err != _GNSSR_SUCCESS:
+        raise ValueError(f"Error scanning {filename}")
+    gaps=np.empty([scan.ngaps,2],dtype=np.int64)
+    for i in range(scan.ngaps):
+        gaps[i,0]=scan.gaps[2*i]
+        gaps[i,1]=scan.gaps[2*i+1]
+    free_nmea_scan(&scan)
+    nat=np.datetime64("NaT","ns")
+    return {"first":np.datetime64(scan.first,"ns") if scan.ncycles > 0 else nat,
+            "last":np.datetime64(scan.last,"ns") if scan.ncycles > 0 else nat,
+            "ncycles":scan.ncycles,"nlines":scan.nlines,"ninvalid":scan.ninvalid,"nbackward":scan.nbackward,
+            "talkers":[scan.talkers[i].decode('ascii') for i in range(scan.ntalkers)],
+            "gaps":gaps.astype("datetime64[ns]"),
+            "size":stat.st_size,"mtime":stat.st_mtime_ns}
+
+def recompress_zstd(filename,outfile=None,int level=9,size_t framesize=4194304):
+    """Recompress a (gzip or lz4 compressed) NMEA file as zstd, which decompresses several times faster
+        The output consists of independent frames which end at line boundaries, so NMEAFile(outfile,nthreads=n) can decompress them in parallel.
+        Note: this requires gnssrlib to be built with zstd support (usezstd in setup.py)
+
+        Parameters
+        ----------
+        filename : str
+            Input file
+        outfile : str, optional
+            Output file (default: filename with the .gz/.lz4 extension replaced by .zst)
+        level : int
+            Zstd compression level
+        framesize : int
+            Approximate uncompressed size of the frames [bytes]
+
+        Returns
+        -------
+        str
+            Name of the output file
+    """
+    cdef int err
+    if outfile is None:
+        outfile=os.path.splitext(filename)[0] if filename.endswith((".gz",".lz4")) else filename
+        outfile+=".zst"
+    cdef bytes cname=filename.encode('utf-8')
+    cdef bytes coutname=outfile.encode('utf-8')
+    cdef const char *cfile=cname
+    cdef const char *cout=coutname
+    with nogil:
+        err=recompress_stream_zstd(cfile,cout,level,framesize)
+    if err != _GNSSR_SUCCESS:
+        raise ValueError(f"Error recompressing {filename} to {outfile}")
+    return outfile
 
 cdef class NMEAFile:
     cdef public int _eof 
     cdef gnssrstream _sid
     cdef public str name
-    def __init__(self, filename):
+    cdef public object index
+    cdef public dict filters
+    cdef object _buffer
+    cdef object _source
+    cdef bint _seekable
+    def __init__(self, filename, int nthreads=1, size_t chunksize=0, bint follow=False):
         self.name = filename
-        err = open_stream(self.name.encode('utf-8'),&self._sid)
+        if follow:
+            #keep reading appended cycles of a file which is still being written to
+            if filename.endswith((".gz",".lz4",".zst",".zstd")):
+                raise ValueError(f"Cannot follow compressed file {self.name}")
+            err = open_stream_follow(self.name.encode('utf-8'),&self._sid)
+        else:
+            err = open_stream(self.name.encode('utf-8'),&self._sid)
         if err is not 0:
             raise ValueError(f"Error opening {self.name}")
+        if nthreads > 1:
+            #decompress (zstd) frames in parallel
+            set_stream_threads(&self._sid,nthreads)
+        if chunksize > 0:
+            #amount of (lz4) data which is decompressed at once
+            set_stream_chunksize(&self._sid,chunksize)
         self._eof = 0
+        self.index = None
+        self.filters = {}
+        self._buffer = None
+        self._source = None
+        self._seekable = not follow
+
+    @staticmethod
+    def frombuffer(buf,compression=None,name="<buffer>",int nthreads=1,size_t chunksize=0):
+        """Parse NMEA data from memory (e.g. bytes received over the network) without writing a temporary file
+            The data is decoded directly from the buffer, which is kept alive by the returned object.
+
+            Parameters
+            ----------
+            buf : bytes, bytearray, memoryview or other contiguous buffer
+                Plain text NMEA data or a complete gzip, lz4 or zstd compressed file
+            compression : str, optional
+                'gzip', 'lz4', 'zstd' or 'none' (default: detected from the magic bytes of the data)
+            name : str
+                Name used in messages
+            nthreads : int
+                Number of threads used to decompress zstd frames in parallel
+            chunksize : int
+                Amount of bytes which are decompressed at once for lz4 data (default 16 KiB, the ring buffer holds two chunks)
+
+            Returns
+            -------
+            NMEAFile
+        """
+        cdef NMEAFile nmeaf=NMEAFile.__new__(NMEAFile)
+        cdef const unsigned char[::1] view
+        cdef const char *data=""
+        cdef const char *comp=NULL
+        cdef size_t size=0
+        view=memoryview(buf).cast("B")
+        size=view.shape[0]
+        if size > 0:
+            data=<const char*>&view[0]
+        if compression is not None:
+            compression=compression.encode('utf-8')
+            comp=compression
+        nmeaf.name = name
+        err = open_stream_buffer(data,size,comp,&nmeaf._sid)
+        if err is not 0:
+            raise ValueError(f"Error opening {nmeaf.name}")
+        if nthreads > 1:
+            set_stream_threads(&nmeaf._sid,nthreads)
+        if chunksize > 0:
+            set_stream_chunksize(&nmeaf._sid,chunksize)
+        nmeaf._eof = 0
+        nmeaf.index = None
+        nmeaf.filters = {}
+        nmeaf._buffer = view
+        nmeaf._source = None
+        nmeaf._seekable = False
+        return nmeaf
+
+    @staticmethod
+    def fromfd(source,name=None):
+        """Parse NMEA data from a file descriptor, such as a serial port, a pipe or a (TCP) socket
+            When the descriptor is non-blocking, readcycles and readbatch return the complete cycles which have been received so far, and continue where they left off on the next call.
+
+            Parameters
+            ----------
+            source : int or object with a fileno() method (e.g. a socket)
+                Descriptor to read from (it is not closed by the returned object, but the source is kept alive)
+            name : str, optional
+                Name used in messages
+
+            Returns
+            -------
+            NMEAFile
+        """
+        cdef NMEAFile nmeaf=NMEAFile.__new__(NMEAFile)
+        fd=source if isinstance(source,int) else source.fileno()
+        nmeaf.name = name if name is not None else f"<fd {fd}>"
+        err = open_stream_fd(fd,&nmeaf._sid)
+        if err is not 0:
+            raise ValueError(f"Error opening {nmeaf.name}")
+        nmeaf._eof = 0
+        nmeaf.index = None
+        nmeaf.filters = {}
+        nmeaf._buffer = None
+        nmeaf._source = source
+        nmeaf._seekable = False
+        return nmeaf
 
     def eof(self):
         return self._eof == 1
@@ -227,16 +898,209 @@ cdef class NMEAFile:
         self._eof = 1
         return StopIteration
 
-    def readcycles(self):
+    def set_filter(self,**filters):
+        """Set selection criteria which are applied while decoding, so that rejected satellites and cycles never reach python
+            The criteria are merged with earlier ones (use None to remove a criterion) and apply to readcycles, readbatch(es) and readall
+
+            Parameters
+            ----------
+            start : datetime, numpy.datetime64 or str, optional
+                Skip cycles before this time
+            end : datetime, numpy.datetime64 or str, optional
+                Stop reading at the first cycle at or after this time
+            end_offset : int, optional
+                Stop reading at the first cycle which starts at or after this uncompressed byte offset (e.g. a checkpoint 'pos' of the index, see seek_offset)
+            systems : list, optional
+                Accepted GNSS systems (gnss_sys objects, names such as 'GPSL1', NMEA talker ids 'GP','GL', or system codes)
+            prns : list of int, optional
+                Accepted satellite PRNs
+            min_elevation : float, optional
+                Minimum satellite elevation [degrees]
+            max_elevation : float, optional
+                Maximum satellite elevation [degrees]
+            min_cnr0 : float, optional
+                Minimum carrier to noise density ratio [dB-Hz]
+            skip_empty : bool, optional
+                Skip satellites with empty prn, elevation, azimuth or cnr0 fields (which are otherwise decoded as 0)
+            merge_void : bool, optional
+                Only end cycles at RMC messages with a valid fix (status 'A'): the satellites of void cycles are carried over to the next valid cycle
+            mask : array_like [n,2], optional
+                Sky mask as a closed polygon of (azimuth,elevation) vertices [degrees] (e.g. SkyMask._poly). 
+                Satellites outside of the mask (which passed the other criteria) are only reported in the masked_prn and masked_pos attributes of the cycle
+        """
+        cdef nmea_filter filt
+        filters=_normalize_filters({**self.filters,**filters})
+        #validate
+        _fill_filter(&filt,filters)
+        self.filters={ky:val for ky,val in filters.items() if val is not None}
+
+    def readbatch(self,int ncycles=10000,**filters):
+        """Read a batch of cycles into columnar numpy arrays
+            
+            Parameters
+            ----------
+            ncycles : int
+                Maximum number of cycles (with satellites in view) to read in this batch
+            **filters :
+                Additional selection criteria for this call (see set_filter)
+
+            Returns
+            -------
+            dict or None
+                Per cycle arrays: 'epoch' (int64 nanoseconds since 1970-01-01),'lat','lon' (float64),'ortho_height','geoid_height', 
+                per satellite arrays: 'prn','system' (int8 system code),'elevation','azimuth','cnr0', 
+                and 'offset' [ncycles+1], which holds the index of the first satellite of each cycle. 
+                Satellites rejected by a sky mask filter are stored in 'masked_prn', 'masked_pos' (see gnss_cycle.masked_pos) and 'masked_offset' [ncycles+1].
+                None is returned when no more cycles are available
+        """
+        cdef _nmea_batch batch
+        cdef nmea_filter filt
+        cdef gnssrstream *sid=&self._sid
+        cdef int err
+        if self._eof == 1:
+            return None
+        filters=_normalize_filters({**self.filters,**filters})
+        _fill_filter(&filt,filters)
+        cols=_alloc_batch(ncycles,&batch)
+        #decode without holding the GIL, so that multiple files can be decoded concurrently
+        with nogil:
+            err=read_nmea_batch(sid,&batch,&filt)
+        if err == _GNSSR_IO_ERROR or (err == _GNSSR_EOF and not sid.follow):
+            self._eof = 1
+        if batch.ncycles == 0:
+            return None
+        return _trim_batch(cols,&batch)
+
+    def readbatches(self,int ncycles=10000,start=None,**filters):
+        """Iterate over the stream in columnar batches of (at most) ncycles cycles (see readbatch)
+            When start is provided, the stream is first positioned using the time index (see seek_time)
+        """
+        if start is not None:
+            if self._seekable:
+                self.seek_time(start)
+            filters["start"]=start
+        batch=self.readbatch(ncycles,**filters)
+        while batch is not None:
+            yield batch
+            batch=self.readbatch(ncycles,**filters)
+        return StopIteration
+
+    def readall(self,int ncycles=10000,start=None,**filters):
+        """Read the remainder of the stream in a single columnar batch (see readbatches)"""
+        return concatenate_batches(list(self.readbatches(ncycles,start,**filters)))
+
+    def build_index(self,span=1048576,save=True):
+        """Build the time index of this file (see build_index) and possibly store it in a sidecar file
+            Note: the current position in the stream is not affected
+        """
+        if not self._seekable:
+            raise ValueError(f"Cannot build a time index of {self.name}, which is not a complete file")
+        self.index=build_index(self.name,span)
+        if save:
+            try:
+                save_index(self.index,self.name)
+            except OSError as exc:
+                log.warning(f"Could not write index file of {self.name}: {exc}")
+        return self.index
+
+    def get_index(self):
+        """Return the time index of this file (see build_index), which is loaded from the sidecar file, or built when not available"""
+        if not self._seekable:
+            raise ValueError(f"Cannot index {self.name}, which is not a complete file")
+        if self.index is None:
+            self.index=load_index(self.name)
+        if self.index is None:
+            self.build_index()
+        return self.index
+
+    def seek_time(self,t):
+        """Position the stream at (or shortly before) the cycle at time t
+            The index is loaded from the sidecar file, or built when not available.
+            For gzip files, decompression is restarted at the nearest preceding access point, so only a part of the file needs to be decoded.
+
+            Parameters
+            ----------
+            t : datetime, numpy.datetime64 or str
+                Requested time
+        """
+        cdef int64_t epoch=_to_epoch(t)
+        if not self._seekable:
+            raise ValueError(f"Cannot seek in {self.name}, use the start filter instead")
+        index=self.get_index()
+        #first checkpoint which covers cycles at or after t
+        i=np.searchsorted(index["last"],epoch,side="left")
+        if i >= len(index["pos"]):
+            #beyond the end of the file
+            self._eof = 1
+            return
+        self.seek_offset(index["pos"][i])
+
+    def seek_offset(self,int64_t pos):
+        """Position the stream at an uncompressed byte offset, which should be the start of a cycle (e.g. a checkpoint 'pos' of the index)
+            For gzip files, decompression is restarted at the nearest preceding access point of the index (see get_index)
+        """
+        cdef gzaccess point
+        cdef gzaccess *pointPtr=NULL
+        cdef unsigned char[::1] window
+        cdef int err
+        if not self._seekable:
+            raise ValueError(f"Cannot seek in {self.name}")
+        index=self.get_index()
+        j=np.searchsorted(index["ap_out"],pos,side="right")-1
+        if j >= 0:
+            point.out=index["ap_out"][j]
+            point.in_=index["ap_in"][j]
+            point.bits=index["ap_bits"][j]
+            window=np.ascontiguousarray(index["ap_window"][j])
+            memcpy(point.window,&window[0],sizeof(point.window))
+            pointPtr=&point
+        with nogil:
+            err=seek_stream(&self._sid,pos,pointPtr)
+        if err != _GNSSR_SUCCESS:
+            raise ValueError(f"Error seeking to offset {pos} in {self.name}")
+        self._eof = 0
+
+    def readcycles(self,start=None,end=None,**filters):
+        """Iterate over the cycles in the stream
+            Note: the yielded gnss_cycle object is reused for every cycle
+            For a followed file (NMEAFile(filename,follow=True)) or a non-blocking descriptor (NMEAFile.fromfd) the iteration stops at the last complete cycle, and continues from there with new data on the next call
+
+            Parameters
+            ----------
+            start : datetime, numpy.datetime64 or str, optional
+                Skip cycles before this time (the stream is first positioned using the time index, see seek_time)
+            end : datetime, numpy.datetime64 or str, optional
+                Stop at the first cycle at or after this time
+            **filters :
+                Additional selection criteria for this call (see set_filter)
+        """
         cdef gnss_cycle cycle=gnss_cycle()
         cdef int err=_GNSSR_SUCCESS
+        cdef gnssrstream *sid=&self._sid
+        cdef _nmea_cycle *cycle_ptr=cycle.cycle_ptr
+        cdef nmea_filter filt
+        if start is not None:
+            filters["start"]=start
+        if end is not None:
+            filters["end"]=end
+        filters=_normalize_filters({**self.filters,**filters})
+        _fill_filter(&filt,filters)
+        if start is not None and self._seekable:
+            self.seek_time(start)
+            if self._eof == 1:
+                return StopIteration
         while err == _GNSSR_SUCCESS:
-            err = read_nmea_cycle(&self._sid,cycle.cycle_ptr)
+            with nogil:
+                err = read_nmea_cycle_filter(sid,cycle_ptr,&filt)
+            cycle._invalidate()
             if err == _GNSSR_SUCCESS:
-                if cycle.sats_in_view > 0:
+                if cycle.sats_in_view > 0 or deref(cycle_ptr).nmasked > 0:
                     yield cycle
             elif err == _GNSSR_EOF:
-                self._eof = 1
+                if not sid.follow:
+                    self._eof = 1
+                break
+            elif err == _GNSSR_AGAIN:
+                #no more data available (yet) on a non-blocking descriptor
                 break
         return StopIteration
-
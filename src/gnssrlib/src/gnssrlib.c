@@ -29,4 +29,15 @@ void copy_GNSS_as(gnss_system *sys, const gnss_system * sysfrom){
 	memcpy(sys,sysfrom,sizeof(gnss_system));
 }
 
-
+const gnss_system * gnss_from_code(gnss_code code){
+	switch (code){
+	    case GNSS_CODE_GPSL1:
+		return &gnss_gpsl1;
+	    case GNSS_CODE_GPSL2:
+		return &gnss_gpsl2;
+	    case GNSS_CODE_GLONASSIIL1:
+		return &gnss_glonassiil1;
+	    default:
+		return &gnss_unknown;
+	}
+}
@@ -23,30 +23,47 @@
 
 #define SPEED_OF_LIGHT 299792458.0
 
-#define GNSS_BAND( FREQ, WMHZ, NAME )     \
+#define GNSS_BAND( FREQ, WMHZ, NAME, CODE )     \
 	{                             \
 	  .system=NAME,		      \
 	  .frequency=FREQ,              \
 	  .length=1e-6*SPEED_OF_LIGHT/FREQ,  \
-	  .bandwidth=1e6*WMHZ           \
+	  .bandwidth=1e6*WMHZ,           \
+	  .code=CODE                    \
 	};
 
-#define GPSL1 GNSS_BAND(1575.42,15.345,"GPSL1");
-#define GPSL2 GNSS_BAND(1227.6,11,"GPSL2");
-#define GPSL5 GNSS_BAND(1176.45,12.5,"GPSL5");
-
-
-#define QZSSL5  GNSS_BAND(1176.45,24,"QZSSL5");
-#define QZSSL2C GNSS_BAND(1227.6,11,"QZSSL2");
-#define QZSSE6 GNSS_BAND(1278.75,20,"QZSSE6");
-#define QZSSL1 GNSS_BAND(1575.42,12,"QZSSL1")
-
-#define GLONASSIL1 GNSS_BAND(1602,6.5,"GLONASSIL1");
-#define GLONASSIL2  GNSS_BAND(1246,5,"GLONASSIL2");
-#define GLONASSIIL1 GNSS_BAND(1575.42,6.5,"GLONASSIIL1");
-#define GLONASSIIL2 GNSS_BAND(1248.06,8.75,"GLONASSIIL2");
-
-#define GNSS_UNKNOWN GNSS_BAND(-1,-1,"UNKNOWN");
+///Compact integer codes of the GNSS bands (e.g. for use in columnar output)
+typedef enum gnss_code{
+	GNSS_CODE_UNKNOWN=0,
+	GNSS_CODE_GPSL1,
+	GNSS_CODE_GPSL2,
+	GNSS_CODE_GPSL5,
+	GNSS_CODE_QZSSL5,
+	GNSS_CODE_QZSSL2C,
+	GNSS_CODE_QZSSE6,
+	GNSS_CODE_QZSSL1,
+	GNSS_CODE_GLONASSIL1,
+	GNSS_CODE_GLONASSIL2,
+	GNSS_CODE_GLONASSIIL1,
+	GNSS_CODE_GLONASSIIL2
+}gnss_code;
+
+#define GPSL1 GNSS_BAND(1575.42,15.345,"GPSL1",GNSS_CODE_GPSL1);
+#define GPSL2 GNSS_BAND(1227.6,11,"GPSL2",GNSS_CODE_GPSL2);
+#define GPSL5 GNSS_BAND(1176.45,12.5,"GPSL5",GNSS_CODE_GPSL5);
+
+
+#define QZSSL5  GNSS_BAND(1176.45,24,"QZSSL5",GNSS_CODE_QZSSL5);
+#define QZSSL2C GNSS_BAND(1227.6,11,"QZSSL2",GNSS_CODE_QZSSL2C);
+#define QZSSE6 GNSS_BAND(1278.75,20,"QZSSE6",GNSS_CODE_QZSSE6);
+#define QZSSL1 GNSS_BAND(1575.42,12,"QZSSL1",GNSS_CODE_QZSSL1)
+
+#define GLONASSIL1 GNSS_BAND(1602,6.5,"GLONASSIL1",GNSS_CODE_GLONASSIL1);
+#define GLONASSIL2  GNSS_BAND(1246,5,"GLONASSIL2",GNSS_CODE_GLONASSIL2);
+#define GLONASSIIL1 GNSS_BAND(1575.42,6.5,"GLONASSIIL1",GNSS_CODE_GLONASSIIL1);
+#define GLONASSIIL2 GNSS_BAND(1248.06,8.75,"GLONASSIIL2",GNSS_CODE_GLONASSIIL2);
+
+#define GNSS_UNKNOWN GNSS_BAND(-1,-1,"UNKNOWN",GNSS_CODE_UNKNOWN);
 //possible other GNSS bands
 //  GNSS frequencies (source https://www.rfwireless-world.com/Terminology/GPS-Frequency-Band-and-GNSS-Frequency-Band.html)
 //# GLONASS II-L1 	1600.995MHz, 0.1874m,15.365MHz
@@ -80,6 +97,7 @@ struct gnss_system{
 	double frequency;
 	double length;
 	double bandwidth;
+	gnss_code code;
 };
 
 typedef struct gnss_system gnss_system; 
@@ -93,5 +111,6 @@ extern const gnss_system gnss_unknown;
 //
 //
 void copy_GNSS_as(gnss_system *sys, const gnss_system * sysfrom);
+const gnss_system * gnss_from_code(gnss_code code);
 
 #endif //GNSSRLIB_H
@@ -0,0 +1,357 @@
+/*# This file is part of gnssr4water*/
+/*# gnssr4water is free software; you can redistribute it and/or*/
+/*# modify it under the terms of the GNU Lesser General Public*/
+/*# License as published by the Free Software Foundation; either*/
+/*# version 3 of the License, or (at your option) any later version.*/
+
+/*# gnssr4water is distributed in the hope that it will be useful,*/
+/*# but WITHOUT ANY WARRANTY; without even the implied warranty of*/
+/*# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU*/
+/*# Lesser General Public License for more details.*/
+
+/*# You should have received a copy of the GNU Lesser General Public*/
+/*# License along with gnssr4water if not, write to the Free Software*/
+/*# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA*/
+
+/*# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2025*/
+
+#define _FILE_OFFSET_BITS 64
+#include <stdlib.h>
+#include <string.h>
+#include "gzstream.h"
+
+static gzstream* init_gzstream(FILE *fid, const void *data, size_t size){
+    gzstream* gz=malloc(sizeof(gzstream));
+    if (gz == NULL){
+	return NULL;
+    }
+    gz->fid=fid;
+    gz->mem=data;
+    gz->memsize=size;
+    gz->mempos=0;
+    memset(&gz->strm,0,sizeof(z_stream));
+    //automatic gzip header detection
+    if (inflateInit2(&gz->strm,15+32) != Z_OK){
+	free(gz);
+	return NULL;
+    }
+    gz->strm.next_in=gz->inbuf;
+    gz->strm.avail_in=0;
+    gz->raw=0;
+    gz->newmember=1;
+    gz->eof=0;
+    gz->out=0;
+    gz->outpos=0;
+    gz->outlen=0;
+    return gz;
+}
+
+gzstream* open_gzstream(const char *filename){
+    FILE *fid=fopen(filename,"rb");
+    if (fid == NULL){
+	return NULL;
+    }
+    gzstream* gz=init_gzstream(fid,NULL,0);
+    if (gz == NULL){
+	fclose(fid);
+    }
+    return gz;
+}
+
+///Decompress from a memory buffer (which needs to stay alive until the stream is closed)
+gzstream* open_gzstream_mem(const void *data, size_t size){
+    return init_gzstream(NULL,data,size);
+}
+
+void close_gzstream(gzstream* gz){
+    inflateEnd(&gz->strm);
+    if (gz->fid != NULL){
+	fclose(gz->fid);
+    }
+    free(gz);
+}
+
+///Make sure compressed input is available, returns 0 at the end of the file
+static size_t fill_input(gzstream* gz){
+    if (gz->strm.avail_in == 0){
+	if (gz->fid == NULL){
+	    //decompress directly from the memory buffer
+	    size_t n=gz->memsize-gz->mempos;
+	    if (n > GZ_CHUNK_MEM){
+		n=GZ_CHUNK_MEM;
+	    }
+	    gz->strm.next_in=(unsigned char*)gz->mem+gz->mempos;
+	    gz->strm.avail_in=n;
+	    gz->mempos+=n;
+	}else{
+	    gz->strm.avail_in=fread(gz->inbuf,1,GZ_CHUNK,gz->fid);
+	    gz->strm.next_in=gz->inbuf;
+	}
+    }
+    return gz->strm.avail_in;
+}
+
+///Position the compressed input
+static int seek_input(gzstream* gz, int64_t offset){
+    gz->strm.next_in=gz->inbuf;
+    gz->strm.avail_in=0;
+    if (gz->fid == NULL){
+	if (offset < 0 || (size_t)offset > gz->memsize){
+	    return GZ_ERROR;
+	}
+	gz->mempos=offset;
+	return GZ_SUCCESS;
+    }
+    return fseeko(gz->fid,offset,SEEK_SET) == 0?GZ_SUCCESS:GZ_ERROR;
+}
+
+///Prepare for decoding the next gzip member (concatenated gzip files)
+static void next_member(gzstream* gz){
+    if (gz->raw){
+	//raw inflate does not consume the gzip trailer (crc32 and uncompressed size)
+	size_t skip=8;
+	while (skip > 0 && fill_input(gz) > 0){
+	    size_t n=skip < gz->strm.avail_in?skip:gz->strm.avail_in;
+	    gz->strm.next_in+=n;
+	    gz->strm.avail_in-=n;
+	    skip-=n;
+	}
+	gz->raw=0;
+    }
+    inflateReset2(&gz->strm,15+32);
+    gz->newmember=1;
+}
+
+///Decompress more data into the output buffer (moves unconsumed data to the start of the buffer)
+static int fill_output(gzstream* gz){
+    if (gz->outpos > 0){
+	memmove(gz->outbuf,gz->outbuf+gz->outpos,gz->outlen-gz->outpos);
+	gz->outlen-=gz->outpos;
+	gz->outpos=0;
+    }
+
+    while (gz->outlen < GZ_OUTBUF && !gz->eof){
+	if (fill_input(gz) == 0){
+	    if (gz->fid != NULL && ferror(gz->fid)){
+		return GZ_ERROR;
+	    }
+	    gz->eof=1;
+	    break;
+	}
+	gz->strm.next_out=(unsigned char*)gz->outbuf+gz->outlen;
+	gz->strm.avail_out=GZ_OUTBUF-gz->outlen;
+	int ret=inflate(&gz->strm,Z_NO_FLUSH);
+	size_t nout=GZ_OUTBUF-gz->outlen-gz->strm.avail_out;
+	gz->outlen+=nout;
+	gz->out+=nout;
+	if (nout > 0){
+	    gz->newmember=0;
+	}
+
+	if (ret == Z_STREAM_END){
+	    next_member(gz);
+	}else if (ret == Z_DATA_ERROR && gz->newmember){
+	    //trailing garbage after the last member: treat as end of file (as gzread does)
+	    gz->eof=1;
+	}else if (ret != Z_OK && ret != Z_BUF_ERROR){
+	    return GZ_ERROR;
+	}
+    }
+    return GZ_SUCCESS;
+}
+
+///Retrieve a view of the next line (including the newline character) which is valid until the next read
+int readline_gzstream(gzstream* gz, const char **line, size_t *len){
+    const char *nl;
+    while (1){
+	size_t avail=gz->outlen-gz->outpos;
+	nl=memchr(gz->outbuf+gz->outpos,'\n',avail);
+	if (nl != NULL){
+	    break;
+	}
+	if (gz->eof || (gz->outpos == 0 && gz->outlen == GZ_OUTBUF)){
+	    //last line without a newline (or a line which does not fit in the buffer)
+	    if (avail == 0){
+		*len=0;
+		return GZ_EOF;
+	    }
+	    *line=gz->outbuf+gz->outpos;
+	    *len=avail;
+	    gz->outpos=gz->outlen;
+	    return GZ_SUCCESS;
+	}
+	if (fill_output(gz) != GZ_SUCCESS){
+	    return GZ_ERROR;
+	}
+    }
+    *line=gz->outbuf+gz->outpos;
+    *len=nl+1-*line;
+    gz->outpos+=*len;
+    return GZ_SUCCESS;
+}
+
+///Discard a number of uncompressed bytes
+int skip_gzstream(gzstream* gz, int64_t nbytes){
+    while (nbytes > 0){
+	size_t avail=gz->outlen-gz->outpos;
+	if (avail == 0){
+	    if (gz->eof){
+		return GZ_EOF;
+	    }
+	    if (fill_output(gz) != GZ_SUCCESS){
+		return GZ_ERROR;
+	    }
+	    continue;
+	}
+	size_t n=(int64_t)avail < nbytes?avail:(size_t)nbytes;
+	gz->outpos+=n;
+	nbytes-=n;
+    }
+    return GZ_SUCCESS;
+}
+
+///Restart decompression from an access point (or from the start of the file when point is NULL)
+int position_gzstream(gzstream* gz, const gzaccess *point){
+    gz->outpos=0;
+    gz->outlen=0;
+    gz->eof=0;
+    if (point == NULL){
+	if (seek_input(gz,0) != GZ_SUCCESS){
+	    return GZ_ERROR;
+	}
+	inflateReset2(&gz->strm,15+32);
+	gz->raw=0;
+	gz->newmember=1;
+	gz->out=0;
+	return GZ_SUCCESS;
+    }
+
+    if (seek_input(gz,point->in-(point->bits?1:0)) != GZ_SUCCESS){
+	return GZ_ERROR;
+    }
+    inflateReset2(&gz->strm,-15);
+    gz->raw=1;
+    gz->newmember=0;
+    if (point->bits){
+	if (fill_input(gz) == 0){
+	    return GZ_ERROR;
+	}
+	int ret=*gz->strm.next_in;
+	gz->strm.next_in++;
+	gz->strm.avail_in--;
+	inflatePrime(&gz->strm,point->bits,ret >> (8-point->bits));
+    }
+    inflateSetDictionary(&gz->strm,point->window,GZ_WINSIZE);
+    gz->out=point->out;
+    return GZ_SUCCESS;
+}
+
+static int add_gzaccess(gzaccess **list, int *npoints, int *nalloc, int bits, int64_t in, int64_t out, unsigned left, const unsigned char *window){
+    if (*npoints == *nalloc){
+	int nnew=*nalloc?2*(*nalloc):8;
+	gzaccess *tmp=realloc(*list,nnew*sizeof(gzaccess));
+	if (tmp == NULL){
+	    return GZ_ERROR;
+	}
+	*list=tmp;
+	*nalloc=nnew;
+    }
+    gzaccess *next=*list+*npoints;
+    next->bits=bits;
+    next->in=in;
+    next->out=out;
+    //unroll the circular window
+    if (left){
+	memcpy(next->window,window+GZ_WINSIZE-left,left);
+    }
+    if (left < GZ_WINSIZE){
+	memcpy(next->window+left,window,GZ_WINSIZE-left);
+    }
+    (*npoints)++;
+    return GZ_SUCCESS;
+}
+
+///Decompress a complete gzip file and store access points roughly every span uncompressed bytes
+int build_gzindex(const char *filename, int64_t span, gzaccess **list, int *npoints){
+    FILE* fid=fopen(filename,"rb");
+    if (fid == NULL){
+	return GZ_ERROR;
+    }
+    unsigned char input[GZ_CHUNK];
+    unsigned char *window=malloc(GZ_WINSIZE);
+    z_stream strm;
+    memset(&strm,0,sizeof(z_stream));
+    if (window == NULL || inflateInit2(&strm,15+32) != Z_OK){
+	free(window);
+	fclose(fid);
+	return GZ_ERROR;
+    }
+    int64_t totin=0,totout=0,last=0;
+    int nalloc=0;
+    int ret=Z_OK;
+    int status=GZ_SUCCESS;
+    int newmember=1;
+    *list=NULL;
+    *npoints=0;
+    strm.avail_out=0;
+    strm.avail_in=0;
+
+    while (1){
+	if (strm.avail_in == 0){
+	    strm.avail_in=fread(input,1,GZ_CHUNK,fid);
+	    strm.next_in=input;
+	    if (strm.avail_in == 0){
+		if (ferror(fid) || !newmember){
+		    //read error or truncated file
+		    status=GZ_ERROR;
+		}
+		break;
+	    }
+	}
+	if (strm.avail_out == 0){
+	    strm.avail_out=GZ_WINSIZE;
+	    strm.next_out=window;
+	}
+	totin+=strm.avail_in;
+	totout+=strm.avail_out;
+	ret=inflate(&strm,Z_BLOCK);
+	totin-=strm.avail_in;
+	totout-=strm.avail_out;
+	if (ret == Z_STREAM_END){
+	    //possibly another gzip member follows
+	    inflateReset2(&strm,15+32);
+	    newmember=1;
+	    continue;
+	}
+	if (ret == Z_DATA_ERROR && newmember && totout > 0){
+	    //trailing garbage
+	    break;
+	}
+	if (ret != Z_OK && ret != Z_BUF_ERROR){
+	    status=GZ_ERROR;
+	    break;
+	}
+	newmember=0;
+	//add an access point at the end of a deflate block header (but not after the last block)
+	if ((strm.data_type & 128) && !(strm.data_type & 64) && (*npoints == 0 || totout-last > span)){
+	    if (add_gzaccess(list,npoints,&nalloc,strm.data_type & 7,totin,totout,strm.avail_out,window) != GZ_SUCCESS){
+		status=GZ_ERROR;
+		break;
+	    }
+	    last=totout;
+	}
+    }
+    inflateEnd(&strm);
+    free(window);
+    fclose(fid);
+    if (status != GZ_SUCCESS){
+	free(*list);
+	*list=NULL;
+	*npoints=0;
+    }
+    return status;
+}
+
+void free_gzindex(gzaccess *list){
+    free(list);
+}
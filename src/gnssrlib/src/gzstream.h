@@ -0,0 +1,73 @@
+/*# This file is part of gnssr4water*/
+/*# gnssr4water is free software; you can redistribute it and/or*/
+/*# modify it under the terms of the GNU Lesser General Public*/
+/*# License as published by the Free Software Foundation; either*/
+/*# version 3 of the License, or (at your option) any later version.*/
+
+/*# gnssr4water is distributed in the hope that it will be useful,*/
+/*# but WITHOUT ANY WARRANTY; without even the implied warranty of*/
+/*# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU*/
+/*# Lesser General Public License for more details.*/
+
+/*# You should have received a copy of the GNU Lesser General Public*/
+/*# License along with gnssr4water if not, write to the Free Software*/
+/*# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA*/
+
+/*# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2025*/
+
+#include <zlib.h>
+#include <stdio.h>
+#include <stdint.h>
+
+#define GZ_WINSIZE 32768U
+#define GZ_CHUNK 16384
+//maximum amount of compressed bytes handed to inflate at once when decompressing from memory
+#define GZ_CHUNK_MEM 1048576
+#define GZ_OUTBUF 262144
+#define GZ_ERROR -1
+#define GZ_EOF -2
+#define GZ_SUCCESS 0
+
+#ifndef GZSTREAM_H
+#define GZSTREAM_H
+
+///Access point in a gzip file from which decompression can be restarted (see zran.c in the zlib examples)
+struct gzaccess{
+    int64_t out; //uncompressed offset
+    int64_t in; //compressed offset of the first full byte
+    int bits; //number of bits (1-7) to use from the byte at in-1, or 0
+    unsigned char window[GZ_WINSIZE]; //preceding 32K of uncompressed data
+};
+
+typedef struct gzaccess gzaccess;
+
+///Gzip decompressing line reader
+struct gzstream{
+    FILE* fid; //compressed input file (NULL when reading from memory)
+    const unsigned char *mem; //compressed input buffer
+    size_t memsize;
+    size_t mempos;
+    z_stream strm;
+    int raw; //set when decoding raw deflate data (after restarting from an access point)
+    int newmember; //set when a new gzip member is expected
+    int eof;
+    int64_t out; //total amount of uncompressed bytes produced
+    unsigned char inbuf[GZ_CHUNK];
+    char outbuf[GZ_OUTBUF];
+    size_t outpos;
+    size_t outlen;
+};
+
+typedef struct gzstream gzstream;
+
+gzstream* open_gzstream(const char *filename);
+gzstream* open_gzstream_mem(const void *data, size_t size);
+void close_gzstream(gzstream* gz);
+int readline_gzstream(gzstream* gz, const char **line, size_t *len);
+int skip_gzstream(gzstream* gz, int64_t nbytes);
+int position_gzstream(gzstream* gz, const gzaccess *point);
+
+int build_gzindex(const char *filename, int64_t span, gzaccess **list, int *npoints);
+void free_gzindex(gzaccess *list);
+
+#endif //GZSTREAM_H
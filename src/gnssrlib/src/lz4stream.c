@@ -1,4 +1,3 @@
-
 /*# This file is part of gnssr4water*/
 /*# gnssr4water is free software; you can redistribute it and/or*/
 /*# modify it under the terms of the GNU Lesser General Public*/
@@ -20,231 +19,231 @@
 #include <stdlib.h>
 #include <string.h>
 
+static int fill_output(lz4stream* lzid);
 
-lz4stream* open_lz4stream(const char *filename){
-    /*///initialize the struct*/
+static lz4stream* init_lz4stream(FILE *fid, const void *data, size_t size){
+    ///initialize the struct (takes ownership of fid)
     lz4stream* lzid =malloc(sizeof(lz4stream));
-    lzid->lz4_fid = NULL;
-    //allocate memory for the chunk buffer
-    lzid->chunkbuf = malloc(LZ4_CHUNK_SIZE);
-    if (lzid->chunkbuf == NULL) {
-	close_lz4stream(lzid);
+    if (lzid == NULL) {
+	if (fid != NULL) {
+	    fclose(fid);
+	}
 	return NULL;
     }
-
-    ///Open the (compressed) file for reading
-    lzid->fid = fopen(filename, "r");
-
-    if (lzid->fid == NULL) {
-	//clean up and close shop
+    lzid->dctx = NULL;
+    lzid->fid = fid;
+    lzid->mem = data;
+    lzid->memsize = size;
+    lzid->inframe = 0;
+    lzid->eof = 0;
+    lzid->out = 0;
+    lzid->inPtr = data;
+    lzid->inlen = fid == NULL?size:0;
+    lzid->inbuf = NULL;
+    lzid->chunksize = LZ4_CHUNK_SIZE;
+    lzid->head = 0;
+    lzid->tail = 0;
+    lzid->ring = malloc(2*lzid->chunksize);
+    if (lzid->ring == NULL || (fid != NULL && (lzid->inbuf = malloc(LZ4_IN_CHUNK)) == NULL)) {
 	close_lz4stream(lzid);
-	fprintf(stderr, "Could not open file %s\n", filename);
 	return NULL;
     }
-    // open the lz4 decompressor
-    LZ4F_errorCode_t ret = LZ4F_OK_NoError;
-    ret = LZ4F_readOpen(&(lzid->lz4_fid), lzid->fid);
+
+    // create the lz4 decompressor
+    LZ4F_errorCode_t ret = LZ4F_createDecompressionContext(&(lzid->dctx), LZ4F_VERSION);
     if (LZ4F_isError(ret)) {
-	printf("LZ4F_readOpen error: %s\n", LZ4F_getErrorName(ret));
+	fprintf(stderr, "LZ4F_createDecompressionContext error: %s\n", LZ4F_getErrorName(ret));
+	lzid->dctx = NULL;
 	close_lz4stream(lzid);
         return NULL;
     }
-    
-    //decode the first chunk into the buffer
-    int err = decompress_lz4_chunk(lzid);
-    if (err != LZ4_SUCCESS) {
-	//error decompressing the first chunkbuf
-	//clean up and close shop
+    //decode the first chunk, so that invalid input is detected when opening
+    if (fill_output(lzid) != LZ4_SUCCESS) {
 	close_lz4stream(lzid);
 	return NULL;
     }
     return lzid;
+}
+
+lz4stream* open_lz4stream(const char *filename){
+    ///Open the (compressed) file for reading
+    FILE* fid = fopen(filename, "rb");
 
+    if (fid == NULL) {
+	fprintf(stderr, "Could not open file %s\n", filename);
+	return NULL;
+    }
+    return open_lz4stream_fid(fid);
 }
 
-int decompress_lz4_chunk(lz4stream* lzid){
-    LZ4F_errorCode_t ret = LZ4F_read(lzid->lz4_fid, lzid->chunkbuf, LZ4_CHUNK_SIZE);
-    if (LZ4F_isError(ret)) {
-	printf("LZ4F_read error: %s\n", LZ4F_getErrorName(ret));
-	close_lz4stream(lzid);
+lz4stream* open_lz4stream_fid(FILE* fid){
+    ///Decompress from an opened file (takes ownership of fid)
+    return init_lz4stream(fid,NULL,0);
+}
+
+lz4stream* open_lz4stream_mem(const void *data, size_t size){
+    ///Decompress directly from a memory buffer (which needs to stay alive until the stream is closed)
+    return init_lz4stream(NULL,data,size);
+}
+
+void close_lz4stream(lz4stream* lzid){
+	if (lzid->dctx != NULL) {
+		LZ4F_freeDecompressionContext(lzid->dctx);
+	}
+
+	if (lzid->fid != NULL) {
+		fclose(lzid->fid);
+	}
+	
+	free(lzid->inbuf);
+	free(lzid->ring);
+	free(lzid);
+}
+
+///Move the unread data to the start of the ring buffer
+static void wrap_ring(lz4stream* lzid){
+    if (lzid->head > 0) {
+	memmove(lzid->ring, lzid->ring+lzid->head, lzid->tail-lzid->head);
+	lzid->tail -= lzid->head;
+	lzid->head = 0;
+    }
+}
+
+///Change the amount of bytes which are decompressed at once (the unread data is preserved)
+int set_lz4stream_chunksize(lz4stream* lzid, size_t chunksize){
+    if (chunksize < LZ4_MIN_CHUNK_SIZE) {
+	chunksize = LZ4_MIN_CHUNK_SIZE;
+    }
+    wrap_ring(lzid);
+    if (lzid->tail > 2*chunksize) {
+	//unread data does not fit
 	return LZ4_ERROR;
     }
-    lzid->buflen = ret; //store the amount of valid bytes in the buffer
-    if (ret == 0) {
-	//Nothing more to read-> end of file
-	return LZ4_EOF;
+    char *ring = realloc(lzid->ring, 2*chunksize);
+    if (ring == NULL) {
+	return LZ4_ERROR;
     }
-    ///let chunkptr point to beginning of the newly fed buffer
-    lzid->chunkPtr = lzid->chunkbuf;
-    ///add a null terminator to the buffer
-    lzid->chunkbuf[ret] = '\0';
+    lzid->ring = ring;
+    lzid->chunksize = chunksize;
     return LZ4_SUCCESS;
 }
-int readline_lz4(lz4stream* lzid, char *buffer,size_t slen){
-	
-	if (lzid->buflen == 0) {
-	    //no more data in the buffer
-	    return LZ4_EOF;
-	}
 
-	char * bufPtr = buffer;
+///Make sure compressed input is available, returns 0 at the end of the input
+static size_t fill_input(lz4stream* lzid){
+    if (lzid->inlen == 0 && lzid->fid != NULL) {
+	lzid->inlen = fread(lzid->inbuf, 1, LZ4_IN_CHUNK, lzid->fid);
+	lzid->inPtr = lzid->inbuf;
+    }
+    return lzid->inlen;
+}
 
-	//find the next newline character in the chunkbuffer
-	char * ln = strchr(lzid->chunkPtr, '\n');
-	
-	
-	// not found 
-	if (ln == NULL ){
-	    //copy the remaining bytes to the output buffer
-	    
-	    //remaining buffer does not fit in the buffer
-	    if (lzid->buflen > lzid->chunkPtr + slen) {
-		return LZ4_ERROR;
-	    }
-	    size_t bcopied = lzid->buflen - (lzid->chunkPtr - lzid->chunkbuf);
-	    strncpy(bufPtr, lzid->chunkPtr,bcopied);
-	    bufPtr += bcopied;
-	    //add a null terminator
-	    *bufPtr = '\0';
-	    //decompress a chunk and try again
-	    int err = decompress_lz4_chunk(lzid);
-	    if (err == LZ4_EOF) {
-		return LZ4_EOF;
-	    }
-	    ln = strchr(lzid->chunkPtr, '\n');
-	    if ( ln == NULL){
-		//no newline found after the second attempt
+///Decompress (at most) a chunk behind the unread data in the ring buffer
+static int fill_output(lz4stream* lzid){
+    if (2*lzid->chunksize-lzid->tail < lzid->chunksize) {
+	//less than a chunk left at the end: wrap around
+	wrap_ring(lzid);
+    }
+    size_t room = 2*lzid->chunksize-lzid->tail;
+    if (room > lzid->chunksize) {
+	room = lzid->chunksize;
+    }
+    size_t produced = 0;
+    while (produced == 0 && room > 0 && !lzid->eof) {
+	if (fill_input(lzid) == 0) {
+	    if ((lzid->fid != NULL && ferror(lzid->fid)) || lzid->inframe) {
+		//read error or truncated frame
 		return LZ4_ERROR;
 	    }
+	    lzid->eof = 1;
+	    break;
 	}
-    
-	//found string does not fit in the buffer
-	if (ln > lzid->chunkPtr + slen) {
+	size_t dstSize = room;
+	size_t srcSize = lzid->inlen;
+	size_t ret = LZ4F_decompress(lzid->dctx, lzid->ring+lzid->tail, &dstSize, lzid->inPtr, &srcSize, NULL);
+	if (LZ4F_isError(ret)) {
+	    fprintf(stderr, "LZ4F_decompress error: %s\n", LZ4F_getErrorName(ret));
 	    return LZ4_ERROR;
 	}
-	///check if data will fit
-	//copy the data up to the newlin into to the buffer
-	size_t bcopied = ln - lzid->chunkPtr+1;
-	strncpy(bufPtr, lzid->chunkPtr, bcopied);
-	
-	bufPtr += bcopied;
-	    //add a null terminator
-	*bufPtr = '\0';
-	//move the chunkPtr to the beginning of the next line
-	lzid->chunkPtr = ln + 1;
-
-	return LZ4_SUCCESS;
+	//ret == 0 marks the end of a frame (possibly another frame follows)
+	lzid->inframe = ret != 0;
+	lzid->inPtr += srcSize;
+	lzid->inlen -= srcSize;
+	lzid->tail += dstSize;
+	lzid->out += dstSize;
+	produced = dstSize;
+    }
+    return LZ4_SUCCESS;
 }
 
-
-void close_lz4stream(lz4stream* lzid){
-	if (lzid->lz4_fid != NULL) {
-		LZ4F_readClose(lzid->lz4_fid);
+///Retrieve a view of the next line (including the newline character) which is valid until the next read
+int readline_lz4(lz4stream* lzid, const char **line, size_t *len){
+    const char *nl;
+    size_t scanned = 0;
+    while (1) {
+	size_t avail = lzid->tail-lzid->head;
+	//only scan the newly decompressed data
+	nl = memchr(lzid->ring+lzid->head+scanned, '\n', avail-scanned);
+	if (nl != NULL) {
+	    break;
 	}
-
-	if (lzid->fid != NULL) {
-		fclose(lzid->fid);
+	scanned = avail;
+	if (lzid->eof || (lzid->head == 0 && lzid->tail == 2*lzid->chunksize)) {
+	    //last line without a newline (or a line which does not fit in the ring buffer)
+	    if (avail == 0) {
+		*len = 0;
+		return LZ4_EOF;
+	    }
+	    *line = lzid->ring+lzid->head;
+	    *len = avail;
+	    lzid->head = lzid->tail;
+	    return LZ4_SUCCESS;
 	}
-	
-	if (lzid->chunkbuf != NULL) {
-		free(lzid->chunkbuf);
+	if (fill_output(lzid) != LZ4_SUCCESS) {
+	    return LZ4_ERROR;
 	}
-
-	free(lzid);
+    }
+    *line = lzid->ring+lzid->head;
+    *len = nl+1-*line;
+    lzid->head += *len;
+    return LZ4_SUCCESS;
 }
-/*lz4stream* open_lz4stream(const char *filename){*/
-    /*///initialize the struct*/
-    /*lz4stream* lzid =malloc(sizeof(lz4stream));*/
-    
-    /*lzid->fid = fopen(filename, "r");*/
-    /*if (lzid->fid == NULL) {*/
-	/*fprintf(stderr, "Could not open file %s\n", filename);*/
-	    /*return NULL;*/
-    /*}else{*/
-	/*lzid->dec_lz4 = LZ4_createStreamDecode();*/
-	/*lzid->rbufPtr = lzid->rbuffer;*/
-	/*lzid->mbufPtr = lzid->rbufPtr;*/
-
-	/*int err = decompress_lz4_block(lzid);*/
-	/*if (err != LZ4_SUCCESS) {*/
-	    /*fprintf(stderr, "Error decompressing block\n");*/
-	    /*return NULL;*/
-	/*}*/
-	/*return lzid;*/
-    /*}*/
-/*}*/
-
-/*///Decompresses a block of the lz4 stream in the ring buffer*/
-/*int decompress_lz4_block(lz4stream* lzid){*/
-	
-	/*uint16_t cmpbytes=0;*/
-	/*//read the amount of compressed bytes in the next block*/
-	/*size_t nread = fread(&cmpbytes, sizeof(uint16_t), 1,lzid->fid);*/
-	/*if ( ( nread != 1) || (cmpbytes == 0) ) {*/
-	    /*if (feof(lzid->fid)) {*/
-		/*return LZ4_EOF;*/
-	    /*} else {*/
-		/*return LZ4_ERROR;*/
-	    /*}*/
-	/*}*/
-	
-	/*//read the compressed block*/
-	/*nread = fread(lzid->compbuf, 1, cmpbytes, lzid->fid);*/
-
 
-	/*if (nread != cmpbytes) {*/
-	    /*if (feof(lzid->fid)) {*/
-		/*return LZ4_EOF;*/
-	    /*} else {*/
-		/*return LZ4_ERROR;*/
-	    /*}*/
-	/*}*/
-	
-	/*//decompress the block into the ringbuffer*/
-        /*int decBytes = LZ4_decompress_safe_continue(lzid->dec_lz4, lzid->compbuf, lzid->rbufPtr, cmpbytes, (int)LZ4_MAX_MESSAGE);*/
-
-        /*if (decBytes <= 0) {*/
-	    /*return LZ4_ERROR;*/
-	/*}*/
-	/*lzid->rbufPtr += decBytes;*/
-	
-	/*if (lzid->rbufPtr >= lzid->rbuffer + LZ4_RING_BUFFER - LZ4_MAX_MESSAGE) {*/
-	    /*//reset to start of the ring buffer if the buffer is almost full*/
-	    /*lzid->rbufPtr = lzid->rbuffer;*/
-	/*}*/
-
-	/*return LZ4_SUCCESS;*/
-/*}*/
+///Discard a number of uncompressed bytes
+int skip_lz4stream(lz4stream* lzid, int64_t nbytes){
+    while (nbytes > 0) {
+	size_t avail = lzid->tail-lzid->head;
+	if (avail == 0) {
+	    if (lzid->eof) {
+		return LZ4_EOF;
+	    }
+	    if (fill_output(lzid) != LZ4_SUCCESS) {
+		return LZ4_ERROR;
+	    }
+	    continue;
+	}
+	size_t n = (int64_t)avail < nbytes?avail:(size_t)nbytes;
+	lzid->head += n;
+	nbytes -= n;
+    }
+    return LZ4_SUCCESS;
+}
 
-/*int readline_lz4(lz4stream* lzid, char *buffer,size_t slen){*/
-	/*//find the next newline character in the ringbuffer*/
-	
-	/*char * ln = strchr(lzid->mbufPtr, '\n');*/
-	/*// not found or  found in an older section of the ringbuffer*/
-	/*if ((ln == NULL) || (ln > lzid->rbufPtr)){*/
-	    /*//decompress a block and try again*/
-	    /*decompress_lz4_block(lzid);*/
-	    /*ln = strchr(lzid->mbufPtr, '\n');*/
-	    /*if ( (ln == NULL) || (ln > lzid->rbufPtr)){*/
-		/*//no newline found after the second attempt*/
-		/*return LZ4_ERROR;*/
-	    /*}*/
-	/*}*/
-	
-	/*//copy the line to the buffer*/
-	/*if (ln > lzid->mbufPtr +slen) {*/
-	    /*// cannot fit the line in the buffer*/
-	    /*return LZ4_ERROR;*/
-	/*}*/
-	/*strncpy(buffer, lzid->mbufPtr, ln - lzid->mbufPtr);*/
-	/*lzid->mbufPtr = ln + 1;*/
-
-	/*return LZ4_SUCCESS;*/
-/*}*/
-
-
-/*void close_lz4stream(lz4stream* lzid){*/
-	/*LZ4_freeStreamDecode(lzid->dec_lz4);*/
-	/*fclose(lzid->fid);*/
-	/*free(lzid);*/
-/*}*/
+///Restart decompression at the beginning of the file
+int rewind_lz4stream(lz4stream* lzid){
+    if (lzid->fid != NULL) {
+	if (fseek(lzid->fid, 0, SEEK_SET) != 0) {
+	    return LZ4_ERROR;
+	}
+	lzid->inlen = 0;
+    }else{
+	lzid->inPtr = lzid->mem;
+	lzid->inlen = lzid->memsize;
+    }
+    LZ4F_resetDecompressionContext(lzid->dctx);
+    lzid->inframe = 0;
+    lzid->eof = 0;
+    lzid->out = 0;
+    lzid->head = 0;
+    lzid->tail = 0;
+    return LZ4_SUCCESS;
+}
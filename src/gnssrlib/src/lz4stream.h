@@ -14,14 +14,15 @@
 /*# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA*/
 
 /*# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2025*/
-
-#include "lz4static/lz4.h"
-#include "lz4static/lz4file.h"
+#include "lz4static/lz4frame.h"
 #include <stdio.h>
+#include <stdint.h>
 
-#define LZ4_MAX_MESSAGE 1024
-#define LZ4_RING_BUFFER 256*1024
+//default amount of bytes decompressed at once (the ring buffer holds two chunks)
 #define LZ4_CHUNK_SIZE 1024*16 
+#define LZ4_MIN_CHUNK_SIZE 256
+//amount of compressed bytes read from a file at once
+#define LZ4_IN_CHUNK 1024*16
 #define LZ4_ERROR -1
 #define LZ4_EOF -2
 #define LZ4_SUCCESS 0
@@ -31,25 +32,37 @@
 #ifndef LZ4STREAM_H
 #define LZ4STREAM_H
 
+///LZ4 (frame format) decompressing line reader
+///Lines are returned as views on a ring buffer: data is decompressed in chunks behind the unread data, and only the unfinished line is moved to the start of the buffer when the end is reached
 struct lz4stream{
-    //LZ4_streamDecode_t* dec_lz4;
-    LZ4_readFile_t* lz4_fid;
-    FILE* fid;
-    //char rbuffer[LZ4_RING_BUFFER];
-    //char * rbufPtr;
-    char *mbufPtr;
-    //char compbuf[LZ4_COMPRESSBOUND(LZ4_MAX_MESSAGE)];
-    char * chunkbuf;
-    char *chunkPtr;
-   size_t buflen;
+    LZ4F_dctx* dctx;
+    FILE* fid; //compressed input file (NULL when reading from memory)
+    const unsigned char *mem; //compressed input buffer
+    size_t memsize;
+    int inframe; //set when the decompressor is in the middle of a frame
+    int eof;
+    int64_t out; //total amount of uncompressed bytes produced
+    //compressed input (points into mem when reading from memory)
+    const unsigned char *inPtr;
+    size_t inlen;
+    unsigned char *inbuf;
+    //ring buffer with the uncompressed data
+    char *ring;
+    size_t chunksize;
+    size_t head; //start of the unread data
+    size_t tail; //end of the valid data
 };
 
 typedef struct lz4stream lz4stream;
 
 lz4stream* open_lz4stream(const char *filename);
+lz4stream* open_lz4stream_fid(FILE* fid);
+lz4stream* open_lz4stream_mem(const void *data, size_t size);
 void close_lz4stream(lz4stream* lzid);
-int readline_lz4(lz4stream* lzid, char *buffer,size_t slen);
-int decompress_lz4_chunk(lz4stream* lzid);
+int set_lz4stream_chunksize(lz4stream* lzid, size_t chunksize);
+int readline_lz4(lz4stream* lzid, const char **line, size_t *len);
+int skip_lz4stream(lz4stream* lzid, int64_t nbytes);
+int rewind_lz4stream(lz4stream* lzid);
 
 
 #endif //LZ4STREAM_H
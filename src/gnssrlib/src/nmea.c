@@ -19,11 +19,13 @@
 #include <stdio.h>
 #include <string.h>
 #include <stdlib.h>
+#include <math.h>
+#include <float.h>
 #include "gnssrlib.h"
 #include "nmea.h"
 
-unsigned char calculate_checksum(const char * nmea){
-	size_t slen=strlen(nmea);
+static unsigned char checksum_range(const char * nmea,size_t slen){
+	//XOR of all bytes between the $ and the *HH at the end
 	unsigned char xorval=nmea[1];
 	for (size_t i=2;i<slen-3;i++){
 		xorval=xorval^nmea[i];
@@ -31,34 +33,131 @@ unsigned char calculate_checksum(const char * nmea){
 	return xorval;
 }
 
-int shift_to_komma(const  char ** nmeaPtr,const char ** kommaPtr,int skip){
-	
-	for (int i=0;i<skip;i++){
-	    //shift tothe next komma in the string
-	    if (*kommaPtr!=NULL){
-		*nmeaPtr=*kommaPtr+1;
-	    }
+unsigned char calculate_checksum(const char * nmea){
+	return checksum_range(nmea,strlen(nmea));
+}
 
-	    *kommaPtr=strchr(*nmeaPtr,',');
-	    if (*kommaPtr==NULL){
+static int hexval(const char c){
+	if (c >= '0' && c <= '9'){
+	    return c-'0';
+	}else if (c >= 'A' && c <= 'F'){
+	    return c-'A'+10;
+	}else if (c >= 'a' && c <= 'f'){
+	    return c-'a'+10;
+	}
+	return -1;
+}
+
+static int parse_2digits(const char * nmeaPtr, const char * end, int * val){
+	if (nmeaPtr+2 > end || nmeaPtr[0] < '0' || nmeaPtr[0] > '9' || nmeaPtr[1] < '0' || nmeaPtr[1] > '9'){
 		return GNSSR_IO_ERROR;
+	}
+	*val=(nmeaPtr[0]-'0')*10+(nmeaPtr[1]-'0');
+	return GNSSR_SUCCESS;
+}
+
+static const double pow10tab[]={1e0,1e1,1e2,1e3,1e4,1e5,1e6,1e7,1e8,1e9,1e10,1e11,1e12,1e13,1e14,1e15,1e16,1e17,1e18,1e19,1e20,1e21,1e22};
+
+///Parse a decimal number ([+-]ddd.ddd) as an integer mantissa and a power of ten, parsing stops at the first other character (like atof, but independent of the locale)
+static double parse_decimal(const char * nmeaPtr, const char * end){
+	int neg=0;
+	int64_t mant=0;
+	int ndigits=0; //significant digits in the mantissa
+	int scale=0; //power of ten to apply to the mantissa
+	if (nmeaPtr < end && (*nmeaPtr == '-' || *nmeaPtr == '+')){
+	    neg=(*nmeaPtr == '-');
+	    nmeaPtr++;
+	}
+	for (;nmeaPtr < end && *nmeaPtr >= '0' && *nmeaPtr <= '9';nmeaPtr++){
+	    if (ndigits < 18){
+		mant=mant*10+(*nmeaPtr-'0');
+		ndigits+=(mant != 0);
+	    }else{
+		scale++;
 	    }
 	}
-    return GNSSR_SUCCESS;
+	if (nmeaPtr < end && *nmeaPtr == '.'){
+	    for (nmeaPtr++;nmeaPtr < end && *nmeaPtr >= '0' && *nmeaPtr <= '9';nmeaPtr++){
+		if (ndigits < 18){
+		    mant=mant*10+(*nmeaPtr-'0');
+		    ndigits+=(mant != 0);
+		    scale--;
+		}
+	    }
+	}
+	//note: dividing by an exact power of ten yields the correctly rounded result (for mantissas below 2^53)
+	double val=mant;
+	if (scale < 0){
+	    val= scale >= -22 ? val/pow10tab[-scale] : val/pow(10.0,-scale);
+	}else if (scale > 0){
+	    val*=pow(10.0,scale);
+	}
+	return neg?-val:val;
+}
+
+///Parse an integer ([+-]ddd), parsing stops at the first other character (like atoi)
+static int parse_int(const char * nmeaPtr, const char * end){
+	int neg=0;
+	int val=0;
+	if (nmeaPtr < end && (*nmeaPtr == '-' || *nmeaPtr == '+')){
+	    neg=(*nmeaPtr == '-');
+	    nmeaPtr++;
+	}
+	for (;nmeaPtr < end && *nmeaPtr >= '0' && *nmeaPtr <= '9';nmeaPtr++){
+	    val=val*10+(*nmeaPtr-'0');
+	}
+	return neg?-val:val;
+}
+
+static inline const char * field_start(const char * nmea, const nmea_fields *fields, int ifield){
+	return nmea+fields->start[ifield];
 }
 
-float convert_deg(const float deg){
-	const float cconv=(1.0-100.0/60);
+static inline const char * field_end(const char * nmea, const nmea_fields *fields, int ifield){
+	//a field ends at the komma before the next field (or at the * of the checksum)
+	return nmea+fields->start[ifield+1]-1;
+}
+
+static inline int field_empty(const char * nmea, const nmea_fields *fields, int ifield){
+	return field_start(nmea,fields,ifield) >= field_end(nmea,fields,ifield);
+}
+
+static inline double field_decimal(const char * nmea, const nmea_fields *fields, int ifield){
+	return parse_decimal(field_start(nmea,fields,ifield),field_end(nmea,fields,ifield));
+}
+
+double convert_deg(const double deg){
+	const double cconv=(1.0-100.0/60);
 	return deg/60 + cconv*(int)(deg/100);
 }
 
-void extract_time(const char * nmeaPtr, int * hr, int * min, float * sec){
-	
-	float tstamp=atof(nmeaPtr);
-	*hr=(int)(tstamp/10000);
-	*min=(int)((tstamp-*hr*10000)/100);
-	*sec=tstamp-*hr*10000-*min*100;
-	
+void extract_time(const char * nmeaPtr, const char * end, int * hr, int * min, int * sec, int * usec){
+	//note: the time is parsed with integer arithmetic, so the fractional seconds are exact
+	int tstamp=0;
+	for (;nmeaPtr < end && *nmeaPtr >= '0' && *nmeaPtr <= '9';nmeaPtr++){
+	    if (tstamp < 100000000){
+		tstamp=tstamp*10+(*nmeaPtr-'0');
+	    }
+	}
+	int frac=0;
+	int ndigits=0;
+	if (nmeaPtr < end && *nmeaPtr == '.'){
+	    //keep one digit more than a microsecond for rounding
+	    for (nmeaPtr++;nmeaPtr < end && *nmeaPtr >= '0' && *nmeaPtr <= '9' && ndigits < 7;nmeaPtr++,ndigits++){
+		frac=frac*10+(*nmeaPtr-'0');
+	    }
+	}
+	for (;ndigits < 7;ndigits++){
+	    frac*=10;
+	}
+	*usec=(frac+5)/10;
+	*hr=tstamp/10000;
+	*min=(tstamp/100)%100;
+	*sec=tstamp%100;
+	if (*usec == 1000000){
+	    *usec=0;
+	    (*sec)++;
+	}
 }
 
 int init_nmea_cycle(nmea_cycle * data){
@@ -69,11 +168,13 @@ int init_nmea_cycle(nmea_cycle * data){
 	data->hr=NMEA_FILL;
 	data->min=NMEA_FILL;
 	data->sec=NMEA_FILL;
+	data->usec=0;
 	data->lon=NMEA_FILL;
 	data->lat=NMEA_FILL;
 	data->ortho_height=NMEA_FILL;
 	data->geoid_height=NMEA_FILL;
 	data->sats_in_view=0;
+	data->nmasked=0;
 	for (int i=0;i<NMEA_GSV_MAX_SATELLITES;++i){
 	    data->prn[i]=0;
 	    data->elevation[i]=0;
@@ -85,27 +186,45 @@ int init_nmea_cycle(nmea_cycle * data){
 }
 
 
-nmea_type check_nmea(char * nmea){
-    //remove possible line ends and carriage returns and determine the type of NMEA message
-
-	if (nmea[0] != '$'){
+nmea_type tokenize_nmea(const char * nmea, size_t *slen, nmea_fields *fields){
+    //validate a line which is not necessarily null terminated, determine the type of NMEA message and split it in fields
+    //the checksum and the field offsets are computed in a single pass over the line
+    //On return slen holds the length of the message without line ends and carriage returns
+	size_t len=*slen;
+	fields->nfields=0;
+	if (len == 0 || nmea[0] != '$'){
 		return NMEA_INVALID;
 	}
-	//possible remove carriage return and or newline
-	size_t slen=strlen(nmea);
-	if (nmea[slen-2]=='\r'){
-		nmea[slen-2]='\0';
-		nmea[slen-1]='\0';
-		slen=slen-2;
-	}else if (nmea[slen-1]=='\n'){
-		nmea[slen-1]='\0';
-		slen=slen-1;
+	//possibly discard carriage return and or newline
+	while (len > 0 && (nmea[len-1] == '\n' || nmea[len-1] == '\r')){
+		len--;
+	}
+	*slen=len;
+	//we need at least $TTMMM*HH
+	if (len < 9 || nmea[len-3] != '*'){
+		return NMEA_INVALID;
+	}
+	int hi=hexval(nmea[len-2]);
+	int lo=hexval(nmea[len-1]);
+	if (hi < 0 || lo < 0 ){
+		return NMEA_INVALID;
 	}
+	//XOR of all bytes between the $ and the *HH at the end, while recording where the fields start
+	const size_t stop=len-3;
+	unsigned char xorval=0;
+	int nfields=1;
+	fields->start[0]=0;
+	for (size_t i=1;i<stop;i++){
+		xorval^=nmea[i];
+		if (nmea[i] == ',' && nfields < NMEA_MAX_FIELDS){
+			fields->start[nfields++]=i+1;
+		}
+	}
+	//sentinel so that the last field ends at the *
+	fields->start[nfields]=stop+1;
+	fields->nfields=nfields;
 	//check if the checksum is correct
-	int tmp;
-	sscanf(nmea+slen-2,"%02x", &tmp);
-	unsigned char check= (unsigned char) tmp;
-	if ( calculate_checksum(nmea) != check){
+	if ( xorval != (unsigned char) (hi*16+lo)){
 		return NMEA_INVALID;
 	}
 	///Determines the type of NMEA message
@@ -128,32 +247,128 @@ nmea_type check_nmea(char * nmea){
 	}
 }
 
+nmea_type check_nmea_len(const char * nmea, size_t *slen){
+    //determine the type of NMEA message of a line which is not necessarily null terminated
+    //On return slen holds the length of the message without line ends and carriage returns
+	nmea_fields fields;
+	return tokenize_nmea(nmea,slen,&fields);
+}
+
+nmea_type check_nmea(char * nmea){
+    //remove possible line ends and carriage returns and determine the type of NMEA message
+	size_t slen=strlen(nmea);
+	size_t slen0=slen;
+	nmea_type m_type=check_nmea_len(nmea,&slen);
+	memset(nmea+slen,'\0',slen0-slen);
+	return m_type;
+}
+
 int read_nmea_cycle(gnssrstream *sid, nmea_cycle * data){
+    return read_nmea_cycle_filter(sid,data,NULL);
+}
+
+void init_nmea_filter(nmea_filter * filter){
+    //accept everything
+    filter->start=INT64_MIN;
+    filter->end=INT64_MAX;
+    filter->end_offset=INT64_MAX;
+    filter->systems=0;
+    filter->use_prns=0;
+    memset(filter->prns,0,sizeof(filter->prns));
+    filter->min_elevation=-FLT_MAX;
+    filter->max_elevation=FLT_MAX;
+    filter->min_cnr0=-FLT_MAX;
+    filter->skip_empty=0;
+    filter->merge_void=0;
+    filter->npoly=0;
+    filter->poly=NULL;
+}
+
+static inline int accept_system(const nmea_filter * filter, gnss_code code){
+    return filter->systems == 0 || (filter->systems & (1u << code));
+}
+
+static inline int accept_satellite(const nmea_filter * filter, int prn, float elev, float cnr0){
+    if (filter->use_prns && (prn < 0 || prn > 255 || !(filter->prns[prn >> 6] & (1ull << (prn & 63))))){
+	return 0;
+    }
+    return elev >= filter->min_elevation && elev <= filter->max_elevation && cnr0 >= filter->min_cnr0;
+}
+
+///Ray casting test of a point in a closed polygon of (azimuth,elevation) vertices (port of skymask.masked_fast)
+///returns 1 when the point is inside, 2 when it is on the boundary and 0 otherwise
+static int in_skymask(const double *poly, int npoly, double elevation, double azimuth){
+    int length=npoly-1;
+    double dy2=elevation-poly[1];
+    double dy,F;
+    int intersections=0;
+    for (int ii=0, jj=1; ii < length; ii=jj++){
+	dy=dy2;
+	dy2=elevation-poly[2*jj+1];
+	//consider only lines which are not completely above/below/right from the point
+	if (dy*dy2 <= 0.0 && (azimuth >= poly[2*ii] || azimuth >= poly[2*jj])){
+	    if (dy < 0 || dy2 < 0){
+		//non-horizontal line
+		F=dy*(poly[2*jj]-poly[2*ii])/(dy-dy2)+poly[2*ii];
+		if (azimuth > F){
+		    intersections++;
+		}else if (azimuth == F){
+		    //point on line
+		    return 2;
+		}
+	    }else if (dy2 == 0 && (azimuth == poly[2*jj] || (dy == 0 && (azimuth-poly[2*ii])*(azimuth-poly[2*jj]) <= 0))){
+		//point on upper peak or horizontal line
+		return 2;
+	    }
+	}
+    }
+    return intersections & 1;
+}
+
+int read_nmea_cycle_filter(gnssrstream *sid, nmea_cycle * data, const nmea_filter * filter){
+    //reads the next cycle which falls within the time window of the filter (NULL accepts everything)
+    //only satellites which pass the filter are stored, and GNSSR_EOF is returned when the end of the time window is passed
+    //when the end of a growing file (sid->follow) is reached in the middle of a cycle, or no more data is available yet (GNSSR_AGAIN), the stream is positioned back at the start of the cycle, so that it can be read completely once more data has arrived
     nmea_type m_type; 
-    char buffer[NMEA_BUFFER_SIZE];
+    nmea_fields fields;
+    const char *line;
+    size_t slen;
     int err=init_nmea_cycle(data);
     if (err != GNSSR_SUCCESS){
 	return err;
     }
     int cycle_found=0;
+    int64_t cyclestart=sid->pos;
+    if (filter != NULL && sid->pos >= filter->end_offset){
+	return GNSSR_EOF;
+    }
+    mark_stream(sid);
     do{
-	err=readline(sid,buffer,NMEA_BUFFER_SIZE);
+	//note: line is a view on the stream data and is not null terminated
+	err=readline_view(sid,&line,&slen);
+	if ((err == GNSSR_EOF && sid->follow) || err == GNSSR_AGAIN){
+	    //possibly incomplete cycle (or line) at the end of a growing file or of the data received so far (seeking also clears the end of file indicator of stdio)
+	    if (seek_stream(sid,cyclestart,NULL) != GNSSR_SUCCESS){
+		return GNSSR_IO_ERROR;
+	    }
+	}
 	if (err != GNSSR_SUCCESS){
 	    return err;
 	}
-	m_type=check_nmea(buffer);
+	m_type=tokenize_nmea(line,&slen,&fields);
 	switch (m_type){
 	    case NMEA_GSV:
 		//Keep adding satellites in view until a RMC message is encountered
-		err=update_nmea_GSV(buffer,data);
+		err=update_nmea_GSV(line,&fields,data,filter);
 		break;
 	    case NMEA_RMC:
-		err=update_nmea_RMC(buffer,data);
-		cycle_found=1;
+		err=update_nmea_RMC(line,&fields,data);
+		//possibly keep adding the satellites of a void cycle to the next one
+		cycle_found=(filter == NULL || !filter->merge_void || data->status == 'A');
 		break;
 	    case NMEA_GGA:
 		//possibly adds orthometric and geoid height
-		int erropt=update_nmea_GGA(buffer,data);
+		int erropt=update_nmea_GGA(line,&fields,data);
 		if (erropt != GNSSR_SUCCESS){
 		    err=GNSSR_SUCCESS;
 		    //ok, as this is optional data
@@ -164,73 +379,354 @@ int read_nmea_cycle(gnssrstream *sid, nmea_cycle * data){
 	if (err != GNSSR_SUCCESS){
 	    return err;
 	}
+	if (cycle_found && filter != NULL){
+	    int64_t epoch=nmea_cycle_epoch(data);
+	    if (epoch >= filter->end){
+		return GNSSR_EOF;
+	    }
+	    if (epoch < filter->start){
+		//before the time window: start over with the next cycle
+		init_nmea_cycle(data);
+		cycle_found=0;
+		cyclestart=sid->pos;
+		mark_stream(sid);
+		if (sid->pos >= filter->end_offset){
+		    return GNSSR_EOF;
+		}
+	    }
+	}
     }while (! cycle_found);
 
     return GNSSR_SUCCESS;
 
 }
 
-int update_nmea_RMC(const char * nmea, nmea_cycle *data){
-	const char * nmeaPtr=nmea;
-	const char* kommaPtr=NULL;
-	if (shift_to_komma(&nmeaPtr,&kommaPtr,2) == GNSSR_IO_ERROR){
+///days since 1970-01-01 of a proleptic gregorian date
+static int64_t days_from_civil(int year, int month, int day){
+	year-= month <= 2;
+	const int64_t era=(year >= 0 ? year : year-399)/400;
+	const int64_t yoe=year-era*400;
+	const int64_t doy=(153*(month + (month > 2 ? -3 : 9)) + 2)/5 + day-1;
+	const int64_t doe=yoe*365 + yoe/4 - yoe/100 + doy;
+	return era*146097 + doe - 719468;
+}
+
+int64_t nmea_cycle_epoch(const nmea_cycle * data){
+	int64_t days=days_from_civil(data->year,data->month,data->day);
+	return (((days*24+data->hr)*60+data->min)*60+data->sec)*1000000000LL+data->usec*1000LL;
+}
+
+///inverse of days_from_civil
+static void civil_from_days(int64_t days, int * year, int * month, int * day){
+	days+=719468;
+	const int64_t era=(days >= 0 ? days : days-146096)/146097;
+	const int64_t doe=days-era*146097;
+	const int64_t yoe=(doe - doe/1460 + doe/36524 - doe/146096)/365;
+	const int64_t doy=doe - (365*yoe + yoe/4 - yoe/100);
+	const int64_t mp=(5*doy + 2)/153;
+	*day=doy - (153*mp+2)/5 + 1;
+	*month=mp < 10 ? mp+3 : mp-9;
+	*year=yoe + era*400 + (*month <= 2);
+}
+
+void set_nmea_cycle_epoch(nmea_cycle * data, int64_t epoch){
+	const int64_t nsday=86400000000000LL;
+	int64_t days=epoch/nsday;
+	int64_t nsec=epoch%nsday;
+	if (nsec < 0){
+	    nsec+=nsday;
+	    days--;
+	}
+	civil_from_days(days,&data->year,&data->month,&data->day);
+	data->hr=nsec/3600000000000LL;
+	nsec-=data->hr*3600000000000LL;
+	data->min=nsec/60000000000LL;
+	nsec-=data->min*60000000000LL;
+	data->sec=nsec/1000000000LL;
+	nsec-=data->sec*1000000000LL;
+	data->usec=nsec/1000;
+}
+
+static void append_nmea_batch(nmea_batch * batch, const nmea_cycle * data){
+	int icyc=batch->ncycles;
+	int isat=batch->nsats;
+	batch->epoch[icyc]=nmea_cycle_epoch(data);
+	batch->lat[icyc]=data->lat;
+	batch->lon[icyc]=data->lon;
+	batch->ortho_height[icyc]=data->ortho_height;
+	batch->geoid_height[icyc]=data->geoid_height;
+	for (int i=0;i<data->sats_in_view;++i){
+	    batch->prn[isat+i]=data->prn[i];
+	    batch->system[isat+i]=(int8_t)data->system[i].code;
+	    batch->elevation[isat+i]=data->elevation[i];
+	    batch->azimuth[isat+i]=data->azimuth[i];
+	    batch->cnr0[isat+i]=data->cnr0[i];
+	}
+	batch->nsats+=data->sats_in_view;
+	for (int i=0;i<data->nmasked;++i){
+	    batch->masked_prn[batch->nmasked+i]=data->masked_prn[i];
+	    batch->masked_pos[batch->nmasked+i]=data->masked_pos[i];
+	}
+	batch->nmasked+=data->nmasked;
+	batch->ncycles++;
+	batch->offset[batch->ncycles]=batch->nsats;
+	batch->masked_offset[batch->ncycles]=batch->nmasked;
+}
+
+int read_nmea_batch(gnssrstream *sid, nmea_batch * batch, const nmea_filter * filter){
+    //fills the batch with cycles until the buffers are full or the stream is exhausted
+    //returns GNSSR_SUCCESS when the batch is full and GNSSR_EOF when the end of the stream is reached, or GNSSR_AGAIN when no more data is available yet (the batch may still hold data)
+    nmea_cycle cycle;
+    int err=GNSSR_SUCCESS;
+    batch->ncycles=0;
+    batch->nsats=0;
+    batch->nmasked=0;
+    batch->offset[0]=0;
+    batch->masked_offset[0]=0;
+    while (batch->ncycles < batch->maxcycles && batch->nsats+NMEA_GSV_MAX_SATELLITES <= batch->maxsats && batch->nmasked+NMEA_GSV_MAX_SATELLITES <= batch->maxsats){
+	err=read_nmea_cycle_filter(sid,&cycle,filter);
+	if (err != GNSSR_SUCCESS){
+	    return err;
+	}
+	if (cycle.sats_in_view == 0 && cycle.nmasked == 0){
+	    continue;
+	}
+	append_nmea_batch(batch,&cycle);
+    }
+    return GNSSR_SUCCESS;
+}
+
+int get_nmea_batch_cycle(const nmea_batch * batch, int icycle, nmea_cycle * data){
+	//fill a cycle from the columnar data of a batch
+	if (icycle < 0 || icycle >= batch->ncycles){
 	    return GNSSR_IO_ERROR;
 	}
-	
-	//extract UTC time
-	extract_time(nmeaPtr,&data->hr,&data->min,&data->sec);
-	/*sscanf(nmeaPtr,"%02d%02d", &data->hr,&data->min);*/
-	/*data->sec=atof(nmeaPtr+5);*/
-	
-	if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){
+	int64_t isat=batch->offset[icycle];
+	int nsats=batch->offset[icycle+1]-isat;
+	if (nsats > NMEA_GSV_MAX_SATELLITES){
 	    return GNSSR_IO_ERROR;
 	}
+	set_nmea_cycle_epoch(data,batch->epoch[icycle]);
+	data->lat=batch->lat[icycle];
+	data->lon=batch->lon[icycle];
+	data->ortho_height=batch->ortho_height[icycle];
+	data->geoid_height=batch->geoid_height[icycle];
+	data->sats_in_view=nsats;
+	for (int i=0;i<nsats;++i){
+	    data->prn[i]=batch->prn[isat+i];
+	    copy_GNSS_as(&data->system[i],gnss_from_code(batch->system[isat+i]));
+	    data->elevation[i]=batch->elevation[isat+i];
+	    data->azimuth[i]=batch->azimuth[isat+i];
+	    data->cnr0[i]=batch->cnr0[isat+i];
+	}
+	int64_t imask=batch->masked_offset[icycle];
+	data->nmasked=batch->masked_offset[icycle+1]-imask;
+	if (data->nmasked > NMEA_GSV_MAX_SATELLITES){
+	    return GNSSR_IO_ERROR;
+	}
+	for (int i=0;i<data->nmasked;++i){
+	    data->masked_prn[i]=batch->masked_prn[imask+i];
+	    data->masked_pos[i]=batch->masked_pos[imask+i];
+	}
+	return GNSSR_SUCCESS;
+}
+
+int index_nmea_stream(gnssrstream *sid, int64_t span, nmea_checkpoint **list, int *npoints){
+    //scans the stream and stores a checkpoint at the first cycle after every span bytes
+    //only the RMC messages, which end the cycles, are decoded
+    //the list is allocated here and needs to be freed by the caller
+    nmea_cycle cycle;
+    nmea_fields fields;
+    const char *line;
+    size_t slen;
+    int nalloc=0;
+    int64_t last=0;
+    int64_t pos=sid->pos; //start of the current cycle
+    int err;
+    *list=NULL;
+    *npoints=0;
+    while (1){
+	err=readline_view(sid,&line,&slen);
+	if (err != GNSSR_SUCCESS){
+	    break;
+	}
+	if (slen < 6 || memcmp(line+3,"RMC",3) != 0 || tokenize_nmea(line,&slen,&fields) != NMEA_RMC){
+	    continue;
+	}
+	init_nmea_cycle(&cycle);
+	err=update_nmea_RMC(line,&fields,&cycle);
+	if (err != GNSSR_SUCCESS){
+	    break;
+	}
+	int64_t epoch=nmea_cycle_epoch(&cycle);
+	int64_t start=pos;
+	//the next cycle starts after the RMC message
+	pos=sid->pos;
+	if (*npoints > 0 && start-last < span){
+	    (*list)[*npoints-1].last=epoch;
+	    continue;
+	}
+	if (*npoints == nalloc){
+	    nalloc=nalloc?2*nalloc:64;
+	    nmea_checkpoint *tmp=realloc(*list,nalloc*sizeof(nmea_checkpoint));
+	    if (tmp == NULL){
+		err=GNSSR_IO_ERROR;
+		break;
+	    }
+	    *list=tmp;
+	}
+	(*list)[*npoints].pos=start;
+	(*list)[*npoints].first=epoch;
+	(*list)[*npoints].last=epoch;
+	(*npoints)++;
+	last=start;
+    }
+    if (err == GNSSR_EOF){
+	return GNSSR_SUCCESS;
+    }
+    free(*list);
+    *list=NULL;
+    *npoints=0;
+    return err;
+}
 
+static void add_nmea_talker(nmea_scan *scan, const char * nmea){
+	for (int i=0;i<scan->ntalkers;i++){
+	    if (memcmp(scan->talkers[i],nmea+1,2) == 0){
+		return;
+	    }
+	}
+	if (scan->ntalkers < NMEA_SCAN_MAX_TALKERS){
+	    memcpy(scan->talkers[scan->ntalkers],nmea+1,2);
+	    scan->talkers[scan->ntalkers][2]='\0';
+	    scan->ntalkers++;
+	}
+}
 
-	data->status=*(nmeaPtr);
-	
+int scan_nmea_stream(gnssrstream *sid, int64_t mingap, nmea_scan *scan){
+    //scans the stream while validating the checksums of all lines, but only decodes the times of the RMC messages
+    //gaps between consecutive cycles which exceed mingap (nanoseconds) are stored in scan->gaps, which needs to be freed by the caller (free_nmea_scan)
+    nmea_cycle cycle;
+    nmea_fields fields;
+    const char *line;
+    size_t slen;
+    int nalloc=0;
+    int64_t prev=0; //epoch of the preceding cycle
+    int err;
+    memset(scan,0,sizeof(nmea_scan));
+    scan->first=INT64_MIN;
+    scan->last=INT64_MIN;
+    while (1){
+	err=readline_view(sid,&line,&slen);
+	if (err != GNSSR_SUCCESS){
+	    break;
+	}
+	//ignore empty lines
+	while (slen > 0 && (line[slen-1] == '\n' || line[slen-1] == '\r')){
+	    slen--;
+	}
+	if (slen == 0){
+	    continue;
+	}
+	scan->nlines++;
+	nmea_type m_type=tokenize_nmea(line,&slen,&fields);
+	if (m_type == NMEA_INVALID){
+	    scan->ninvalid++;
+	    continue;
+	}
+	if (m_type == NMEA_GSV){
+	    add_nmea_talker(scan,line);
+	    continue;
+	}
+	if (m_type != NMEA_RMC){
+	    continue;
+	}
+	init_nmea_cycle(&cycle);
+	if (update_nmea_RMC(line,&fields,&cycle) != GNSSR_SUCCESS){
+	    scan->ninvalid++;
+	    continue;
+	}
+	int64_t epoch=nmea_cycle_epoch(&cycle);
+	if (scan->ncycles == 0){
+	    scan->first=epoch;
+	    scan->last=epoch;
+	}else if (epoch < prev){
+	    scan->nbackward++;
+	}else if (epoch-prev > mingap){
+	    if (scan->ngaps == nalloc){
+		nalloc=nalloc?2*nalloc:16;
+		int64_t *tmp=realloc(scan->gaps,2*nalloc*sizeof(int64_t));
+		if (tmp == NULL){
+		    err=GNSSR_IO_ERROR;
+		    break;
+		}
+		scan->gaps=tmp;
+	    }
+	    scan->gaps[2*scan->ngaps]=prev;
+	    scan->gaps[2*scan->ngaps+1]=epoch;
+	    scan->ngaps++;
+	}
+	if (epoch < scan->first){
+	    scan->first=epoch;
+	}
+	if (epoch > scan->last){
+	    scan->last=epoch;
+	}
+	prev=epoch;
+	scan->ncycles++;
+    }
+    if (err == GNSSR_EOF){
+	return GNSSR_SUCCESS;
+    }
+    free_nmea_scan(scan);
+    return err;
+}
+
+void free_nmea_scan(nmea_scan *scan){
+    free(scan->gaps);
+    scan->gaps=NULL;
+    scan->ngaps=0;
+}
 
-	if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){
+int update_nmea_RMC(const char * nmea, const nmea_fields *fields, nmea_cycle *data){
+	//we need the fields up to the date (and the field behind it)
+	if (fields->nfields < 11){
 	    return GNSSR_IO_ERROR;
 	}
+	
+	//extract UTC time
+	extract_time(field_start(nmea,fields,1),field_end(nmea,fields,1),&data->hr,&data->min,&data->sec,&data->usec);
+
+	data->status=*field_start(nmea,fields,2);
 
 	//extract latitude
-	float deg=atof(nmeaPtr);
+	double deg=field_decimal(nmea,fields,3);
 	deg=convert_deg(deg);
 	
-	if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){
-	    return GNSSR_IO_ERROR;
-	}
-	
-	if (*(nmeaPtr)=='S'){
+	if (*field_start(nmea,fields,4)=='S'){
 		data->lat=-deg;
 	}else{
 		data->lat=deg;
 	}
 
-	if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){
-	    return GNSSR_IO_ERROR;
-	}
-	deg=atof(nmeaPtr);
-
+	deg=field_decimal(nmea,fields,5);
 	deg=convert_deg(deg);
 
-	if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){
-	    return GNSSR_IO_ERROR;
-	}
-	if (*(nmeaPtr)=='W'){
+	if (*field_start(nmea,fields,6)=='W'){
 		data->lon=-deg;
 	}else{
 		data->lon=deg;
 	}
 	
 	/*///skip the speed and course*/
-	if (shift_to_komma(&nmeaPtr,&kommaPtr,3) == GNSSR_IO_ERROR){
-	    return GNSSR_IO_ERROR;
-	}
     
 	//extract date
-	sscanf(nmeaPtr,"%02d%02d%02d", &data->day,&data->month,&data->year);
+	//note: don't use sscanf here, as it calls strlen on (possibly very long, memory mapped) non-terminated lines
+	const char *nmeaPtr=field_start(nmea,fields,9);
+	const char *end=field_end(nmea,fields,9);
+	if (parse_2digits(nmeaPtr,end,&data->day) == GNSSR_SUCCESS && parse_2digits(nmeaPtr+2,end,&data->month) == GNSSR_SUCCESS){
+		parse_2digits(nmeaPtr+4,end,&data->year);
+	}
 	if (data->year < 80){
 		data->year+=2000;
 	}
@@ -250,62 +746,68 @@ void get_gnss_system(const char * nmea,gnss_system *system){
 
 }
 
-int update_nmea_GSV(const char * nmea, nmea_cycle *data){
-	const char * nmeaPtr=nmea;
-	const char* kommaPtr=NULL;
+int update_nmea_GSV(const char * nmea, const nmea_fields *fields, nmea_cycle *data, const nmea_filter *filter){
+	const int nfields=fields->nfields;
 	//check satellite system
 	gnss_system system;
-	get_gnss_system(nmeaPtr,&system);
+	get_gnss_system(nmea,&system);
+	if (filter != NULL && !accept_system(filter,system.code)){
+	    //no need to parse the satellites of this system
+	    return GNSSR_SUCCESS;
+	}
 
-	if (shift_to_komma(&nmeaPtr,&kommaPtr,4) == GNSSR_IO_ERROR){
+	//skip the total number of messages, the message id and the number of satellites in view
+	if (nfields < 5){
 	    return GNSSR_IO_ERROR;
 	}
-
-	//extract total number of messages in this cycle
-	/*int total_messages=atoi(nmeaPtr);*/
-	
-
-	/*if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){*/
-	    /*return GNSSR_IO_ERROR;*/
-	/*}*/
-	//extract message id in this cycle
-	/*int messageid=atoi(nmeaPtr)-1;*/
-	
-	/*if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){*/
-	    /*return GNSSR_IO_ERROR;*/
-	/*}*/
-	
-	/*int satellites_in_view=atoi(nmeaPtr);*/
-
-	/*if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){*/
-	    /*return GNSSR_IO_ERROR;*/
-	/*}*/
 	
 	int prn;
 	float elev;
 	float az;
 	float cnr0;
 	int stop=0;
-	for (int i=0 ;i<4;++i){
-	    if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){
-		//possibly gracefully end the cycle
+	//satellites come in groups of 4 fields: prn, elevation, azimuth and cnr0
+	for (int ifield=4 ;ifield<20;ifield+=4){
+	    if (ifield >= nfields-1){
+		//possibly gracefully end the cycle (e.g. a trailing signal id)
 		return GNSSR_SUCCESS;
 	    }
-	    prn=atoi(nmeaPtr);
-	    if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){
+	    if (ifield+2 >= nfields-1){
+		//incomplete satellite
 		return GNSSR_IO_ERROR;
 	    }
-	    elev=atof(nmeaPtr);
-	    if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){
-		return GNSSR_IO_ERROR;
+	    //ok to have the cnr0 as the last field
+	    stop=(ifield+3 == nfields-1);
+	    if (filter != NULL && filter->skip_empty && (field_empty(nmea,fields,ifield) || field_empty(nmea,fields,ifield+1) || field_empty(nmea,fields,ifield+2) || field_empty(nmea,fields,ifield+3))){
+		if (stop){
+		    return GNSSR_SUCCESS;
+		}
+		continue;
 	    }
-	    az=atof(nmeaPtr);
-	    if (shift_to_komma(&nmeaPtr,&kommaPtr,1) == GNSSR_IO_ERROR){
-		//ok to have an error here (no komma found at the end)
-		stop=1;
+	    prn=parse_int(field_start(nmea,fields,ifield),field_end(nmea,fields,ifield));
+	    elev=field_decimal(nmea,fields,ifield+1);
+	    az=field_decimal(nmea,fields,ifield+2);
+	    cnr0=field_decimal(nmea,fields,ifield+3);
+
+	    if (filter != NULL && !accept_satellite(filter,prn,elev,cnr0)){
+		if (stop){
+		    return GNSSR_SUCCESS;
+		}
+		continue;
 	    }
 
-	    cnr0=atof(nmeaPtr);
+	    if (filter != NULL && filter->poly != NULL && in_skymask(filter->poly,filter->npoly,elev,az) == 0){
+		//outside of the sky mask: only keep track of the prn
+		if (data->nmasked < NMEA_GSV_MAX_SATELLITES){
+		    data->masked_prn[data->nmasked]=prn;
+		    data->masked_pos[data->nmasked]=data->sats_in_view;
+		    data->nmasked++;
+		}
+		if (stop){
+		    return GNSSR_SUCCESS;
+		}
+		continue;
+	    }
 
 	    int idx=data->sats_in_view;
 	    data->prn[idx]=prn;
@@ -318,6 +820,8 @@ int update_nmea_GSV(const char * nmea, nmea_cycle *data){
 		//maximum number of satellites in view reached (start over)
 		printf("Maximum number of satellites in view reached, resetting cycle\n");
 		data->sats_in_view=0;
+		//the positions of the masked satellites refer to the discarded satellites
+		data->nmasked=0;
 	    }
 	    if (stop){
 		return GNSSR_SUCCESS;
@@ -331,24 +835,20 @@ int update_nmea_GSV(const char * nmea, nmea_cycle *data){
 }
 
 
-int update_nmea_GGA(const char * nmea, nmea_cycle *data){
+int update_nmea_GGA(const char * nmea, const nmea_fields *fields, nmea_cycle *data){
 	
-	const char * nmeaPtr=nmea;
-	const char* kommaPtr=NULL;
 	//skip stuff which we already have from the RMC message
-	if (shift_to_komma(&nmeaPtr,&kommaPtr,10) == GNSSR_IO_ERROR){
+	if (fields->nfields < 11){
 	    return GNSSR_IO_ERROR;
 	}
     
-	data->ortho_height=atof(nmeaPtr);
+	data->ortho_height=field_decimal(nmea,fields,9);
 
-
-	if (shift_to_komma(&nmeaPtr,&kommaPtr,2) == GNSSR_IO_ERROR){
+	if (fields->nfields < 13){
 	    return GNSSR_IO_ERROR;
 	}
 
-
-	data->geoid_height=atof(nmeaPtr);
+	data->geoid_height=field_decimal(nmea,fields,11);
 
 	return GNSSR_SUCCESS;
 
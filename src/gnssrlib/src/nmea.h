@@ -17,6 +17,7 @@
 
 
 #include <stdio.h>
+#include <stdint.h>
 #include <zlib.h>
 #include <string.h>
 #include "gnssrlib.h"
@@ -34,6 +35,9 @@
 
 #define NMEA_FILL -9999
 
+//maximum number of fields which are split off a line (a GSV message has 21 at most)
+#define NMEA_MAX_FIELDS 32
+
 typedef enum nmea_type { 
 	NMEA_GGA,
 	NMEA_GSV,
@@ -55,10 +59,11 @@ struct nmea_cycle{
 	int day;
 	int hr;
 	int min;
-	float sec;
+	int sec;
+	int usec; //microseconds of the second (exact, the same resolution as python datetimes)
 	char status;
-	float lat;
-	float lon;
+	double lat;
+	double lon;
 	float ortho_height;
 	float geoid_height;
 	//GSV Stuff
@@ -68,22 +73,134 @@ struct nmea_cycle{
 	float elevation[NMEA_GSV_MAX_SATELLITES];
 	float azimuth[NMEA_GSV_MAX_SATELLITES];
 	float cnr0[NMEA_GSV_MAX_SATELLITES];
+	//satellites rejected by the sky mask of a filter
+	int nmasked;
+	int masked_prn[NMEA_GSV_MAX_SATELLITES];
+	int masked_pos[NMEA_GSV_MAX_SATELLITES]; //amount of accepted satellites preceding the masked satellite
 };
 
 typedef struct nmea_cycle nmea_cycle;
 
+///Columnar storage of a batch of nmea cycles (buffers are owned by the caller)
+struct nmea_batch{
+	//capacity of the per cycle and per satellite buffers
+	int maxcycles;
+	int maxsats;
+	//amount of filled cycles and satellites
+	int ncycles;
+	int nsats;
+	//per cycle data
+	int64_t *epoch; //nanoseconds since 1970-01-01
+	int64_t *offset; //index of the first satellite of each cycle (size maxcycles+1)
+	double *lat;
+	double *lon;
+	float *ortho_height;
+	float *geoid_height;
+	//per satellite data
+	int *prn;
+	int8_t *system;
+	float *elevation;
+	float *azimuth;
+	float *cnr0;
+	//satellites rejected by the sky mask (size maxsats)
+	int nmasked;
+	int64_t *masked_offset; //index of the first masked satellite of each cycle (size maxcycles+1)
+	int *masked_prn;
+	int *masked_pos;
+};
+
+typedef struct nmea_batch nmea_batch;
+
+///Selection criteria which are applied while decoding cycles
+struct nmea_filter{
+	int64_t start; //time window [start,end) in nanoseconds since 1970-01-01
+	int64_t end;
+	int64_t end_offset; //stop at the first cycle which starts at or after this uncompressed byte offset (e.g. a checkpoint of another part of the stream)
+	uint32_t systems; //bitmask of accepted gnss codes (1 << code), 0 accepts all systems
+	int use_prns; //when set only accept the prns in the bitset below
+	uint64_t prns[4]; //bitset of accepted PRNs (0-255)
+	float min_elevation;
+	float max_elevation;
+	float min_cnr0;
+	int skip_empty; //skip satellites with empty prn, elevation, azimuth or cnr0 fields (which are otherwise decoded as 0)
+	int merge_void; //carry the satellites of cycles with a void RMC message (status other than 'A') over to the next valid cycle
+	//sky mask: closed polygon with (azimuth,elevation) vertices, satellites outside are only reported by prn
+	int npoly;
+	const double *poly;
+};
+
+typedef struct nmea_filter nmea_filter;
+
+///Stream position at the start of a cycle (used for seeking in time)
+struct nmea_checkpoint{
+	int64_t pos; //uncompressed byte offset of the first line of the cycle
+	int64_t first; //epoch of the cycle at the checkpoint (nanoseconds since 1970-01-01)
+	int64_t last; //epoch of the last cycle before the next checkpoint
+};
+
+typedef struct nmea_checkpoint nmea_checkpoint;
+
+//maximum number of distinct talker ids which are recorded by a scan
+#define NMEA_SCAN_MAX_TALKERS 16
+
+///Summary of a NMEA stream (see scan_nmea_stream)
+struct nmea_scan{
+	int64_t first; //earliest and latest epoch of the cycles (nanoseconds since 1970-01-01), INT64_MIN when no cycles are found
+	int64_t last;
+	int64_t ncycles; //amount of cycles (valid RMC messages)
+	int64_t nlines; //amount of non-empty lines
+	int64_t ninvalid; //lines which are not a valid NMEA message (e.g. checksum errors)
+	int64_t nbackward; //cycles which are earlier than the preceding cycle
+	int ntalkers;
+	char talkers[NMEA_SCAN_MAX_TALKERS][3]; //null terminated talker ids of the GSV messages (e.g. GP, GL)
+	int ngaps;
+	int64_t *gaps; //pairs of epochs (last cycle before, first cycle after) of gaps exceeding the minimum gap, free with free_nmea_scan
+};
+
+typedef struct nmea_scan nmea_scan;
+
+///Offsets of the fields of a NMEA line (fields are separated by kommas, the first field holds the $ and the message id)
+struct nmea_fields{
+	int nfields;
+	size_t start[NMEA_MAX_FIELDS+1]; //offset of the first character of each field, followed by the offset behind the *
+};
+
+typedef struct nmea_fields nmea_fields;
+
 unsigned char calculate_checksum(const char * nmea);
 
-int update_nmea_RMC(const char * nmea, nmea_cycle *data);
+int update_nmea_RMC(const char * nmea, const nmea_fields *fields, nmea_cycle *data);
 
-int update_nmea_GSV(const char * nmea, nmea_cycle *data);
+int update_nmea_GSV(const char * nmea, const nmea_fields *fields, nmea_cycle *data, const nmea_filter *filter);
 
-int update_nmea_GGA(const char * nmea, nmea_cycle *data);
+int update_nmea_GGA(const char * nmea, const nmea_fields *fields, nmea_cycle *data);
 
 nmea_type check_nmea(char * nmea);
 
+nmea_type check_nmea_len(const char * nmea, size_t *slen);
+
+nmea_type tokenize_nmea(const char * nmea, size_t *slen, nmea_fields *fields);
+
 int init_nmea_cycle(nmea_cycle * data);
 
 int read_nmea_cycle(gnssrstream *sid, nmea_cycle * data);
 
+void init_nmea_filter(nmea_filter * filter);
+
+int read_nmea_cycle_filter(gnssrstream *sid, nmea_cycle * data, const nmea_filter * filter);
+
+int64_t nmea_cycle_epoch(const nmea_cycle * data);
+
+void set_nmea_cycle_epoch(nmea_cycle * data, int64_t epoch);
+
+int read_nmea_batch(gnssrstream *sid, nmea_batch * batch, const nmea_filter * filter);
+
+int get_nmea_batch_cycle(const nmea_batch * batch, int icycle, nmea_cycle * data);
+
+int index_nmea_stream(gnssrstream *sid, int64_t span, nmea_checkpoint **list, int *npoints);
+
+int scan_nmea_stream(gnssrstream *sid, int64_t mingap, nmea_scan *scan);
+
+void free_nmea_scan(nmea_scan *scan);
+
 #endif //NMEA_H
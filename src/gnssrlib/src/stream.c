@@ -21,20 +21,194 @@
 #include "gnssrlib.h"
 #include "stream.h"
 #ifdef USE_GZIP
-#include <zlib.h>
+#include "gzstream.h"
 #endif
 
 #ifdef USE_LZ4
 #include "lz4stream.h"
 #endif
 
+#ifdef USE_ZSTD
+#include "zstdstream.h"
+#endif
+
+#include <stdlib.h>
+#include <errno.h>
+#include <unistd.h>
+#ifdef USE_MMAP
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+
+///Memory map a file, returns NULL when the file cannot be mapped
+memstream* open_mmapstream(const char *filename){
+    int fd=open(filename,O_RDONLY);
+    if (fd < 0){
+	return NULL;
+    }
+    struct stat st;
+    if (fstat(fd,&st) != 0 || !S_ISREG(st.st_mode)){
+	close(fd);
+	return NULL;
+    }
+    memstream* mid=malloc(sizeof(memstream));
+    if (mid == NULL){
+	close(fd);
+	return NULL;
+    }
+    mid->size=st.st_size;
+    mid->data=NULL;
+    mid->mapped=1;
+    if (mid->size > 0){
+	void *data=mmap(NULL,mid->size,PROT_READ,MAP_PRIVATE,fd,0);
+	if (data == MAP_FAILED){
+	    close(fd);
+	    free(mid);
+	    return NULL;
+	}
+	madvise(data,mid->size,MADV_SEQUENTIAL);
+	mid->data=data;
+    }
+    //the mapping stays valid after closing the file descriptor
+    close(fd);
+    mid->ptr=mid->data;
+    return mid;
+}
+#endif //USE_MMAP
+
+///View on a memory buffer owned by the caller
+memstream* open_memstream_view(const char *data, size_t size){
+    memstream* mid=malloc(sizeof(memstream));
+    if (mid == NULL){
+	return NULL;
+    }
+    mid->data=data;
+    mid->size=size;
+    mid->ptr=data;
+    mid->mapped=0;
+    return mid;
+}
+
+void close_memstream(memstream* mid){
+#ifdef USE_MMAP
+    if (mid->mapped && mid->data != NULL){
+	munmap((void*)mid->data,mid->size);
+    }
+#endif
+    free(mid);
+}
+
+///Retrieve a view of the next line (including the newline character) without copying
+int readline_mem(memstream* mid, const char **line, size_t *len){
+    const char *end=mid->data+mid->size;
+    if (mid->ptr >= end){
+	*len=0;
+	return GNSSR_EOF;
+    }
+    *line=mid->ptr;
+    const char *nl=memchr(mid->ptr,'\n',end-mid->ptr);
+    if (nl == NULL){
+	//last line without a newline
+	mid->ptr=end;
+    }else{
+	mid->ptr=nl+1;
+    }
+    *len=mid->ptr-*line;
+    return GNSSR_SUCCESS;
+}
+
+///Read lines from a file descriptor (which is not closed by the stream)
+fdstream* open_fdstream(int fd){
+    fdstream* fs=malloc(sizeof(fdstream));
+    if (fs == NULL){
+	return NULL;
+    }
+    fs->buf=malloc(GNSSR_FD_BUFFER);
+    if (fs->buf == NULL){
+	free(fs);
+	return NULL;
+    }
+    fs->fd=fd;
+    fs->eof=0;
+    fs->cap=GNSSR_FD_BUFFER;
+    fs->head=0;
+    fs->tail=0;
+    fs->marked=0;
+    fs->mark=0;
+    fs->base=0;
+    return fs;
+}
+
+void close_fdstream(fdstream* fs){
+    free(fs->buf);
+    free(fs);
+}
+
+///Retrieve a view of the next complete line, returns GNSSR_AGAIN when a non-blocking descriptor has no more data yet
+int readline_fd(fdstream* fs, const char **line, size_t *len){
+    const char *nl;
+    size_t scanned=0;
+    *len=0;
+    while (1){
+	nl=memchr(fs->buf+fs->head+scanned,'\n',fs->tail-fs->head-scanned);
+	if (nl != NULL){
+	    break;
+	}
+	scanned=fs->tail-fs->head;
+	if (fs->eof){
+	    //last line without a newline
+	    if (scanned == 0){
+		return GNSSR_EOF;
+	    }
+	    *line=fs->buf+fs->head;
+	    *len=scanned;
+	    fs->head=fs->tail;
+	    return GNSSR_SUCCESS;
+	}
+	if (fs->tail == fs->cap){
+	    //discard the data before the mark (or the unread data) and grow the buffer when that does not free up space
+	    size_t keep=fs->marked?fs->mark:fs->head;
+	    if (keep > 0){
+		memmove(fs->buf,fs->buf+keep,fs->tail-keep);
+		fs->head-=keep;
+		fs->tail-=keep;
+		fs->mark-=fs->marked?keep:0;
+		fs->base+=keep;
+	    }else{
+		char *tmp=realloc(fs->buf,2*fs->cap);
+		if (tmp == NULL){
+		    return GNSSR_IO_ERROR;
+		}
+		fs->buf=tmp;
+		fs->cap*=2;
+	    }
+	}
+	ssize_t nread=read(fs->fd,fs->buf+fs->tail,fs->cap-fs->tail);
+	if (nread > 0){
+	    fs->tail+=nread;
+	}else if (nread == 0){
+	    fs->eof=1;
+	}else if (errno == EAGAIN || errno == EWOULDBLOCK){
+	    return GNSSR_AGAIN;
+	}else if (errno != EINTR){
+	    return GNSSR_IO_ERROR;
+	}
+    }
+    *line=fs->buf+fs->head;
+    *len=nl+1-*line;
+    fs->head+=*len;
+    return GNSSR_SUCCESS;
+}
+
 int open_stream(const char *filename,gnssrstream* sid){
     size_t slen=strlen(filename);
+    sid->pos=0;
+    sid->follow=0;
 
     if (strncmp(filename+slen-3,".gz",3) == 0) {
 #ifdef USE_GZIP
 	sid->ftype = GZIP;
-	sid->fid = (void*)gzopen(filename, "r");
+	sid->fid = (void*)open_gzstream(filename);
 	if (!sid->fid) {
 	    fprintf(stderr, "Could not open file %s\n", filename);
 	    return GNSSR_IO_ERROR;
@@ -63,6 +237,31 @@ int open_stream(const char *filename,gnssrstream* sid){
 #endif
     }
 
+    if (strncmp(filename+slen-4,".zst",4) == 0 || strncmp(filename+slen-5,".zstd",5) == 0) {
+#ifdef USE_ZSTD
+	sid->ftype = ZSTD;
+	sid->fid=(void*)open_zstdstream(filename);
+	if (sid->fid== NULL) {
+	    fprintf(stderr, "Could not open file %s\n", filename);
+	    return GNSSR_IO_ERROR;
+	}else{
+	    return GNSSR_SUCCESS;
+	}
+#else
+	fprintf(stderr, "ZSTD support not compiled in\n");
+	return GNSSR_IO_ERROR;
+#endif
+    }
+
+#ifdef USE_MMAP
+    sid->ftype = MEMORY;
+    sid->fid = (void*)open_mmapstream(filename);
+    if (sid->fid != NULL){
+	return GNSSR_SUCCESS;
+    }
+    //fall back to buffered reading when the file can not be memory mapped
+#endif
+
     sid->ftype = UNCOMPRESSED;
     sid->fid = (void*)fopen(filename, "r");
     if (sid->fid == NULL) {
@@ -73,12 +272,98 @@ int open_stream(const char *filename,gnssrstream* sid){
     }
 }
 
+int open_stream_follow(const char *filename,gnssrstream* sid){
+    //open an uncompressed file which is still being written to (e.g. by a logger)
+    //the file is read through stdio (not memory mapped), so that lines which are appended after reaching the end of the file can be picked up
+    sid->pos=0;
+    sid->follow=1;
+    sid->ftype = UNCOMPRESSED;
+    sid->fid = (void*)fopen(filename, "r");
+    if (sid->fid == NULL) {
+	fprintf(stderr, "Could not open file %s\n", filename);
+	return GNSSR_IO_ERROR;
+    }
+    return GNSSR_SUCCESS;
+}
+
+int open_stream_fd(int fd,gnssrstream* sid){
+    //read from a file descriptor such as a serial port or a (TCP) socket, which is owned by the caller
+    //when the descriptor is non-blocking, reading returns GNSSR_AGAIN when no (complete) data is available yet
+    sid->pos=0;
+    sid->follow=0;
+    sid->ftype = FD;
+    sid->fid = (void*)open_fdstream(fd);
+    return sid->fid == NULL?GNSSR_IO_ERROR:GNSSR_SUCCESS;
+}
+
+int open_stream_buffer(const char *data, size_t size, const char *compression, gnssrstream* sid){
+    //open a stream on a memory buffer which needs to stay alive until the stream is closed
+    //compression can be "gzip", "lz4", "zstd", "none" or NULL (detect from the magic bytes of the buffer)
+    static const unsigned char gzmagic[2]={0x1f,0x8b};
+    static const unsigned char lz4magic[4]={0x04,0x22,0x4d,0x18};
+    static const unsigned char zstdmagic[4]={0x28,0xb5,0x2f,0xfd};
+    sid->pos=0;
+    sid->follow=0;
+    if (compression == NULL){
+	if (size >= 2 && memcmp(data,gzmagic,2) == 0){
+	    compression="gzip";
+	}else if (size >= 4 && memcmp(data,lz4magic,4) == 0){
+	    compression="lz4";
+	}else if (size >= 4 && memcmp(data,zstdmagic,4) == 0){
+	    compression="zstd";
+	}else{
+	    compression="none";
+	}
+    }
+
+    if (strcmp(compression,"gzip") == 0){
+#ifdef USE_GZIP
+	sid->ftype = GZIP;
+	sid->fid = (void*)open_gzstream_mem(data,size);
+	return sid->fid == NULL?GNSSR_IO_ERROR:GNSSR_SUCCESS;
+#else
+	fprintf(stderr, "GZIP support not compiled in\n");
+	return GNSSR_IO_ERROR;
+#endif
+    }
+
+    if (strcmp(compression,"lz4") == 0){
+#ifdef USE_LZ4
+	sid->ftype = LZ4;
+	sid->fid = (void*)open_lz4stream_mem(data,size);
+	return sid->fid == NULL?GNSSR_IO_ERROR:GNSSR_SUCCESS;
+#else
+	fprintf(stderr, "LZ4 support not compiled in\n");
+	return GNSSR_IO_ERROR;
+#endif
+    }
+
+    if (strcmp(compression,"zstd") == 0){
+#ifdef USE_ZSTD
+	sid->ftype = ZSTD;
+	sid->fid = (void*)open_zstdstream_mem(data,size);
+	return sid->fid == NULL?GNSSR_IO_ERROR:GNSSR_SUCCESS;
+#else
+	fprintf(stderr, "ZSTD support not compiled in\n");
+	return GNSSR_IO_ERROR;
+#endif
+    }
+
+    if (strcmp(compression,"none") == 0){
+	sid->ftype = MEMORY;
+	sid->fid = (void*)open_memstream_view(data,size);
+	return sid->fid == NULL?GNSSR_IO_ERROR:GNSSR_SUCCESS;
+    }
+    fprintf(stderr, "Unknown compression %s\n",compression);
+    return GNSSR_IO_ERROR;
+}
+
 void close_stream(gnssrstream * sid)
 {
 switch (sid->ftype) {
 #ifdef USE_GZIP
     case GZIP: 
-	gzclose(sid->fid);
+	close_gzstream(sid->fid);
 	break;
 #endif
 #ifdef USE_LZ4
@@ -87,6 +372,17 @@ switch (sid->ftype) {
 	break;
 
 #endif
+#ifdef USE_ZSTD
+    case ZSTD:
+	close_zstdstream(sid->fid);
+	break;
+#endif
+    case MEMORY:
+	close_memstream(sid->fid);
+	break;
+    case FD:
+	close_fdstream(sid->fid);
+	break;
     case UNCOMPRESSED:
 	fclose(sid->fid);
 	break;
@@ -101,19 +397,20 @@ switch (sid->ftype) {
 #ifdef USE_GZIP
     case GZIP:
 	{
-	char* err= gzgets(sid->fid, buffer, slen);
-
-	if (err == Z_NULL) {
-	    //check for end of file
-	    int eof = gzeof(sid->fid);
-	    if (eof == 1) {
-		buffer[0] = '\0';
-		return GNSSR_EOF;
-	    } else {
-		return GNSSR_IO_ERROR;
-	    }
+	const char *line;
+	size_t len;
+	int err=readline_gzstream(sid->fid,&line,&len);
+	if (err != GZ_SUCCESS){
+	    buffer[0] = '\0';
+	    return err == GZ_EOF?GNSSR_EOF:GNSSR_IO_ERROR;
 	}
-
+	sid->pos+=len;
+	//copy (and possibly truncate) the line into the buffer
+	if (len > slen-1){
+	    len=slen-1;
+	}
+	memcpy(buffer,line,len);
+	buffer[len]='\0';
 	return GNSSR_SUCCESS;
 	}
 	break;
@@ -122,17 +419,83 @@ switch (sid->ftype) {
 #ifdef USE_LZ4
     case LZ4:
 	{
-	int err= readline_lz4(sid->fid, buffer, slen);
-	if (err == LZ4_EOF) {
+	const char *line;
+	size_t len;
+	int err=readline_lz4(sid->fid,&line,&len);
+	if (err != LZ4_SUCCESS){
 	    buffer[0] = '\0';
-	    return GNSSR_EOF;
-	} else if (err == LZ4_ERROR) {
-	    return GNSSR_IO_ERROR;
-	}else{
-	    return GNSSR_SUCCESS;
-	}}
+	    return err == LZ4_EOF?GNSSR_EOF:GNSSR_IO_ERROR;
+	}
+	sid->pos+=len;
+	//copy (and possibly truncate) the line into the buffer
+	if (len > slen-1){
+	    len=slen-1;
+	}
+	memcpy(buffer,line,len);
+	buffer[len]='\0';
+	return GNSSR_SUCCESS;
+	}
 	break;
 #endif //USE_LZ4
+#ifdef USE_ZSTD
+    case ZSTD:
+	{
+	const char *line;
+	size_t len;
+	int err=readline_zstdstream(sid->fid,&line,&len);
+	if (err != ZS_SUCCESS){
+	    buffer[0] = '\0';
+	    return err == ZS_EOF?GNSSR_EOF:GNSSR_IO_ERROR;
+	}
+	sid->pos+=len;
+	//copy (and possibly truncate) the line into the buffer
+	if (len > slen-1){
+	    len=slen-1;
+	}
+	memcpy(buffer,line,len);
+	buffer[len]='\0';
+	return GNSSR_SUCCESS;
+	}
+	break;
+#endif //USE_ZSTD
+    case FD:
+	{
+	const char *line;
+	size_t len;
+	int err=readline_fd(sid->fid,&line,&len);
+	if (err != GNSSR_SUCCESS){
+	    buffer[0] = '\0';
+	    return err;
+	}
+	sid->pos+=len;
+	//copy (and possibly truncate) the line into the buffer
+	if (len > slen-1){
+	    len=slen-1;
+	}
+	memcpy(buffer,line,len);
+	buffer[len]='\0';
+	return GNSSR_SUCCESS;
+	}
+	break;
+    case MEMORY:
+	{
+	const char *line;
+	size_t len;
+	int err=readline_mem(sid->fid,&line,&len);
+	if (err != GNSSR_SUCCESS){
+	    buffer[0] = '\0';
+	    return err;
+	}
+	sid->pos+=len;
+	//copy (and possibly truncate) the line into the buffer
+	if (len > slen-1){
+	    len=slen-1;
+	}
+	memcpy(buffer,line,len);
+	buffer[len]='\0';
+	return GNSSR_SUCCESS;
+	}
+	break;
     case UNCOMPRESSED:
 	{
 	char* err= fgets(buffer, slen, sid->fid);
@@ -145,6 +508,7 @@ switch (sid->ftype) {
 		return GNSSR_IO_ERROR;
 	    }
 	}else{
+	    sid->pos+=strlen(buffer);
 	    return GNSSR_SUCCESS;
 	}
 	}
@@ -153,3 +517,292 @@ switch (sid->ftype) {
     //shouldn't get here
     return GNSSR_IO_ERROR;
     }
+
+int readline_view(gnssrstream * sid, const char **line, size_t *len)
+{
+    //Retrieves a view of the next line (which is only valid until the next read from the stream)
+    if (sid->ftype == MEMORY){
+	//zero copy
+	int err=readline_mem(sid->fid,line,len);
+	sid->pos+=*len;
+	return err;
+    }
+    if (sid->ftype == FD){
+	//view on the receive buffer
+	int err=readline_fd(sid->fid,line,len);
+	sid->pos+=*len;
+	return err;
+    }
+#ifdef USE_GZIP
+    if (sid->ftype == GZIP){
+	//view on the decompression buffer
+	int err=readline_gzstream(sid->fid,line,len);
+	if (err != GZ_SUCCESS){
+	    *len=0;
+	    return err == GZ_EOF?GNSSR_EOF:GNSSR_IO_ERROR;
+	}
+	sid->pos+=*len;
+	return GNSSR_SUCCESS;
+    }
+#endif
+#ifdef USE_LZ4
+    if (sid->ftype == LZ4){
+	//view on the ring buffer
+	int err=readline_lz4(sid->fid,line,len);
+	if (err != LZ4_SUCCESS){
+	    *len=0;
+	    return err == LZ4_EOF?GNSSR_EOF:GNSSR_IO_ERROR;
+	}
+	sid->pos+=*len;
+	return GNSSR_SUCCESS;
+    }
+#endif
+#ifdef USE_ZSTD
+    if (sid->ftype == ZSTD){
+	//view on the decompression buffer
+	int err=readline_zstdstream(sid->fid,line,len);
+	if (err != ZS_SUCCESS){
+	    *len=0;
+	    return err == ZS_EOF?GNSSR_EOF:GNSSR_IO_ERROR;
+	}
+	sid->pos+=*len;
+	return GNSSR_SUCCESS;
+    }
+#endif
+    //read through the line buffer of the stream
+    int err=readline(sid,sid->linebuf,GNSSR_LINE_BUFFER);
+    *line=sid->linebuf;
+    if (err != GNSSR_SUCCESS){
+	*len=0;
+	return err;
+    }
+    *len=strlen(sid->linebuf);
+    return GNSSR_SUCCESS;
+}
+
+int seek_stream(gnssrstream * sid, int64_t pos, const gzaccess *point)
+{
+    //Position the stream at an uncompressed byte offset, which should be the start of a line
+    //point is an (optional) gzip access point preceding pos from which decompression can be restarted
+    switch (sid->ftype) {
+#ifdef USE_GZIP
+    case GZIP:
+	{
+	gzstream *gz=sid->fid;
+	int64_t current=gz->out-(int64_t)(gz->outlen-gz->outpos);
+	int err=GZ_SUCCESS;
+	if (point != NULL && point->out <= pos && (pos < current || point->out > current)){
+	    //restarting at the access point avoids decompressing the preceding data
+	    err=position_gzstream(gz,point);
+	    current=point->out;
+	}else if (pos < current){
+	    err=position_gzstream(gz,NULL);
+	    current=0;
+	}
+	if (err == GZ_SUCCESS){
+	    err=skip_gzstream(gz,pos-current);
+	}
+	if (err != GZ_SUCCESS){
+	    return err == GZ_EOF?GNSSR_EOF:GNSSR_IO_ERROR;
+	}
+	}
+	break;
+#endif
+#ifdef USE_LZ4
+    case LZ4:
+	{
+	//lz4 frames are decoded sequentially, so skip bytes after possibly rewinding
+	lz4stream *lzid=sid->fid;
+	int64_t current=lzid->out-(int64_t)(lzid->tail-lzid->head);
+	int err=LZ4_SUCCESS;
+	if (pos < current){
+	    err=rewind_lz4stream(lzid);
+	    current=0;
+	}
+	if (err == LZ4_SUCCESS){
+	    err=skip_lz4stream(lzid,pos-current);
+	}
+	if (err != LZ4_SUCCESS){
+	    return err == LZ4_EOF?GNSSR_EOF:GNSSR_IO_ERROR;
+	}
+	}
+	break;
+#endif
+#ifdef USE_ZSTD
+    case ZSTD:
+	{
+	//decode sequentially (frames are not indexed) after possibly rewinding
+	zstdstream *zs=sid->fid;
+	int64_t current=zs->out-(int64_t)(zs->outlen-zs->outpos);
+	int err=ZS_SUCCESS;
+	if (pos < current){
+	    err=rewind_zstdstream(zs);
+	    current=0;
+	}
+	if (err == ZS_SUCCESS){
+	    err=skip_zstdstream(zs,pos-current);
+	}
+	if (err != ZS_SUCCESS){
+	    return err == ZS_EOF?GNSSR_EOF:GNSSR_IO_ERROR;
+	}
+	}
+	break;
+#endif
+    case MEMORY:
+	{
+	memstream *mid=sid->fid;
+	if (pos < 0 || (size_t)pos > mid->size){
+	    return GNSSR_EOF;
+	}
+	mid->ptr=mid->data+pos;
+	}
+	break;
+    case UNCOMPRESSED:
+	if (fseeko(sid->fid,pos,SEEK_SET) != 0){
+	    return GNSSR_IO_ERROR;
+	}
+	break;
+    case FD:
+	{
+	//only positions within the received data after the mark can be reached
+	fdstream *fs=sid->fid;
+	size_t start=fs->marked?fs->mark:fs->head;
+	if (pos < fs->base+(int64_t)start || pos > fs->base+(int64_t)fs->tail){
+	    return GNSSR_IO_ERROR;
+	}
+	fs->head=pos-fs->base;
+	}
+	break;
+    }
+    sid->pos=pos;
+    return GNSSR_SUCCESS;
+}
+
+void mark_stream(gnssrstream * sid)
+{
+    //Keep the data from the current position onwards available for seeking (needed for streams which can not be repositioned otherwise)
+    if (sid->ftype == FD){
+	fdstream *fs=sid->fid;
+	fs->marked=1;
+	fs->mark=fs->head;
+    }
+}
+
+int index_stream_access(const char *filename, int64_t span, gzaccess **list, int *npoints)
+{
+    //Retrieve access points (roughly every span uncompressed bytes) for streams which can not be positioned directly
+    *list=NULL;
+    *npoints=0;
+#ifdef USE_GZIP
+    size_t slen=strlen(filename);
+    if (slen >= 3 && strncmp(filename+slen-3,".gz",3) == 0) {
+	if (build_gzindex(filename,span,list,npoints) != GZ_SUCCESS){
+	    return GNSSR_IO_ERROR;
+	}
+    }
+#endif
+    return GNSSR_SUCCESS;
+}
+
+int set_stream_threads(gnssrstream * sid, int nthreads)
+{
+    //Set the amount of threads used for decompression (currently only used for multi-frame zstd streams)
+#ifdef USE_ZSTD
+    if (sid->ftype == ZSTD){
+	return set_zstdstream_threads(sid->fid,nthreads) == ZS_SUCCESS?GNSSR_SUCCESS:GNSSR_IO_ERROR;
+    }
+#endif
+    return GNSSR_SUCCESS;
+}
+
+int set_stream_chunksize(gnssrstream * sid, size_t chunksize)
+{
+    //Set the amount of bytes which are decompressed at once (currently only used for lz4 streams, which keep two chunks in memory)
+#ifdef USE_LZ4
+    if (sid->ftype == LZ4){
+	return set_lz4stream_chunksize(sid->fid,chunksize) == LZ4_SUCCESS?GNSSR_SUCCESS:GNSSR_IO_ERROR;
+    }
+#endif
+    return GNSSR_SUCCESS;
+}
+
+int recompress_stream_zstd(const char *filename, const char *outfile, int level, size_t framesize)
+{
+    //Recompress a (e.g. gzip compressed) file as a zstd file consisting of independent frames of about framesize uncompressed bytes
+    //Frames end at line boundaries and store their content size, so they can be decompressed in parallel
+#ifdef USE_ZSTD
+    gnssrstream sid;
+    if (open_stream(filename,&sid) != GNSSR_SUCCESS){
+	return GNSSR_IO_ERROR;
+    }
+    if (framesize == 0){
+	framesize=ZS_FRAME_SIZE;
+    }
+    FILE *fid=fopen(outfile,"wb");
+    ZSTD_CCtx *cctx=ZSTD_createCCtx();
+    size_t srccap=framesize;
+    size_t dstcap=ZSTD_compressBound(srccap);
+    char *src=malloc(srccap);
+    char *dst=malloc(dstcap);
+    int err=GNSSR_SUCCESS;
+    if (fid == NULL){
+	fprintf(stderr, "Could not open file %s\n", outfile);
+	err=GNSSR_IO_ERROR;
+    }else if (cctx == NULL || src == NULL || dst == NULL){
+	fprintf(stderr, "Could not allocate the zstd compression context and buffers\n");
+	err=GNSSR_IO_ERROR;
+    }
+    const char *line;
+    size_t len;
+    size_t nsrc=0;
+    while (err == GNSSR_SUCCESS){
+	int ret=readline_view(&sid,&line,&len);
+	if (ret != GNSSR_SUCCESS && ret != GNSSR_EOF){
+	    err=ret;
+	    break;
+	}
+	if (nsrc > 0 && (ret == GNSSR_EOF || nsrc+len > framesize)){
+	    //write a frame (the content size is stored in the frame header)
+	    size_t nout=ZSTD_compressCCtx(cctx,dst,dstcap,src,nsrc,level);
+	    if (ZSTD_isError(nout) || fwrite(dst,1,nout,fid) != nout){
+		err=GNSSR_IO_ERROR;
+		break;
+	    }
+	    nsrc=0;
+	}
+	if (ret == GNSSR_EOF){
+	    break;
+	}
+	if (len > srccap){
+	    //a line which is longer than a frame
+	    char *tmpsrc=realloc(src,len);
+	    char *tmpdst=realloc(dst,ZSTD_compressBound(len));
+	    if (tmpsrc != NULL){
+		src=tmpsrc;
+	    }
+	    if (tmpdst != NULL){
+		dst=tmpdst;
+	    }
+	    if (tmpsrc == NULL || tmpdst == NULL){
+		err=GNSSR_IO_ERROR;
+		break;
+	    }
+	    srccap=len;
+	    dstcap=ZSTD_compressBound(len);
+	}
+	memcpy(src+nsrc,line,len);
+	nsrc+=len;
+    }
+    close_stream(&sid);
+    if (fid != NULL && fclose(fid) != 0){
+	err=GNSSR_IO_ERROR;
+    }
+    ZSTD_freeCCtx(cctx);
+    free(src);
+    free(dst);
+    return err;
+#else
+    fprintf(stderr, "ZSTD support not compiled in\n");
+    return GNSSR_IO_ERROR;
+#endif
+}
@@ -17,6 +17,13 @@
 
 #include <string.h>
 #include <stdio.h>
+#include <stdint.h>
+#ifdef USE_GZIP
+#include "gzstream.h"
+#endif
+#ifdef USE_ZSTD
+#include "zstdstream.h"
+#endif
 
 
 #ifndef GNSSRSTREAM_H
@@ -26,28 +33,91 @@
 #define GNSSR_IO_ERROR -1
 #define GNSSR_EOF 2
 #define GNSSR_SUCCESS 0
+//no data available yet on a non-blocking file descriptor
+#define GNSSR_AGAIN 3
+
+//size of the line buffer used for line views of non-memory backed streams
+#define GNSSR_LINE_BUFFER 128
+//initial size of the receive buffer of file descriptor streams
+#define GNSSR_FD_BUFFER 65536
 
 typedef enum { 
 	UNCOMPRESSED,
+	MEMORY,
+	FD,
 #ifdef USE_GZIP
 	GZIP,
 #endif
 #ifdef USE_LZ4
-	LZ4
+	LZ4,
+#endif
+#ifdef USE_ZSTD
+	ZSTD,
 #endif
 }stream_type;
 
 struct gnssrstream{
 	stream_type ftype;
 	void *fid;
+	int64_t pos; //uncompressed byte offset of the next line
+	int follow; //set when the (uncompressed) file is still growing, so that reading continues after the end of the file
+	char linebuf[GNSSR_LINE_BUFFER];
+};
+
+#ifndef USE_GZIP
+//placeholder for gzip access points so the seeking interface does not depend on zlib
+struct gzaccess{
+	int64_t out;
+	int64_t in;
+	int bits;
+	unsigned char window[32768];
 };
 
+typedef struct gzaccess gzaccess;
+#endif
+
+///View on a memory buffer (a memory mapped file or a buffer of the caller) which can be scanned without copying
+struct memstream{
+	const char *data;
+	size_t size;
+	const char *ptr;
+	int mapped; //set when the data is memory mapped by the stream
+};
+
+typedef struct memstream memstream;
+
+///Line reader of a (non-blocking) file descriptor, e.g. a serial port or a socket
+///Data from the last mark (see mark_stream) onwards is kept in the buffer, so that the stream can be positioned back to the mark when a cycle is incomplete
+struct fdstream{
+	int fd;
+	int eof;
+	char *buf;
+	size_t cap;
+	size_t head; //start of the unread data
+	size_t tail; //end of the received data
+	int marked;
+	size_t mark;
+	int64_t base; //stream offset of the start of the buffer
+};
+
+typedef struct fdstream fdstream;
+
 typedef struct gnssrstream gnssrstream;
 
 int open_stream(const char *filename,gnssrstream* strid);
+int open_stream_follow(const char *filename,gnssrstream* strid);
+int open_stream_fd(int fd,gnssrstream* strid);
+int open_stream_buffer(const char *data, size_t size, const char *compression, gnssrstream* strid);
 int readline(gnssrstream* strid, char *buffer,size_t slen);
+int readline_view(gnssrstream* strid, const char **line, size_t *len);
 void close_stream(gnssrstream* strid);
+int seek_stream(gnssrstream* strid, int64_t pos, const gzaccess *point);
+void mark_stream(gnssrstream* strid);
+int index_stream_access(const char *filename, int64_t span, gzaccess **list, int *npoints);
 int eof(gnssrstream* strid);
+int set_stream_threads(gnssrstream* strid, int nthreads);
+int set_stream_chunksize(gnssrstream* strid, size_t chunksize);
+int recompress_stream_zstd(const char *filename, const char *outfile, int level, size_t framesize);
 
 
 #endif //GNSSRSTREAM_H
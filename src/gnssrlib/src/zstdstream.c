@@ -0,0 +1,378 @@
+/*# This file is part of gnssr4water*/
+/*# gnssr4water is free software; you can redistribute it and/or*/
+/*# modify it under the terms of the GNU Lesser General Public*/
+/*# License as published by the Free Software Foundation; either*/
+/*# version 3 of the License, or (at your option) any later version.*/
+
+/*# gnssr4water is distributed in the hope that it will be useful,*/
+/*# but WITHOUT ANY WARRANTY; without even the implied warranty of*/
+/*# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU*/
+/*# Lesser General Public License for more details.*/
+
+/*# You should have received a copy of the GNU Lesser General Public*/
+/*# License along with gnssr4water if not, write to the Free Software*/
+/*# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA*/
+
+/*# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2025*/
+
+#define _FILE_OFFSET_BITS 64
+#include <stdlib.h>
+#include <string.h>
+#include <pthread.h>
+#include "zstdstream.h"
+
+//initial size of the output buffer (grows when multiple frames are decompressed at once)
+#define ZS_OUTBUF 262144
+//frames with a larger content size are decompressed in streaming mode
+#define ZS_MAX_FRAME 67108864
+//maximum number of frames which are decompressed in one go
+#define ZS_MAX_FRAMES 1024
+
+static zstdstream* init_zstdstream(FILE *fid, const void *data, size_t size){
+    zstdstream* zs=calloc(1,sizeof(zstdstream));
+    if (zs == NULL){
+	return NULL;
+    }
+    zs->fid=fid;
+    zs->mem=data;
+    zs->memsize=size;
+    zs->nthreads=1;
+    zs->dctx[0]=ZSTD_createDCtx();
+    zs->outbuf=malloc(ZS_OUTBUF);
+    zs->outcap=ZS_OUTBUF;
+    if (fid == NULL){
+	//decompress directly from the memory buffer
+	zs->inbuf=(unsigned char*)data;
+	zs->inlen=size;
+	zs->inend=1;
+    }else{
+	zs->inbuf=malloc(ZS_CHUNK);
+	zs->incap=ZS_CHUNK;
+    }
+    if (zs->dctx[0] == NULL || zs->outbuf == NULL || zs->inbuf == NULL){
+	zs->fid=NULL;
+	close_zstdstream(zs);
+	return NULL;
+    }
+    return zs;
+}
+
+zstdstream* open_zstdstream(const char *filename){
+    FILE *fid=fopen(filename,"rb");
+    if (fid == NULL){
+	return NULL;
+    }
+    zstdstream* zs=init_zstdstream(fid,NULL,0);
+    if (zs == NULL){
+	fclose(fid);
+    }
+    return zs;
+}
+
+///Decompress from a memory buffer (which needs to stay alive until the stream is closed)
+zstdstream* open_zstdstream_mem(const void *data, size_t size){
+    return init_zstdstream(NULL,data,size);
+}
+
+void close_zstdstream(zstdstream* zs){
+    for (int i=0;i<ZS_MAX_THREADS;i++){
+	if (zs->dctx[i] != NULL){
+	    ZSTD_freeDCtx(zs->dctx[i]);
+	}
+    }
+    if (zs->fid != NULL){
+	fclose(zs->fid);
+	free(zs->inbuf);
+    }
+    free(zs->outbuf);
+    free(zs);
+}
+
+///Set the amount of frames which are decompressed in parallel
+int set_zstdstream_threads(zstdstream* zs, int nthreads){
+    if (nthreads < 1){
+	nthreads=1;
+    }else if (nthreads > ZS_MAX_THREADS){
+	nthreads=ZS_MAX_THREADS;
+    }
+    for (int i=1;i<nthreads;i++){
+	if (zs->dctx[i] == NULL){
+	    zs->dctx[i]=ZSTD_createDCtx();
+	    if (zs->dctx[i] == NULL){
+		return ZS_ERROR;
+	    }
+	}
+    }
+    zs->nthreads=nthreads;
+    return ZS_SUCCESS;
+}
+
+///Make sure that (at least) need bytes of compressed input are available (unless the input is exhausted), returns the amount of available bytes
+static size_t fill_input(zstdstream* zs, size_t need){
+    if (zs->inlen-zs->inpos >= need || zs->inend){
+	return zs->inlen-zs->inpos;
+    }
+    //move the unconsumed data to the start of the buffer
+    if (zs->inpos > 0){
+	memmove(zs->inbuf,zs->inbuf+zs->inpos,zs->inlen-zs->inpos);
+	zs->inlen-=zs->inpos;
+	zs->inpos=0;
+    }
+    if (need < ZS_CHUNK){
+	need=ZS_CHUNK;
+    }
+    if (need > zs->incap){
+	unsigned char *tmp=realloc(zs->inbuf,need);
+	if (tmp == NULL){
+	    return zs->inlen;
+	}
+	zs->inbuf=tmp;
+	zs->incap=need;
+    }
+    while (zs->inlen < need){
+	size_t nread=fread(zs->inbuf+zs->inlen,1,zs->incap-zs->inlen,zs->fid);
+	if (nread == 0){
+	    zs->inend=1;
+	    break;
+	}
+	zs->inlen+=nread;
+    }
+    return zs->inlen;
+}
+
+///Make room for (at least) nbytes of output behind the unconsumed data
+static int reserve_output(zstdstream* zs, size_t nbytes){
+    if (zs->outpos > 0){
+	memmove(zs->outbuf,zs->outbuf+zs->outpos,zs->outlen-zs->outpos);
+	zs->outlen-=zs->outpos;
+	zs->outpos=0;
+    }
+    if (zs->outlen+nbytes > zs->outcap){
+	char *tmp=realloc(zs->outbuf,zs->outlen+nbytes);
+	if (tmp == NULL){
+	    return ZS_ERROR;
+	}
+	zs->outbuf=tmp;
+	zs->outcap=zs->outlen+nbytes;
+    }
+    return ZS_SUCCESS;
+}
+
+///Streaming decompression of the next part of the input
+static int fill_output_stream(zstdstream* zs){
+    if (reserve_output(zs,0) != ZS_SUCCESS){
+	return ZS_ERROR;
+    }
+    while (zs->outlen < zs->outcap && !zs->eof){
+	if (fill_input(zs,1) == 0){
+	    //note: a truncated last frame is silently accepted (as for gzip)
+	    zs->eof=1;
+	    break;
+	}
+	ZSTD_inBuffer input={zs->inbuf,zs->inlen,zs->inpos};
+	ZSTD_outBuffer output={zs->outbuf,zs->outcap,zs->outlen};
+	size_t ret=ZSTD_decompressStream(zs->dctx[0],&output,&input);
+	if (ZSTD_isError(ret)){
+	    if (!zs->inframe && zs->inend){
+		//trailing garbage after the last frame: treat as end of file
+		zs->eof=1;
+		break;
+	    }
+	    return ZS_ERROR;
+	}
+	zs->inpos=input.pos;
+	zs->out+=output.pos-zs->outlen;
+	zs->outlen=output.pos;
+	zs->inframe=(ret != 0);
+    }
+    return ZS_SUCCESS;
+}
+
+struct zstdframe{
+    const unsigned char *src;
+    size_t srcsize;
+    char *dst;
+    size_t dstsize;
+    size_t ret;
+};
+
+struct zstdworker{
+    ZSTD_DCtx *dctx;
+    struct zstdframe *frames;
+    int first; //frames first, first+stride, ... are decompressed by this worker
+    int stride;
+    int nframes;
+};
+
+static void* decompress_frames(void *arg){
+    struct zstdworker *worker=arg;
+    for (int i=worker->first;i<worker->nframes;i+=worker->stride){
+	struct zstdframe *frame=worker->frames+i;
+	frame->ret=ZSTD_decompressDCtx(worker->dctx,frame->dst,frame->dstsize,frame->src,frame->srcsize);
+    }
+    return NULL;
+}
+
+///Decompress the next frames in parallel, returns ZS_EOF when the frames can not be decompressed independently
+static int fill_output_parallel(zstdstream* zs){
+    struct zstdframe frames[ZS_MAX_FRAMES];
+    size_t offsets[ZS_MAX_FRAMES];
+    size_t start=zs->inpos;
+    size_t total=0;
+    int nframes=0;
+    //locate complete frames in the input (offsets relative to the start, as the input buffer may move)
+    //until there is enough work for all threads
+    size_t pos=0;
+    while (nframes < ZS_MAX_FRAMES && total < (size_t)zs->nthreads*ZS_FRAME_SIZE){
+	size_t fsize=ZSTD_findFrameCompressedSize(zs->inbuf+start+pos,zs->inlen-start-pos);
+	if (ZSTD_isError(fsize)){
+	    if (zs->inend){
+		break;
+	    }
+	    //read more input (which may move the buffer)
+	    size_t avail=zs->inlen-start;
+	    zs->inpos=start;
+	    if (fill_input(zs,2*avail+ZS_CHUNK) <= avail && !zs->inend){
+		return ZS_ERROR;
+	    }
+	    start=zs->inpos;
+	    continue;
+	}
+	unsigned long long csize=ZSTD_getFrameContentSize(zs->inbuf+start+pos,fsize);
+	if (csize == ZSTD_CONTENTSIZE_UNKNOWN || csize == ZSTD_CONTENTSIZE_ERROR || csize > ZS_MAX_FRAME){
+	    break;
+	}
+	offsets[nframes]=pos;
+	frames[nframes].srcsize=fsize;
+	frames[nframes].dstsize=csize;
+	pos+=fsize;
+	total+=csize;
+	nframes++;
+    }
+    zs->inpos=start;
+    if (nframes == 0){
+	return ZS_EOF;
+    }
+
+    if (reserve_output(zs,total) != ZS_SUCCESS){
+	return ZS_ERROR;
+    }
+    size_t out=zs->outlen;
+    for (int i=0;i<nframes;i++){
+	frames[i].src=zs->inbuf+start+offsets[i];
+	frames[i].dst=zs->outbuf+out;
+	out+=frames[i].dstsize;
+    }
+    int nworkers=zs->nthreads < nframes?zs->nthreads:nframes;
+    struct zstdworker workers[ZS_MAX_THREADS];
+    pthread_t threads[ZS_MAX_THREADS];
+    int started[ZS_MAX_THREADS]={0};
+    for (int i=0;i<nworkers;i++){
+	workers[i].dctx=zs->dctx[i];
+	workers[i].frames=frames;
+	workers[i].first=i;
+	workers[i].stride=nworkers;
+	workers[i].nframes=nframes;
+    }
+    for (int i=1;i<nworkers;i++){
+	started[i]=(pthread_create(&threads[i],NULL,decompress_frames,&workers[i]) == 0);
+	if (!started[i]){
+	    decompress_frames(&workers[i]);
+	}
+    }
+    decompress_frames(&workers[0]);
+    for (int i=1;i<nworkers;i++){
+	if (started[i]){
+	    pthread_join(threads[i],NULL);
+	}
+    }
+    for (int i=0;i<nframes;i++){
+	if (ZSTD_isError(frames[i].ret) || frames[i].ret != frames[i].dstsize){
+	    return ZS_ERROR;
+	}
+    }
+    zs->inpos=start+pos;
+    zs->outlen+=total;
+    zs->out+=total;
+    return ZS_SUCCESS;
+}
+
+///Decompress more data into the output buffer (moves unconsumed data to the start of the buffer)
+static int fill_output(zstdstream* zs){
+    if (zs->nthreads > 1 && !zs->inframe){
+	int ret=fill_output_parallel(zs);
+	if (ret != ZS_EOF){
+	    return ret;
+	}
+    }
+    return fill_output_stream(zs);
+}
+
+///Retrieve a view of the next line (including the newline character) which is valid until the next read
+int readline_zstdstream(zstdstream* zs, const char **line, size_t *len){
+    const char *nl;
+    while (1){
+	size_t avail=zs->outlen-zs->outpos;
+	nl=memchr(zs->outbuf+zs->outpos,'\n',avail);
+	if (nl != NULL){
+	    break;
+	}
+	if (zs->eof || (zs->outpos == 0 && zs->outlen == zs->outcap)){
+	    //last line without a newline (or a line which does not fit in the buffer)
+	    if (avail == 0){
+		*len=0;
+		return ZS_EOF;
+	    }
+	    *line=zs->outbuf+zs->outpos;
+	    *len=avail;
+	    zs->outpos=zs->outlen;
+	    return ZS_SUCCESS;
+	}
+	if (fill_output(zs) != ZS_SUCCESS){
+	    return ZS_ERROR;
+	}
+    }
+    *line=zs->outbuf+zs->outpos;
+    *len=nl+1-*line;
+    zs->outpos+=*len;
+    return ZS_SUCCESS;
+}
+
+///Discard a number of uncompressed bytes
+int skip_zstdstream(zstdstream* zs, int64_t nbytes){
+    while (nbytes > 0){
+	size_t avail=zs->outlen-zs->outpos;
+	if (avail == 0){
+	    if (zs->eof){
+		return ZS_EOF;
+	    }
+	    if (fill_output(zs) != ZS_SUCCESS){
+		return ZS_ERROR;
+	    }
+	    continue;
+	}
+	size_t n=(int64_t)avail < nbytes?avail:(size_t)nbytes;
+	zs->outpos+=n;
+	nbytes-=n;
+    }
+    return ZS_SUCCESS;
+}
+
+///Restart decompression from the start of the file
+int rewind_zstdstream(zstdstream* zs){
+    if (zs->fid != NULL){
+	if (fseeko(zs->fid,0,SEEK_SET) != 0){
+	    return ZS_ERROR;
+	}
+	zs->inlen=0;
+	zs->inend=0;
+    }
+    zs->inpos=0;
+    ZSTD_DCtx_reset(zs->dctx[0],ZSTD_reset_session_only);
+    zs->inframe=0;
+    zs->eof=0;
+    zs->out=0;
+    zs->outpos=0;
+    zs->outlen=0;
+    return ZS_SUCCESS;
+}
@@ -0,0 +1,68 @@
+/*# This file is part of gnssr4water*/
+/*# gnssr4water is free software; you can redistribute it and/or*/
+/*# modify it under the terms of the GNU Lesser General Public*/
+/*# License as published by the Free Software Foundation; either*/
+/*# version 3 of the License, or (at your option) any later version.*/
+
+/*# gnssr4water is distributed in the hope that it will be useful,*/
+/*# but WITHOUT ANY WARRANTY; without even the implied warranty of*/
+/*# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU*/
+/*# Lesser General Public License for more details.*/
+
+/*# You should have received a copy of the GNU Lesser General Public*/
+/*# License along with gnssr4water if not, write to the Free Software*/
+/*# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA*/
+
+/*# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2025*/
+
+#include <zstd.h>
+#include <stdio.h>
+#include <stdint.h>
+
+#define ZS_CHUNK 131072
+//maximum number of threads used for decompressing frames in parallel
+#define ZS_MAX_THREADS 64
+//default uncompressed size of the frames written by recompress_zstd
+#define ZS_FRAME_SIZE 4194304
+#define ZS_ERROR -1
+#define ZS_EOF -2
+#define ZS_SUCCESS 0
+
+#ifndef ZSTDSTREAM_H
+#define ZSTDSTREAM_H
+
+///Zstandard decompressing line reader
+///Files consisting of multiple frames which store their content size (e.g. written by recompress_zstd) can be decompressed with multiple threads, one frame per thread
+struct zstdstream{
+    FILE* fid; //compressed input file (NULL when reading from memory)
+    const unsigned char *mem; //compressed input buffer
+    size_t memsize;
+    int nthreads;
+    ZSTD_DCtx* dctx[ZS_MAX_THREADS];
+    int eof;
+    int inframe; //set when the streaming decompressor is in the middle of a frame
+    int64_t out; //total amount of uncompressed bytes produced
+    //compressed input
+    unsigned char *inbuf;
+    size_t inpos;
+    size_t inlen;
+    size_t incap;
+    int inend; //set when the input is exhausted
+    //uncompressed output
+    char *outbuf;
+    size_t outpos;
+    size_t outlen;
+    size_t outcap;
+};
+
+typedef struct zstdstream zstdstream;
+
+zstdstream* open_zstdstream(const char *filename);
+zstdstream* open_zstdstream_mem(const void *data, size_t size);
+void close_zstdstream(zstdstream* zs);
+int set_zstdstream_threads(zstdstream* zs, int nthreads);
+int readline_zstdstream(zstdstream* zs, const char **line, size_t *len);
+int skip_zstdstream(zstdstream* zs, int64_t nbytes);
+int rewind_zstdstream(zstdstream* zs);
+
+#endif //ZSTDSTREAM_H
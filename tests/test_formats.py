@@ -23,3 +23,627 @@ def test_NMEAFile():
                 # breakpoint()
             # print(nmea)
     
+
+
+def _nmealine(body):
+    chk=0
+    for c in body.encode():
+        chk^=c
+    return f"${body}*{chk:02X}\r\n"
+
+def _mknmea(filename,ncycles=120,t0=datetime(2024,2,17)):
+    """Write a small synthetic NMEA log with GPS and GLONASS satellites"""
+    lines=[]
+    for i in range(ncycles):
+        t=t0+timedelta(seconds=i)
+        for talker,prn0 in [("GP",1),("GL",65)]:
+            sats=[(prn0+k,(10+k*8+i//30)%90,(k*36+i//60)%360,20+(k+i)%25) for k in range(6)]
+            for m in range(2):
+                fields=",".join(f"{p:02d},{e:02d},{a:03d},{c:02d}" for p,e,a,c in sats[3*m:3*m+3])
+                lines.append(_nmealine(f"{talker}GSV,2,{m+1},06,{fields}"))
+        hms=t.strftime("%H%M%S")+".00"
+        lines.append(_nmealine(f"GNGGA,{hms},5213.2530,N,00651.0591,E,1,12,0.9,45.3,M,46.1,M,,"))
+        lines.append(_nmealine(f"GNRMC,{hms},A,5213.2530,N,00651.0591,E,0.0,0.0,{t.strftime('%d%m%y')},,,A"))
+    
+    if filename.endswith(".gz"):
+        import gzip
+        with gzip.open(filename,'wt') as fid:
+            fid.writelines(lines)
+    else:
+        with open(filename,'wt') as fid:
+            fid.writelines(lines)
+    return filename
+
+def test_readbatch(tmp_path):
+    import numpy as np
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea.gz"))
+    with NMEAFile(nmeafile) as nmeaid:
+        cycles=[(cyc.time,cyc.prn.copy(),cyc.elevation.copy(),cyc.cnr0.copy()) for cyc in nmeaid.readcycles()]
+    
+    with NMEAFile(nmeafile) as nmeaid:
+        batches=list(nmeaid.readbatches(50))
+    
+    assert len(batches) == 3
+    icyc=0
+    for batch in batches:
+        for i,epoch in enumerate(batch['epoch']):
+            tm,prn,elev,cnr0=cycles[icyc]
+            satslice=slice(batch['offset'][i],batch['offset'][i+1])
+            assert np.datetime64(tm,'ns') == epoch.astype('datetime64[ns]')
+            assert np.array_equal(batch['prn'][satslice],prn)
+            assert np.array_equal(batch['elevation'][satslice],elev)
+            assert np.array_equal(batch['cnr0'][satslice],cnr0)
+            icyc+=1
+    assert icyc == len(cycles)
+
+def test_readfiles(tmp_path):
+    import numpy as np
+    from gnssr4water.io.nmeastream import readfiles
+    nmeafiles=[_mknmea(str(tmp_path/f"synthetic{i}.nmea.gz"),ncycles=60*(i+1)) for i in range(3)]
+    batches=readfiles(nmeafiles,max_workers=3,ncycles=25)
+    for nmeafile,batch in zip(nmeafiles,batches):
+        with NMEAFile(nmeafile) as nmeaid:
+            ref=nmeaid.readbatch(1000)
+        assert ref.keys() == batch.keys()
+        for ky in ref.keys():
+            assert np.array_equal(ref[ky],batch[ky])
+
+def test_prefetch(tmp_path):
+    from gnssr4water.io.nmeastream import NMEAFileStream
+    nmeafiles=[_mknmea(str(tmp_path/f"synthetic{i}.nmea.gz"),ncycles=30,t0=datetime(2024,2,17,i)) for i in range(4)]
+    ref=[(cyc.epoch,cyc.prn.tolist(),cyc.cnr0.tolist()) for cyc in NMEAFileStream(nmeafiles).readcycles()]
+    prefetched=[(cyc.epoch,cyc.prn.tolist(),cyc.cnr0.tolist()) for cyc in NMEAFileStream(nmeafiles,prefetch=2).readcycles()]
+    assert len(ref) == 4*30
+    assert ref == prefetched
+
+def test_seek_time(tmp_path):
+    from gnssr4water.gnssrlib import index_filename
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea.gz"),ncycles=600)
+    with NMEAFile(nmeafile) as nmeaid:
+        ref=[(cyc.time,cyc.prn.tolist()) for cyc in nmeaid.readcycles()]
+    
+    start,end=datetime(2024,2,17,0,7),datetime(2024,2,17,0,8)
+    with NMEAFile(nmeafile) as nmeaid:
+        #use a small span so that the file holds multiple checkpoints
+        index=nmeaid.build_index(span=4096)
+        assert len(index['pos']) > 10
+        assert os.path.exists(index_filename(nmeafile))
+        window=[(cyc.time,cyc.prn.tolist()) for cyc in nmeaid.readcycles(start,end)]
+        assert window == [val for val in ref if start <= val[0] < end]
+        #seek backwards
+        assert [(cyc.time,cyc.prn.tolist()) for cyc in nmeaid.readcycles(start=ref[0][0])] == ref
+
+def test_filter(tmp_path):
+    import numpy as np
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea"))
+    with NMEAFile(nmeafile) as nmeaid:
+        ref=[(cyc.time,cyc.to_arrays()) for cyc in nmeaid.readcycles()]
+    
+    with NMEAFile(nmeafile) as nmeaid:
+        nmeaid.set_filter(systems=["GP"],min_cnr0=30,min_elevation=20)
+        filtered=[(cyc.time,cyc.to_arrays()) for cyc in nmeaid.readcycles(end=datetime(2024,2,17,0,1))]
+    
+    expected=[]
+    for tm,sats in ref:
+        idx=(sats['prn'] < 64) & (sats['cnr0'] >= 30) & (sats['elevation'] >= 20)
+        if tm < datetime(2024,2,17,0,1) and idx.any():
+            expected.append((tm,sats['prn'][idx],sats['cnr0'][idx]))
+    #cycles without accepted satellites are not returned
+    assert 0 < len(filtered) < 60
+    assert len(filtered) == len(expected)
+    for (tm,sats),(tmref,prn,cnr0) in zip(filtered,expected):
+        assert tm == tmref
+        assert np.array_equal(sats['prn'],prn)
+        assert np.array_equal(sats['cnr0'],cnr0)
+
+    with NMEAFile(nmeafile) as nmeaid:
+        batch=nmeaid.readall(prns=[2,66])
+    assert set(batch['prn']) == {2,66}
+
+def test_skymask_filter(tmp_path):
+    import numpy as np
+    from gnssr4water.sites.skymask import masked_fast
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea"))
+    poly=np.array([(10,5),(200,5),(200,70),(120,80),(10,50),(10,5)],dtype=np.float64)
+    with NMEAFile(nmeafile) as nmeaid:
+        ref=[(cyc.time,cyc.to_arrays()) for cyc in nmeaid.readcycles()]
+    
+    with NMEAFile(nmeafile) as nmeaid:
+        nmeaid.set_filter(mask=poly)
+        masked=[(cyc.time,cyc.prn.tolist(),cyc.masked_prn.tolist(),cyc.masked_pos.tolist()) for cyc in nmeaid.readcycles()]
+    
+    assert len(masked) == len(ref)
+    for (tm,prn,masked_prn,masked_pos),(tmref,sats) in zip(masked,ref):
+        assert tm == tmref
+        inmask=np.array([masked_fast(poly,el,az) != 0 for el,az in zip(sats['elevation'],sats['azimuth'])],dtype=bool)
+        assert prn == sats['prn'][inmask].tolist()
+        assert masked_prn == sats['prn'][~inmask].tolist()
+        assert masked_pos == np.cumsum(inmask)[~inmask].tolist()
+
+def test_skymask_filter_overflow():
+    import numpy as np
+    #a masked satellite followed by more accepted satellites than a cycle can hold
+    sats=["01,02,100,40"]+[f"{prn:02d},30,100,40" for prn in range(2,44)]
+    lines=[_nmealine(f"GPGSV,11,{i//4+1},43,{','.join(sats[i:i+4])}") for i in range(0,len(sats),4)]
+    lines.append(_nmealine("GNRMC,000000.00,A,5213.2530,N,00651.0591,E,0.0,0.0,170224,,,A"))
+    poly=np.array([(10,5),(200,5),(200,70),(120,80),(10,50),(10,5)],dtype=np.float64)
+    with NMEAFile.frombuffer("".join(lines).encode()) as nmeaid:
+        cycles=[(cyc.prn.tolist(),cyc.masked_prn.tolist()) for cyc in nmeaid.readcycles(mask=poly)]
+    #the cycle starts over, without the masked satellite which preceded the discarded satellites
+    assert cycles == [([42,43],[])]
+
+def test_frombuffer(tmp_path):
+    import numpy as np
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea.gz"))
+    with NMEAFile(nmeafile) as nmeaid:
+        ref=nmeaid.readall()
+    with open(nmeafile,'rb') as fid:
+        data=fid.read()
+    import gzip
+    for buf,compression in [(data,None),(memoryview(data),"gzip"),(gzip.decompress(data),None),(bytearray(gzip.decompress(data)),"none")]:
+        with NMEAFile.frombuffer(buf,compression=compression) as nmeaid:
+            batch=nmeaid.readall(25)
+        assert ref.keys() == batch.keys()
+        for ky in ref.keys():
+            assert np.array_equal(ref[ky],batch[ky])
+    
+    start=datetime(2024,2,17,0,1)
+    with NMEAFile.frombuffer(data) as nmeaid:
+        assert [cyc.time for cyc in nmeaid.readcycles(start=start)] == [start+timedelta(seconds=i) for i in range(60)]
+
+def test_zstd(tmp_path):
+    import numpy as np
+    import pytest
+    from gnssr4water.gnssrlib import recompress_zstd
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea.gz"),ncycles=300)
+    try:
+        #use small frames, so that multiple frames are decompressed in parallel
+        zstfile=recompress_zstd(nmeafile,framesize=4096)
+    except ValueError:
+        pytest.skip("gnssrlib is built without zstd support")
+    assert zstfile == str(tmp_path/"synthetic.nmea.zst")
+    with NMEAFile(nmeafile) as nmeaid:
+        ref=nmeaid.readall()
+    for nthreads in [1,4]:
+        with NMEAFile(zstfile,nthreads=nthreads) as nmeaid:
+            batch=nmeaid.readall(50)
+        for ky in ref.keys():
+            assert np.array_equal(ref[ky],batch[ky])
+
+def test_readfile_parallel(tmp_path):
+    import numpy as np
+    from gnssr4water.io.nmeastream import readfile,readfile_parallel
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea.gz"),ncycles=600)
+    with NMEAFile(nmeafile) as nmeaid:
+        #use a small span so that the file can be split in multiple segments
+        nmeaid.build_index(span=4096)
+    for filters in [{},{"start":datetime(2024,2,17,0,3,10),"end":datetime(2024,2,17,0,7,50)},{"min_elevation":30}]:
+        ref=readfile(nmeafile,**filters)
+        batch=readfile_parallel(nmeafile,max_workers=4,ncycles=25,**filters)
+        assert ref.keys() == batch.keys()
+        for ky in ref.keys():
+            assert np.array_equal(ref[ky],batch[ky])
+
+def test_lz4_chunksize(tmp_path):
+    import numpy as np
+    import shutil
+    import subprocess
+    import pytest
+    if shutil.which("lz4") is None:
+        pytest.skip("lz4 command line tool is not available")
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea"),ncycles=300)
+    lz4file=nmeafile+".lz4"
+    #small blocks, so that lines straddle the blocks and the chunks
+    subprocess.run(["lz4","-q","-B4",nmeafile,lz4file],check=True)
+    with NMEAFile(nmeafile) as nmeaid:
+        ref=nmeaid.readall()
+    with open(lz4file,'rb') as fid:
+        data=fid.read()
+    for chunksize in [0,256,1000,1<<20]:
+        for nmeaid in [NMEAFile(lz4file,chunksize=chunksize),NMEAFile.frombuffer(data,chunksize=chunksize)]:
+            with nmeaid:
+                batch=nmeaid.readall(50)
+            for ky in ref.keys():
+                assert np.array_equal(ref[ky],batch[ky])
+
+def test_scan_nmea(tmp_path):
+    from gnssr4water.gnssrlib import scan_nmea
+    import numpy as np
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea"),ncycles=60)
+    with open(nmeafile,'at') as fid:
+        #corrupted line and a cycle after a gap of 5 minutes
+        fid.write("$GPGSV,garbage*00\r\n")
+        fid.write(_nmealine("GNRMC,000559.00,A,5213.2530,N,00651.0591,E,0.0,0.0,170224,,,A"))
+    scan=scan_nmea(nmeafile)
+    assert scan["ncycles"] == 61
+    assert scan["ninvalid"] == 1
+    assert scan["first"] == np.datetime64("2024-02-17T00:00:00")
+    assert scan["last"] == np.datetime64("2024-02-17T00:05:59")
+    assert scan["talkers"] == ["GP","GL"]
+    assert scan["gaps"].tolist() == np.array([["2024-02-17T00:00:59","2024-02-17T00:05:59"]],dtype="datetime64[ns]").tolist()
+
+def test_catalog(tmp_path):
+    import shutil
+    from gnssr4water.io.nmeacatalog import NMEACatalog
+    #files of two minutes which overlap for one minute, and a duplicate
+    nmeafiles=[_mknmea(str(tmp_path/f"synthetic{i}.nmea.gz"),ncycles=120,t0=datetime(2024,2,17,0,i)) for i in range(3)]
+    shutil.copy(nmeafiles[1],tmp_path/"duplicate.nmea.gz")
+    with NMEACatalog(str(tmp_path/"catalog.db")) as catalog:
+        assert catalog.update(nmeafiles+[str(tmp_path/"duplicate.nmea.gz")]) == 4
+        #nothing changed
+        assert catalog.update(nmeafiles) == 0
+        assert len(catalog.select()) == 3
+        times=[cyc.time for cyc in catalog.stream().readcycles()]
+        assert times == [datetime(2024,2,17)+timedelta(seconds=i) for i in range(240)]
+        start,end=datetime(2024,2,17,0,1,30),datetime(2024,2,17,0,2,30)
+        times=[cyc.time for cyc in catalog.stream(start,end,prefetch=2).readcycles()]
+        assert times == [start+timedelta(seconds=i) for i in range(60)]
+
+def test_follow(tmp_path):
+    from gnssr4water.io.nmeastream import NMEAFollowStream
+    logs=[open(_mknmea(str(tmp_path/f"source{i}.txt"),ncycles=40,t0=datetime(2024,2,17,i))).read() for i in range(2)]
+    nmeafile=str(tmp_path/"log_00.nmea")
+    open(nmeafile,'wt').close()
+    stream=NMEAFollowStream(str(tmp_path/"log_*.nmea"))
+    times=[]
+    #append in pieces which end in the middle of lines and cycles
+    for i in range(0,len(logs[0]),777):
+        with open(nmeafile,'at') as fid:
+            fid.write(logs[0][i:i+777])
+        times.extend(cyc.time for cyc in stream.available())
+    assert times == [datetime(2024,2,17)+timedelta(seconds=i) for i in range(40)]
+    #rotation to the next file
+    with open(tmp_path/"log_01.nmea",'wt') as fid:
+        fid.write(logs[1])
+    times=[cyc.time for cyc in stream.readcycles(timeout=0)]
+    assert stream.current == str(tmp_path/"log_01.nmea")
+    assert times == [datetime(2024,2,17,1)+timedelta(seconds=i) for i in range(40)]
+    stream.close()
+
+def test_livestream():
+    import asyncio
+    import socket
+    from gnssr4water.io.nmeastream import NMEALiveStream
+    logs=[]
+    for i in range(2):
+        lines=[]
+        for k in range(200):
+            t=datetime(2024,2,17,i)+timedelta(seconds=k)
+            hms=t.strftime("%H%M%S")+".00"
+            lines.append(_nmealine(f"GPGSV,1,1,01,{5+i:02d},45,180,40"))
+            lines.append(_nmealine(f"GNRMC,{hms},A,5213.2530,N,00651.0591,E,0.0,0.0,170224,,,A"))
+        logs.append("".join(lines).encode())
+
+    async def send(sock,data):
+        #send in pieces which end in the middle of lines and cycles
+        loop=asyncio.get_running_loop()
+        for k in range(0,len(data),333):
+            await loop.sock_sendall(sock,data[k:k+333])
+            await asyncio.sleep(0)
+        sock.close()
+
+    async def receive(stream):
+        return [(cyc.time,cyc.prn.tolist()) async for cyc in stream.areadcycles()]
+
+    async def main():
+        pairs=[socket.socketpair() for _ in logs]
+        streams=[NMEALiveStream(receiver) for _,receiver in pairs]
+        for sender,_ in pairs:
+            sender.setblocking(False)
+        results=await asyncio.gather(*[receive(stream) for stream in streams],*[send(sender,data) for (sender,_),data in zip(pairs,logs)])
+        for stream in streams:
+            stream.close()
+        return results[:len(logs)]
+
+    for i,cycles in enumerate(asyncio.run(main())):
+        assert cycles == [(datetime(2024,2,17,i)+timedelta(seconds=k),[5+i]) for k in range(200)]
+
+def test_cyclestore(tmp_path):
+    import numpy as np
+    import pytest
+    pytest.importorskip("zarr")
+    from gnssr4water.io.cyclestore import CycleStore
+    from gnssr4water.io.nmeastream import NMEAFileStream
+    #files spanning midnight
+    nmeafiles=[_mknmea(str(tmp_path/f"synthetic{i}.nmea.gz"),ncycles=120,t0=datetime(2024,2,17,23,58)+timedelta(minutes=2*i)) for i in range(2)]
+    store=CycleStore(str(tmp_path/"store"))
+    assert store.write(NMEAFileStream(nmeafiles)) == [np.datetime64("2024-02-17"),np.datetime64("2024-02-18")]
+    assert store.days() == [np.datetime64("2024-02-17"),np.datetime64("2024-02-18")]
+    ref=[(cyc.time,cyc.to_arrays()) for cyc in NMEAFileStream(nmeafiles).readcycles()]
+    cycles=[(cyc.time,cyc.to_arrays()) for cyc in store.readcycles()]
+    assert [tm for tm,_ in cycles] == [tm for tm,_ in ref]
+    for (_,arrs),(_,refarrs) in zip(cycles,ref):
+        for ky,val in refarrs.items():
+            assert np.array_equal(arrs[ky],val)
+    start=datetime(2024,2,17,23,59,30)
+    times=[cyc.time for cyc in CycleStore(str(tmp_path/"store"),start=start,end=start+timedelta(seconds=60)).readcycles()]
+    assert times == [start+timedelta(seconds=i) for i in range(60)]
+
+def test_readnmea(tmp_path):
+    import numpy as np
+    from gnssr4water.io.nmea import readnmea
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea.gz"),ncycles=300)
+    df=readnmea(nmeafile)
+    assert list(df.index.names) == ["time","PRN","segment"]
+    assert list(df.columns) == ["lat","lon","system","elev","az","snr","elevsmth","azsmth"]
+    assert len(df) == 300*12
+    #all synthetic satellites are ascending
+    assert (df.index.get_level_values("segment") == 0).all()
+    for prn,grp in df.groupby("PRN"):
+        assert np.all(np.diff(grp.elevsmth) > 0)
+    #file objects are accepted as well
+    with open(_mknmea(str(tmp_path/"synthetic.nmea"),ncycles=300),'rb') as fid:
+        assert readnmea(fid).equals(df)
+
+def test_readnmea_irregular(tmp_path):
+    import numpy as np
+    import pandas as pd
+    from gnssr4water.io.nmea import readnmea,dispatchParse,smoothDegrees
+    #log with void fixes, empty satellite fields, zero cnr0 values and duplicate PRNs
+    lines=[]
+    t0=datetime(2024,2,17)
+    for i in range(90):
+        t=t0+timedelta(seconds=i)
+        void=(i%7 == 3)
+        fields=[f"{prn:02d},{(10+4*prn+i//10)%90:02d},{(prn*36+i//20)%360:03d},{30+prn:02d}" for prn in range(1,6)]
+        if i%5 == 0:
+            fields[2]="03,,,33"
+            fields[3]=f"04,{(26+i//10)%90:02d},144,"
+        if i%11 == 0:
+            fields[1]=fields[1][:-2]+"00"
+        if void:
+            #only seen in void cycles
+            fields.append(f"06,{(34+i//10)%90:02d},216,36")
+        lines.append(_nmealine(f"GPGSV,2,1,06,{','.join(fields[0:4])}"))
+        lines.append(_nmealine(f"GPGSV,2,2,06,{','.join(fields[4:])}"))
+        if i%13 == 0:
+            lines.append(_nmealine(f"GPGSV,1,1,01,01,{(14+i//10)%90:02d},036,44"))
+        lines.append(_nmealine(f"GLGSV,1,1,02,65,{(40+i//10)%90:02d},100,35,66,,,"))
+        hms=t.strftime("%H%M%S")+".00"
+        lines.append(_nmealine(f"GNGGA,{hms},5213.2530,N,00651.0591,E,1,12,0.9,45.3,M,46.1,M,,"))
+        if void:
+            lines.append(_nmealine(f"GNRMC,{hms},V,,,,,,,{t.strftime('%d%m%y')},,,N"))
+        else:
+            lines.append(_nmealine(f"GNRMC,{hms},A,5213.2530,N,00651.0591,E,0.0,0.0,{t.strftime('%d%m%y')},,,A"))
+    nmeafile=str(tmp_path/"irregular.nmea")
+    with open(nmeafile,'wt',newline='') as fid:
+        fid.writelines(lines)
+
+    #reference from the python line parser
+    rows=[]
+    cycle={}
+    with open(nmeafile,'rt') as fid:
+        for ln in fid:
+            if ln[0:6] not in dispatchParse:
+                continue
+            cycle.update(dispatchParse[ln[0:6]](ln))
+            if "time" in cycle and any(ky.startswith("PRN") for ky in cycle):
+                base={ky:val for ky,val in cycle.items() if not ky.startswith("PRN")}
+                rows.extend({**base,"PRN":int(ky[3:]),**val} for ky,val in cycle.items() if ky.startswith("PRN"))
+                cycle={}
+    ref=pd.DataFrame(rows)
+    ref["elevsmth"]=np.nan
+    for prn,grp in ref.groupby("PRN"):
+        ref.loc[grp.index,"elevsmth"]=smoothDegrees(grp.elev.to_numpy(),grp.time.to_numpy())
+
+    df=readnmea(nmeafile).reset_index()
+    assert len(df) == len(ref)
+    assert np.array_equal(df.time.to_numpy(),ref.time.to_numpy().astype("datetime64[ns]"))
+    for col in ["PRN","elev","az","snr","elevsmth"]:
+        assert np.array_equal(df[col].to_numpy(),ref[col].to_numpy()),col
+    assert np.array_equal(df.lat,ref.lat) and np.array_equal(df.lon,ref.lon)
+    assert (df.system == ref.system).all()
+    assert 6 in df.PRN.values and (df.snr == 0).any()
+
+def test_readnmea_precision(tmp_path):
+    import numpy as np
+    from gnssr4water.io.nmea import readnmea,parseDeg
+    #10 Hz log: the fractional seconds and the coordinates should not be rounded to single precision
+    lines=[]
+    for i in range(20):
+        hms=f"1200{58+i//10:02d}.{i%10}0"
+        lines.append(_nmealine("GPGSV,1,1,01,01,45,180,40"))
+        lines.append(_nmealine(f"GNRMC,{hms},A,5213.{i:03d},N,00651.{i:04d},W,0.0,0.0,170224,,,A"))
+    nmeafile=str(tmp_path/"10hz.nmea")
+    with open(nmeafile,'wt',newline='') as fid:
+        fid.writelines(lines)
+    df=readnmea(nmeafile).reset_index()
+    assert df.time.iloc[-1] == np.datetime64("2024-02-17T12:00:59.900")
+    expected=np.datetime64("2024-02-17T12:00:58")+np.arange(20)*np.timedelta64(100,"ms")
+    assert np.array_equal(df.time.to_numpy(),expected.astype("datetime64[ns]"))
+    assert df.lat.iloc[0] == parseDeg(5213.0,"N")
+    assert np.array_equal(df.lat,[parseDeg(float(f"5213.{i:03d}"),"N") for i in range(20)])
+    assert np.array_equal(df.lon,[parseDeg(float(f"00651.{i:04d}"),"W") for i in range(20)])
+
+def test_readnmea_chunks(tmp_path):
+    import numpy as np
+    import pandas as pd
+    from gnssr4water.io.nmea import readnmea,compactdtypes
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea.gz"),ncycles=1800,t0=datetime(2024,2,17,0,50))
+    ref=readnmea(nmeafile).reset_index().astype(compactdtypes).set_index(["time","PRN","segment"])
+    for chunks in [200,"10min"]:
+        parts=list(readnmea(nmeafile,chunks=chunks))
+        assert len(parts) > 1
+        assert parts[0].index.get_level_values("PRN").dtype == np.int16
+        pd.testing.assert_frame_equal(pd.concat(parts),ref)
+    #chunks of complete time periods
+    starts=[part.index.get_level_values("time")[0] for part in readnmea(nmeafile,chunks="1h")]
+    assert starts == [pd.Timestamp("2024-02-17 00:50"),pd.Timestamp("2024-02-17 01:00")]
+
+    #culminating satellites: runs of equal elevations which are longer than the chunks and azimuths which cross north
+    lines=[]
+    t0=datetime(2024,2,17)
+    for i in range(3600):
+        t=t0+timedelta(seconds=i)
+        sats=[]
+        for prn in range(1,5):
+            phase=i/3600-(prn-1)*0.2+0.3
+            elev=int((60+prn)*np.sin(np.pi*phase/0.9))
+            if 0 < phase < 0.9 and elev > 0:
+                sats.append((prn,elev,int(350+(phase-0.45)*200+3*prn)%360))
+        fields=",".join(f"{p:02d},{e:02d},{a:03d},40" for p,e,a in sats)
+        lines.append(_nmealine(f"GPGSV,1,1,{len(sats):02d},{fields}"))
+        lines.append(_nmealine(f"GNRMC,{t.strftime('%H%M%S')}.00,A,5213.2530,N,00651.0591,E,0.0,0.0,{t.strftime('%d%m%y')},,,A"))
+    nmeafile=str(tmp_path/"culmination.nmea")
+    with open(nmeafile,'wt',newline='') as fid:
+        fid.writelines(lines)
+    ref=readnmea(nmeafile).reset_index().astype(compactdtypes).set_index(["time","PRN","segment"])
+    for chunks in [37,100]:
+        pd.testing.assert_frame_equal(pd.concat(readnmea(nmeafile,chunks=chunks)),ref)
+
+def test_smooth_batch():
+    import numpy as np
+    from gnssr4water.io.nmea import smoothDegrees,smoothDegreesBatch,resolveSubValues,resolveSubValuesBatch
+    t0=np.datetime64("2024-02-17T00:00:00","ns")
+    #an ascending arc, an arc crossing the 0-360 border with a time gap and a constant one
+    arcs=[np.floor(np.linspace(10,25.5,300)),np.floor(np.linspace(350,375,200))%360,np.full(20,5.0)]
+    times=[t0+np.arange(300)*np.timedelta64(1,'s'),t0+np.append(np.arange(100),np.arange(140,240))*np.timedelta64(1,'s'),t0+np.arange(20)*np.timedelta64(1,'s')]
+    istart=np.cumsum([0]+[len(arc) for arc in arcs[:-1]])
+    smth=smoothDegreesBatch(np.concatenate(arcs),np.concatenate(times).view(np.int64),istart)
+    assert np.array_equal(smth,np.concatenate([smoothDegrees(arc,tm) for arc,tm in zip(arcs,times)]))
+    assert np.all(np.diff(smth[0:300]) > 0)
+    sub=resolveSubValuesBatch(np.concatenate(times),np.concatenate(arcs),istart)
+    assert np.array_equal(sub,np.concatenate([resolveSubValues(tm.astype("datetime64[us]").astype(object),arc) for arc,tm in zip(arcs,times)]))
+
+def test_arcbuilder(tmp_path):
+    import asyncio
+    import numpy as np
+    from gnssr4water.io.nmeastream import NMEAFileStream
+    from gnssr4water.sites.arcbuilder import SatArcBuilder,ArcBuffer
+    from gnssr4water.sites.skymask import SimpleMask
+    buf=ArcBuffer(1,None,capacity=4)
+    for i in range(10):
+        buf.append(i*1000000000,i,2*i,30)
+    arc=buf.arc()
+    assert len(arc) == 10 and arc.time.dtype == np.dtype("datetime64[ns]")
+    assert np.shares_memory(arc.cnr0,buf.cnr0)
+
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea.gz"),ncycles=900)
+    async def collect():
+        builder=SatArcBuilder(NMEAFileStream([nmeafile]),SimpleMask(6.85,52.22,45,3,elevations=[5,60]),minLengthSec=300)
+        return [arc async for arc in builder.arcs()]
+    arcs=asyncio.run(collect())
+    assert len(arcs) > 0
+    for arc in arcs:
+        assert arc.direction == "asc"
+        assert np.all(np.diff(arc.time) == np.timedelta64(1,'s'))
+
+def test_arcbuilder_filter(tmp_path,caplog):
+    from gnssr4water.sites.arcbuilder import SatArcBuilder
+    from gnssr4water.sites.skymask import SkyMask
+    from shapely.geometry import Polygon
+    mask=SkyMask(poly=Polygon([(10,5),(200,5),(200,70),(120,80),(10,50),(10,5)]),lon=6.85,lat=52.22,ellipsHeight=45,antennaHeight=3)
+    nmeafile=_mknmea(str(tmp_path/"synthetic.nmea"))
+    with NMEAFile(nmeafile) as nmeaid:
+        nmeaid.set_filter(min_cnr0=25)
+        #the filters of the stream are only changed on request
+        SatArcBuilder(nmeaid,mask)
+        assert nmeaid.filters == {"min_cnr0":25}
+        builder=SatArcBuilder(nmeaid,mask,filterStream=True)
+        builder.pushFilter()
+        assert builder.cmask and nmeaid.filters["min_cnr0"] == builder.mindb
+        assert "Replacing the 'min_cnr0' filter" in caplog.text
+
+def test_arc_expiry():
+    import asyncio
+    import numpy as np
+    from types import SimpleNamespace
+    from gnssr4water.sites.arcbuilder import SatArcBuilder
+    from gnssr4water.sites.skymask import SimpleMask
+    from gnssr4water.gnssrlib import GPSL1
+
+    def cycle(t,prns):
+        n=len(prns)
+        return SimpleNamespace(epoch=t*1000000000,sats_in_view=n,prn=np.array(prns),elevation=np.full(n,30,dtype=np.float32),
+                               azimuth=np.full(n,45,dtype=np.float32),cnr0=np.full(n,40,dtype=np.float32),system=[GPSL1]*n)
+    
+    async def run():
+        builder=SatArcBuilder(None,SimpleMask(6.85,52.22,45,3,elevations=[5,60]),minLengthSec=0,split=False)
+        #PRN 5 is opened first, but is last seen after PRN 3
+        for t in range(20):
+            await builder.append(cycle(t,[5,3] if t < 10 else [5]))
+        await builder.append(cycle(100,[7]))
+        return [builder.arcqueue.get_nowait().prn for _ in range(builder.arcqueue.qsize())]
+    assert asyncio.run(run()) == [3,5]
+
+def test_build_arcs():
+    import asyncio
+    import numpy as np
+    from gnssr4water.sites.arcbuilder import SatArcBuilder
+    from gnssr4water.sites.skymask import SimpleMask
+    from gnssr4water.gnssrlib import GPSL1,iter_cycles
+
+    #synthetic cycles with tracking gaps, low cnr0 values and satellites moving out of the mask
+    rng=np.random.default_rng(7)
+    epoch=np.cumsum(rng.choice([1,1,1,1,30,90],size=2000))*1000000000
+    nsats=rng.integers(0,6,size=len(epoch))
+    nobs=nsats.sum()
+    batch={"epoch":epoch,"offset":np.concatenate([[0],np.cumsum(nsats)]),
+           "prn":np.concatenate([rng.choice(12,size=n,replace=False)+1 for n in nsats]).astype(np.intc),
+           "system":np.full(nobs,GPSL1.code,dtype=np.int8),
+           "cnr0":rng.uniform(5,50,size=nobs).astype(np.float32)}
+    batch["elevation"]=(20+25*np.sin(np.repeat(epoch,nsats)/3.6e12*np.pi+batch["prn"])).astype(np.float32)
+    batch["azimuth"]=((np.repeat(epoch,nsats)/2e10+30*batch["prn"])%360).astype(np.float32)
+    for ky in ["lat","lon","ortho_height","geoid_height"]:
+        batch[ky]=np.zeros(len(epoch))
+
+    def newbuilder():
+        builder=SatArcBuilder(None,SimpleMask(6.85,52.22,45,3,elevations=[3,40]),minLengthSec=5,split=False)
+        builder.arcqueue=asyncio.Queue()
+        return builder
+
+    async def stream():
+        builder=newbuilder()
+        for nmeacycle in iter_cycles(batch):
+            await builder.append(nmeacycle)
+        return [builder.arcqueue.get_nowait() for _ in range(builder.arcqueue.qsize())]
+
+    streamed=asyncio.run(stream())
+    built=newbuilder().build_arcs(batch)
+    assert len(streamed) > 10
+    assert len(built) == len(streamed)
+    for arc,ref in zip(built,streamed):
+        assert arc.prn == ref.prn
+        assert np.array_equal(arc.time,ref.time)
+        assert np.array_equal(arc.elev,ref.elev)
+        assert np.array_equal(arc.cnr0,ref.cnr0)
+
+def test_arc_time():
+    import numpy as np
+    from datetime import datetime,timedelta
+    from gnssr4water.sites.arc import Arc
+    from gnssr4water.gnssrlib import GPSL1
+    t0=datetime(2024,5,1,12)
+    times=[t0+timedelta(seconds=i) for i in range(11)]
+    elev=np.linspace(10,20,11)
+    arc=Arc(3,GPSL1,times,elev,np.full(11,45.0),np.full(11,40.0),refinenmea=False)
+    assert arc.time.dtype == np.dtype("datetime64[ns]")
+    assert arc.centralT == np.datetime64(t0+timedelta(seconds=5),'ns')
+    assert arc.deltaT == np.timedelta64(10,'s')
+    assert not hasattr(arc,"__dict__")
+    #int64 nanoseconds are accepted as well
+    arcns=Arc(3,GPSL1,arc.time.view(np.int64),elev,np.full(11,45.0),np.full(11,40.0),refinenmea=False)
+    assert np.array_equal(arcns.time,arc.time)
+
+def test_arc_split():
+    import numpy as np
+    from gnssr4water.sites.arc import Arc
+    from gnssr4water.refl.waterlevel import WaterLevelArc
+    from gnssr4water.gnssrlib import GPSL1
+    n=600
+    time=np.arange(n)*1000000000
+    #rising and setting satellite, truncated to whole degrees as in nmea
+    elev=np.floor(40-30*((np.arange(n)-300)/300)**2)
+    arc=Arc(5,GPSL1,time,elev,np.floor(np.linspace(100,130,n)),np.full(n,40.0))
+    assert arc.direction == "asc-desc"
+    asc,desc=arc.split()
+    assert asc.direction == "asc" and desc.direction == "desc"
+    assert len(asc)+len(desc) == n
+    #parts are views on the (refined) parent arc
+    for part,sl in ((asc,slice(0,len(asc))),(desc,slice(len(asc),n))):
+        assert np.shares_memory(part.elev,arc.elev)
+        assert np.array_equal(part.elev,arc.elev[sl])
+        assert np.array_equal(part.elevint,arc.elevint[sl])
+    wlarc=WaterLevelArc(desc)
+    assert wlarc.elev is desc.elev and wlarc.time is desc.time
+    assert np.allclose(wlarc.sinelev,np.sin(np.deg2rad(desc.elev)))